@@ -0,0 +1,173 @@
+from dataclasses import dataclass
+from typing import List
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+from typing import Union
+from enum import Enum, auto
+import time
+import warnings
+
+import numpy as np
+import scipy.optimize as so
+
+from compiled_model import CompiledModel
+from regular_grid import RegularGrid
+
+
+# noinspection PyArgumentList
+class FitStatus(Enum):
+    DEFAULT = 0
+    SUCCESS = auto()
+    FAILED = auto()
+    INVALID_DATA = auto()
+    # 評価回数の上限で打ち切った。params は打ち切った時点の値
+    INCOMPLETE = auto()
+
+
+@dataclass
+class FrameFitResult:
+    params: np.ndarray
+    covariance: np.ndarray
+    status: FitStatus
+    chi2: float
+    nfev: int = 0
+    njev: int = 0
+    elapsed: float = 0.0
+    warm_started: bool = False
+    # 通常の初期値から始めた場合と比べた短縮時間の目安 (秒)。ウォームスタートしなかったフレームは NaN
+    time_saved: float = float("nan")
+
+
+@dataclass
+class BatchFitResult:
+    params: np.ndarray
+    covariances: np.ndarray
+    status: np.ndarray
+    chi2: np.ndarray
+    nfev: np.ndarray
+    njev: np.ndarray
+    elapsed: np.ndarray
+    warm_started: np.ndarray
+    time_saved: np.ndarray
+
+    def __len__(self):
+        return len(self.status)
+
+    @classmethod
+    def empty(cls, n_frames: int, n_free: int) -> "BatchFitResult":
+        return cls(
+            params=np.full((n_frames, n_free), np.nan),
+            covariances=np.full((n_frames, n_free, n_free), np.nan),
+            status=np.full(n_frames, FitStatus.DEFAULT.value, dtype=np.int64),
+            chi2=np.full(n_frames, np.nan),
+            nfev=np.zeros(n_frames, dtype=np.int64),
+            njev=np.zeros(n_frames, dtype=np.int64),
+            elapsed=np.zeros(n_frames, dtype=np.float64),
+            warm_started=np.zeros(n_frames, dtype=bool),
+            time_saved=np.full(n_frames, np.nan)
+        )
+
+    @classmethod
+    def concatenate(cls, results: List["BatchFitResult"]) -> "BatchFitResult":
+        return cls(**{name: np.concatenate([getattr(r, name) for r in results])
+                      for name in cls.__dataclass_fields__})
+
+    def set_frame(self, index: int, frame_result: FrameFitResult):
+        self.params[index] = frame_result.params
+        self.covariances[index] = frame_result.covariance
+        self.status[index] = frame_result.status.value
+        self.chi2[index] = frame_result.chi2
+        self.nfev[index] = frame_result.nfev
+        self.njev[index] = frame_result.njev
+        self.elapsed[index] = frame_result.elapsed
+        self.warm_started[index] = frame_result.warm_started
+        self.time_saved[index] = frame_result.time_saved
+
+    def get_success_mask(self) -> np.ndarray:
+        return self.status == FitStatus.SUCCESS.value
+
+
+def fit_frame(model: CompiledModel,
+              raveled_expl: Union[np.ndarray, RegularGrid],
+              raveled_data: np.ndarray,
+              p0: Sequence[float],
+              bounds: Tuple[Sequence[float], Sequence[float]],
+              max_nfev: Optional[int] = None) -> FrameFitResult:
+    n_free = model.get_free_num()
+    failed_params = np.full(n_free, np.nan)
+    failed_cov = np.full((n_free, n_free), np.nan)
+    finite = np.isfinite(raveled_data)
+    if not np.all(finite):
+        # NaN の画素は座標ごと除き、残りの画素でフィットする
+        if np.sum(finite) <= n_free:
+            return FrameFitResult(failed_params, failed_cov, FitStatus.INVALID_DATA, np.nan)
+        if isinstance(raveled_expl, RegularGrid):
+            raveled_expl = raveled_expl.ravel()
+        raveled_expl = raveled_expl[..., finite]
+        raveled_data = raveled_data[finite]
+
+    if max_nfev is not None:
+        return _fit_frame_limited(model, raveled_expl, raveled_data, p0, bounds, max_nfev)
+
+    jac = model.jac if model.has_jac() else None
+    start_nfev, start_njev = model.nfev, model.njev
+    start_time = time.perf_counter()
+    try:
+        with warnings.catch_warnings():
+            # 共分散が推定できない場合の警告はフレーム毎には出さない
+            warnings.simplefilter("ignore", so.OptimizeWarning)
+            opt_para, opt_cov = so.curve_fit(model.f, raveled_expl, raveled_data,
+                                             p0=p0, bounds=bounds, jac=jac)
+    except RuntimeError:
+        return FrameFitResult(failed_params, failed_cov, FitStatus.FAILED, np.nan,
+                              model.nfev - start_nfev, model.njev - start_njev, time.perf_counter() - start_time)
+
+    elapsed = time.perf_counter() - start_time
+    nfev, njev = model.nfev - start_nfev, model.njev - start_njev
+    residual = raveled_data - model.f(raveled_expl, *opt_para)
+    return FrameFitResult(opt_para, opt_cov, FitStatus.SUCCESS, float(np.dot(residual, residual)),
+                          nfev, njev, elapsed)
+
+
+def _fit_frame_limited(model: CompiledModel,
+                       raveled_expl: Union[np.ndarray, RegularGrid],
+                       raveled_data: np.ndarray,
+                       p0: Sequence[float],
+                       bounds: Tuple[Sequence[float], Sequence[float]],
+                       max_nfev: int) -> FrameFitResult:
+    # curve_fit は上限に達すると途中の値を返さないので、同じ trf を least_squares で直接呼ぶ。
+    # 共分散は求めない
+    n_free = model.get_free_num()
+
+    def residual(params: np.ndarray) -> np.ndarray:
+        return model.f(raveled_expl, *params) - raveled_data
+
+    jac = "2-point"
+    if model.has_jac():
+        def jac(params: np.ndarray) -> np.ndarray:
+            return model.jac(raveled_expl, *params)
+
+    start_nfev, start_njev = model.nfev, model.njev
+    start_time = time.perf_counter()
+    try:
+        res = so.least_squares(residual, p0, jac=jac, bounds=bounds, method="trf", max_nfev=max_nfev)
+    except (RuntimeError, ValueError):
+        return FrameFitResult(np.full(n_free, np.nan), np.full((n_free, n_free), np.nan), FitStatus.FAILED, np.nan,
+                              model.nfev - start_nfev, model.njev - start_njev, time.perf_counter() - start_time)
+
+    status = FitStatus.SUCCESS if res.success else FitStatus.INCOMPLETE
+    return FrameFitResult(res.x, np.full((n_free, n_free), np.nan), status, float(2 * res.cost),
+                          model.nfev - start_nfev, model.njev - start_njev, time.perf_counter() - start_time)
+
+
+def fit_frames(model: CompiledModel,
+               raveled_expl: Union[np.ndarray, RegularGrid],
+               frames: np.ndarray,
+               p0: Sequence[float],
+               bounds: Tuple[Sequence[float], Sequence[float]]) -> BatchFitResult:
+    # frames: (n_frames, *frame_shape)。説明変数とモデルは全フレームで共有する
+    result = BatchFitResult.empty(len(frames), model.get_free_num())
+    for index, frame in enumerate(frames):
+        result.set_frame(index, fit_frame(model, raveled_expl, frame.ravel(), p0, bounds))
+    return result
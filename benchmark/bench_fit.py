@@ -0,0 +1,202 @@
+from typing import Optional
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Any
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import scipy
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fit import Fit
+from function_list import FunctionList
+from compiled_model import CompiledModel
+from functions.predefined_functions import Gauss
+from functions.predefined_functions import Constant
+from functions.function_parameters import ParamState
+from utils import data_loader
+import utils.sample_generator as sample_gen
+
+
+# パラメータの状態の組み合わせ。各ガウシアンに同じ設定を適用する
+STATE_CONFIGS = {
+    "free": {},
+    "fixed_theta": {"theta": ParamState.FIX},
+    "depended_sigma": {"sigma_s": ParamState.DEPENDED},
+}
+
+
+def get_machine_info() -> Dict[str, Any]:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ""
+    return {
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "scipy": scipy.__version__,
+        "git_commit": commit,
+        "timestamp": datetime.datetime.now().isoformat(),
+    }
+
+
+def measure(func: Callable[[], Any], repeat: int) -> float:
+    # 最小値を代表値とする
+    elapsed = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed.append(time.perf_counter() - start)
+    return min(elapsed)
+
+
+def build_problem(size: int, n_components: int, state_config: str, noise: float, seed: int):
+    x_mesh, y_mesh, data, truth = sample_gen.gen_2d_multi_gaussian(size, n_components, noise, 10.0, seed)
+    fl = FunctionList()
+    for _ in range(n_components):
+        fl.add_func(Gauss)
+    fl.add_func(Constant)
+
+    rng = np.random.default_rng(seed + 1)
+    for func, params in zip(fl.get_functions(), truth):
+        for param in func.parameters:
+            # 真値から少しずらした値を初期値にする
+            param.value = params[param.name] * rng.uniform(0.9, 1.1)
+            state = STATE_CONFIGS[state_config].get(param.name, ParamState.FREE)
+            param.state = state
+            if state is ParamState.DEPENDED:
+                param.set_dependency("sigma_l", params["sigma_s"] / params["sigma_l"])
+    fl.get_functions()[-1].parameters[0].value = 9.0
+    fl.apply_dim()
+    return Fit(data, fl, (x_mesh, y_mesh)), data
+
+
+def bench_case(size: int, n_components: int, state_config: str, noise: float,
+               repeat: int, seed: int, threads: int = 1) -> Dict[str, Any]:
+    fitter, data = build_problem(size, n_components, state_config, noise, seed)
+    fitter.eval_options.threads = threads
+    raveled_expl = fitter.get_raveled_explanatory()
+    p0 = fitter.fl.get_values()
+    model = CompiledModel(fitter.fl, fitter.eval_options)
+
+    record: Dict[str, Any] = {
+        "size": size,
+        "pixels": int(data.size),
+        "components": n_components,
+        "state_config": state_config,
+        "noise": noise,
+        "threads": threads,
+        "free_params": len(p0),
+        "fixed_params": sum(p.state is ParamState.FIX for f in fitter.fl.get_functions() for p in f.parameters),
+        "depended_params": sum(p.state is ParamState.DEPENDED
+                               for f in fitter.fl.get_functions() for p in f.parameters),
+    }
+    record["function_list_f"] = measure(lambda: fitter.fl.f(raveled_expl, *p0), repeat)
+    record["compiled_f"] = measure(lambda: model.f(raveled_expl, *p0), repeat)
+    if model.has_jac():
+        record["compiled_jac"] = measure(lambda: model.jac(raveled_expl, *p0), repeat)
+
+    start = time.perf_counter()
+    try:
+        fitter.curve_fit()
+        record["curve_fit_status"] = "SUCCESS"
+    except RuntimeError:
+        record["curve_fit_status"] = "FAILED"
+    record["curve_fit"] = time.perf_counter() - start
+    fitter.fl.set_values(*p0)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        npy_path = os.path.join(tmp_dir, "data.npy")
+        csv_path = os.path.join(tmp_dir, "data.csv")
+        np.save(npy_path, data)
+        np.savetxt(csv_path, data, delimiter=",")
+        record["load_npy"] = measure(lambda: np.array(data_loader.load_data(npy_path)[0]), repeat)
+        record["load_csv"] = measure(lambda: data_loader.load_data(csv_path)[0], 1)
+    return record
+
+
+def scaling_curve(records: List[Dict[str, Any]], x_key: str, fixed: Dict[str, Any], y_key: str) -> List[List[float]]:
+    curve = []
+    for record in records:
+        if all(record[k] == v for k, v in fixed.items()) and (y_key in record):
+            curve.append([record[x_key], record[y_key]])
+    return sorted(curve)
+
+
+def plot_scaling(scaling: Dict[str, Dict[str, List[List[float]]]], path: str):
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    plt.figure(figsize=(10, 4))
+    for index, (x_key, curves) in enumerate(scaling.items()):
+        plt.subplot(1, len(scaling), index + 1)
+        for y_key, curve in curves.items():
+            if len(curve) == 0:
+                continue
+            arr = np.array(curve)
+            plt.loglog(arr[:, 0], arr[:, 1], "o-", label=y_key)
+        plt.xlabel(x_key)
+        plt.ylabel("time [s]")
+        plt.legend()
+    plt.tight_layout()
+    plt.savefig(path)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Benchmark the fit pipeline on synthetic data.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[64, 128, 256, 512])
+    parser.add_argument("--components", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--states", nargs="+", default=["free"], choices=list(STATE_CONFIGS.keys()))
+    parser.add_argument("--noise", type=float, nargs="+", default=[0.5])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--threads", type=int, default=1, help="Evaluate the model in tiles on this many threads")
+    parser.add_argument("-o", "--output", default="bench_result.json")
+    parser.add_argument("--plot", help="Save scaling curves to this image file")
+    args = parser.parse_args(argv)
+
+    base_size, base_components = args.sizes[0], args.components[0]
+    records = []
+    for state_config in args.states:
+        for noise in args.noise:
+            cases = [(size, base_components) for size in args.sizes]
+            cases += [(base_size, k) for k in args.components if k != base_components]
+            for size, n_components in cases:
+                record = bench_case(size, n_components, state_config, noise, args.repeat, args.seed, args.threads)
+                records.append(record)
+                print("size={size:<6d} components={components:<4d} states={state_config:<15s} "
+                      "f={compiled_f:.4g}s curve_fit={curve_fit:.4g}s".format(**record))
+
+    fixed = {"state_config": args.states[0], "noise": args.noise[0]}
+    y_keys = ["function_list_f", "compiled_f", "compiled_jac", "curve_fit", "load_npy", "load_csv"]
+    scaling = {
+        "pixels": {y: scaling_curve(records, "pixels", dict(fixed, components=base_components), y) for y in y_keys},
+        "components": {y: scaling_curve(records, "components", dict(fixed, size=base_size), y) for y in y_keys},
+    }
+
+    with open(args.output, "w") as file:
+        json.dump({"machine": get_machine_info(), "records": records, "scaling": scaling}, file, indent=2)
+    print("saved: {}".format(args.output))
+
+    if args.plot is not None:
+        plot_scaling(scaling, args.plot)
+        print("saved: {}".format(args.plot))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+from typing import Optional
+from typing import Iterator
+from typing import Tuple
+from typing import Union
+
+import numpy as np
+
+from function_list import ExplanatoryType
+from regular_grid import RegularGrid
+
+
+class ChunkSource:
+    # データを先頭の軸で chunk_size 画素程度の塊に分けて、(塊の説明変数, 塊のデータ (1-D, float64)) を順に返す。
+    # np.memmap のデータは塊毎にだけ読み込むので、全画素を同時にメモリに載せない。
+    # マスクで除いた画素と NaN の画素は塊毎に取り除く
+    DEFAULT_CHUNK_SIZE = 262144
+
+    def __init__(self, explanatory: Union[ExplanatoryType, np.ndarray], data: np.ndarray, dim: int,
+                 valid: Optional[np.ndarray] = None, chunk_size: int = DEFAULT_CHUNK_SIZE):
+        if (dim == 2) and isinstance(explanatory, np.ndarray):
+            # 詰めた (2, 画素数) の座標
+            explanatory = (explanatory[0], explanatory[1])
+        if isinstance(explanatory, RegularGrid) and (np.ndim(data) == 1):
+            data = data.reshape(explanatory.shape)
+        self.explanatory = explanatory
+        self.data = data
+        self.dim = dim
+        self.valid = valid
+        self.chunk_size = chunk_size
+
+    def __iter__(self) -> Iterator[Tuple[ExplanatoryType, np.ndarray]]:
+        shape = self.data.shape
+        row_size = int(np.prod(shape[1:]))
+        rows_per_chunk = max(self.chunk_size // max(row_size, 1), 1)
+        for begin in range(0, shape[0], rows_per_chunk):
+            rows = slice(begin, min(begin + rows_per_chunk, shape[0]))
+            chunk_data = np.asarray(self.data[rows], dtype=np.float64)
+            chunk_expl = self._slice_explanatory(rows, shape)
+            chunk_valid = np.isfinite(chunk_data)
+            if self.valid is not None:
+                chunk_valid &= np.asarray(self.valid[rows], dtype=bool)
+            if np.all(chunk_valid):
+                yield chunk_expl, chunk_data.ravel()
+                continue
+            if not np.any(chunk_valid):
+                continue
+            if self.dim == 1:
+                yield np.asarray(chunk_expl)[chunk_valid], chunk_data[chunk_valid]
+                continue
+            x, y = np.broadcast_arrays(chunk_expl[0], chunk_expl[1])
+            yield (x[chunk_valid], y[chunk_valid]), chunk_data[chunk_valid]
+
+    def _slice_explanatory(self, rows: slice, shape: Tuple[int, ...]) -> ExplanatoryType:
+        if self.dim == 1:
+            return np.asarray(self.explanatory[rows], dtype=np.float64)
+        if isinstance(self.explanatory, RegularGrid):
+            return RegularGrid(self.explanatory.x_axis, self.explanatory.y_axis[rows])
+        # broadcasting で先頭の軸を持たない配列はそのまま使う
+        return tuple(np.asarray(arr[rows], dtype=np.float64)
+                     if (np.ndim(arr) == len(shape)) and (np.shape(arr)[0] == shape[0]) else arr
+                     for arr in self.explanatory)
@@ -0,0 +1,514 @@
+from dataclasses import dataclass
+from typing import Optional
+from typing import List
+from typing import Dict
+from typing import Tuple
+from typing import Type
+from typing import Union
+from typing import Iterator
+from typing import Callable
+from typing import Any
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+
+import numpy as np
+from scipy import sparse
+
+from function_list import FunctionList
+from function_list import ExplanatoryType
+from regular_grid import RegularGrid
+from pixel_index import PixelIndex
+from pixel_index import GridIndex
+from pixel_index import build_pixel_index
+from param_mapping import ParamMapping
+from functions.base_function import BaseFunction
+from fit_stats import EvalTimer
+from eval_cache import EvalCache
+from base_exceptions import FitterException
+
+
+@dataclass
+class EvaluationOptions:
+    # None の場合は打ち切らずに全画素で評価する
+    truncate_sigma: Optional[float] = None
+    # モデル評価の精度。ヤコビアンと残差は常に float64 で扱う
+    dtype: type = np.float64
+    # 作業領域を評価間で使い回す
+    reuse_buffers: bool = False
+    # 同じパラメータでの評価結果を保持する数 (0 で無効)
+    cache_entries: int = 2
+    # 関数毎の寄与を保持する数 (0 で無効)。数値微分のように一部の関数のパラメータだけが変わる評価で効く。
+    # 変数射影と multistart では数値微分の場合に Fit が設定する
+    component_cache_entries: int = 0
+    # 2 以上の場合、画素を tile_size 画素程度のタイルに分けてスレッドで並列に評価する。
+    # 窓で打ち切る評価 (truncate_sigma) と関数毎のキャッシュを使う評価は逐次のまま
+    threads: int = 1
+    tile_size: int = 65536
+
+
+# スレッド数毎のスレッドプール。フィットを跨いで使い回す
+_THREAD_POOLS: Dict[int, ThreadPoolExecutor] = {}
+_THREAD_POOLS_LOCK = threading.Lock()
+
+
+def _get_thread_pool(threads: int) -> ThreadPoolExecutor:
+    with _THREAD_POOLS_LOCK:
+        pool = _THREAD_POOLS.get(threads)
+        if pool is None:
+            pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="tile")
+            _THREAD_POOLS[threads] = pool
+        return pool
+
+
+class CompiledModel:
+    # FunctionList をフィット開始前に一度だけ解析し、自由パラメータのベクトルから
+    # 各関数の全パラメータへの写像をインデックス配列として保持する。
+    # 評価時には FuncParameter を一切書き換えない。
+    def __init__(self, function_list: FunctionList, options: Optional[EvaluationOptions] = None):
+        if options is None:
+            options = EvaluationOptions()
+        self.options = options
+        # 評価回数 (フィットの反復回数の目安)
+        self.nfev = 0
+        self.njev = 0
+        # 設定した場合のみ評価時間を計測する
+        self.timer: Optional[EvalTimer] = None
+        self._pixel_index: Optional[Union[PixelIndex, GridIndex]] = None
+        self._pixel_index_key: Optional[tuple] = None
+        # キーにアドレスを使うので、元の配列は索引と同じ間だけ保持しておく
+        self._pixel_index_source: Optional[ExplanatoryType] = None
+        self._cast_expl: Optional[ExplanatoryType] = None
+        self._cast_expl_key: Optional[tuple] = None
+        self._cast_expl_source: Optional[ExplanatoryType] = None
+        self._scratch: List[np.ndarray] = []
+        # タイル毎の評価で使うスレッド毎の作業領域
+        self._thread_scratch = threading.local()
+        self._cache: Optional[EvalCache] = None
+        if options.cache_entries > 0:
+            self._cache = EvalCache(options.cache_entries)
+        self._component_cache: Optional[EvalCache] = None
+        if options.component_cache_entries > 0:
+            self._component_cache = EvalCache(options.component_cache_entries)
+
+        dim, msg = function_list.apply_dim()
+        if dim not in [1, 2]:
+            raise FitterException(msg)
+        self.dim = dim
+
+        self._func_types: List[Type[BaseFunction]] = [type(func) for func in function_list.get_functions()]
+        mapping = ParamMapping(function_list.get_functions())
+        self._slices = mapping.slices
+        self._base_values = mapping.base_values
+        self._free_index = mapping.free_index
+        self._dep_index = mapping.dep_index
+        self._dep_root_index = mapping.dep_root_index
+        self._dep_coef = mapping.dep_coef
+        self._dep_offset = mapping.dep_offset
+        self._jac_entries = self._build_jac_entries()
+        self._groups = self._build_groups()
+        self._scratch_num = max([func_type.SCRATCH_NUM for func_type in self._func_types] + [0])
+
+    def _build_groups(self) -> List[Tuple[Type[BaseFunction], np.ndarray]]:
+        # 同じ型の関数をまとめ、(K, パラメータ数) の全パラメータ内インデックスを保持する
+        group_rows: Dict[Type[BaseFunction], List[List[int]]] = {}
+        for func_type, sl in zip(self._func_types, self._slices):
+            group_rows.setdefault(func_type, []).append(list(range(sl.start, sl.stop)))
+        return [(func_type, np.array(rows, dtype=np.int64)) for func_type, rows in group_rows.items()]
+
+    def _build_jac_entries(self) -> List[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        # 各関数の (全パラメータ内の行, 自由パラメータの列, 係数) の組。
+        # DEPENDED と GLOBAL_DEPENDED は依存元が FREE の場合のみ連鎖律で寄与する (依存元は他の関数でもよい)。
+        free_col = {int(full): col for col, full in enumerate(self._free_index)}
+        rows: List[List[int]] = [[] for _ in self._slices]
+        cols: List[List[int]] = [[] for _ in self._slices]
+        coefs: List[List[float]] = [[] for _ in self._slices]
+
+        def append(full_index: int, col: int, coef: float):
+            for func_index, sl in enumerate(self._slices):
+                if sl.start <= full_index < sl.stop:
+                    rows[func_index].append(full_index - sl.start)
+                    cols[func_index].append(col)
+                    coefs[func_index].append(coef)
+                    return
+
+        for full_index, col in free_col.items():
+            append(full_index, col, 1.0)
+        for full_index, root, coef in zip(self._dep_index, self._dep_root_index, self._dep_coef):
+            if int(root) in free_col:
+                append(int(full_index), free_col[int(root)], float(coef))
+
+        return [(np.array(r, dtype=np.int64), np.array(c, dtype=np.int64), np.array(k, dtype=np.float64))
+                for r, c, k in zip(rows, cols, coefs)]
+
+    def __len__(self):
+        return len(self._func_types)
+
+    def get_free_num(self) -> int:
+        return len(self._free_index)
+
+    def get_all_num(self) -> int:
+        return len(self._base_values)
+
+    def expand(self, free_values: np.ndarray) -> np.ndarray:
+        full_values = self._base_values.copy()
+        full_values[self._free_index] = free_values
+        full_values[self._dep_index] = full_values[self._dep_root_index] * self._dep_coef + self._dep_offset
+        return full_values
+
+    def f_full(self, explanatory: ExplanatoryType, full_values: np.ndarray) -> np.ndarray:
+        # キャッシュした配列を返すことがあるので、戻り値は書き込み不可にしている。
+        # options.dtype が float32 でも加算までを float32 で行い、戻り値は float64 にする
+        if self._cache is None:
+            return self._evaluate(explanatory, full_values).astype(np.float64, copy=False)
+        key = (self._get_array_key(explanatory), full_values.tobytes())
+        out = self._cache.get(key)
+        if out is None:
+            out = self._evaluate(explanatory, full_values).astype(np.float64, copy=False)
+            out.setflags(write=False)
+            self._cache.put(key, out, explanatory)
+        return out
+
+    def clear_cache(self):
+        for cache in [self._cache, self._component_cache]:
+            if cache is not None:
+                cache.clear()
+
+    def _evaluate(self, explanatory: ExplanatoryType, full_values: np.ndarray) -> np.ndarray:
+        # 窓の索引は元の座標で作り、全画素の評価だけを options.dtype の座標で行う
+        shape = self._get_shape(explanatory)
+        out = np.zeros(shape, dtype=self.options.dtype)
+        pixel_index = self._get_pixel_index(explanatory)
+        cast_expl = self._cast_explanatory(explanatory)
+        scratch = self._get_scratch(shape)
+        if self._component_cache is not None:
+            self._add_components(explanatory, full_values, cast_expl, pixel_index, scratch, out)
+            return out
+        if self._use_tiles(shape, pixel_index):
+            start = time.perf_counter()
+            self._run_tiles(self._f_tile, cast_expl, shape, full_values, out)
+            if self.timer is not None:
+                self.timer.add_component_time("tiles", start)
+            return out
+
+        for func_type, rows in self._groups:
+            if self.timer is None:
+                self._f_group(func_type, full_values[rows], cast_expl, pixel_index, scratch, out)
+                continue
+            start = time.perf_counter()
+            self._f_group(func_type, full_values[rows], cast_expl, pixel_index, scratch, out)
+            self.timer.add_component_time(func_type.name(), start)
+        return out
+
+    def _add_components(self, explanatory: ExplanatoryType, full_values: np.ndarray, cast_expl: ExplanatoryType,
+                        pixel_index: Optional[Union[PixelIndex, GridIndex]], scratch: Optional[List[np.ndarray]],
+                        out: np.ndarray):
+        # 関数毎に (画素, 寄与) を保持し、パラメータの変わった関数だけを評価し直す。画素が None なら全画素
+        expl_key = self._get_array_key(explanatory)
+        flat_out = out.reshape(-1)
+        for index in range(len(self._func_types)):
+            pixels, component_out = self._get_component(index, expl_key, explanatory, full_values, cast_expl,
+                                                        pixel_index, scratch, out)
+            if pixels is None:
+                out += component_out
+            else:
+                flat_out[pixels] += component_out
+
+    def _get_component(self, index: int, expl_key: tuple, explanatory: ExplanatoryType, full_values: np.ndarray,
+                       cast_expl: ExplanatoryType, pixel_index: Optional[Union[PixelIndex, GridIndex]],
+                       scratch: Optional[List[np.ndarray]],
+                       out: np.ndarray) -> Tuple[Optional[np.ndarray], np.ndarray]:
+        func_type, values = self._func_types[index], full_values[self._slices[index]]
+        key = (expl_key, index, values.tobytes())
+        contribution = self._component_cache.get(key)
+        if contribution is None:
+            start = time.perf_counter()
+            contribution = self._evaluate_component(func_type, values, cast_expl, pixel_index, scratch, out)
+            if self.timer is not None:
+                self.timer.add_component_time(func_type.name(), start)
+            self._component_cache.put(key, contribution, explanatory)
+        return contribution
+
+    def _evaluate_component(self, func_type: Type[BaseFunction], values: np.ndarray, explanatory: ExplanatoryType,
+                            pixel_index: Optional[Union[PixelIndex, GridIndex]],
+                            scratch: Optional[List[np.ndarray]],
+                            out: np.ndarray) -> Tuple[Optional[np.ndarray], np.ndarray]:
+        if pixel_index is not None:
+            window = func_type.window_from_values(values, self.options.truncate_sigma)
+            if window is not None:
+                pixels = pixel_index.query(*window)
+                return pixels, np.asarray(func_type.f_from_values(pixel_index.take(pixels), values), dtype=out.dtype)
+        component_out = np.zeros(out.shape, dtype=out.dtype)
+        return None, func_type.f_batch(explanatory, values[np.newaxis], component_out, scratch)
+
+    def f_components(self, explanatory: ExplanatoryType, full_values: np.ndarray) -> np.ndarray:
+        # 関数毎の寄与を列に並べる (shape: (画素数, 関数の数))。関数毎のキャッシュがあれば使う
+        shape = self._get_shape(explanatory)
+        columns = np.zeros((int(np.prod(shape)), len(self._func_types)), dtype=np.float64)
+        pixel_index = self._get_pixel_index(explanatory)
+        cast_expl = self._cast_explanatory(explanatory)
+        scratch = self._get_scratch(shape)
+        out = np.empty(shape, dtype=self.options.dtype)
+        expl_key = self._get_array_key(explanatory) if self._component_cache is not None else None
+        for index, (func_type, sl) in enumerate(zip(self._func_types, self._slices)):
+            if self._component_cache is not None:
+                pixels, component = self._get_component(index, expl_key, explanatory, full_values, cast_expl,
+                                                        pixel_index, scratch, out)
+            else:
+                pixels, component = self._evaluate_component(func_type, full_values[sl], cast_expl, pixel_index,
+                                                             scratch, out)
+            if pixels is None:
+                columns[:, index] = component.reshape(-1)
+            else:
+                columns[pixels, index] = component
+        return columns
+
+    def get_linear_columns(self) -> Tuple[np.ndarray, np.ndarray]:
+        # 線形パラメータ (LINEAR_PARAM_INDEX) が FREE で、他のパラメータの依存元でもない関数について
+        # (関数の番号, 自由パラメータの列) を返す
+        free_col = {int(full): col for col, full in enumerate(self._free_index)}
+        dep_roots = set(int(root) for root in self._dep_root_index)
+        components, cols = [], []
+        for index, (func_type, sl) in enumerate(zip(self._func_types, self._slices)):
+            if func_type.LINEAR_PARAM_INDEX is None:
+                continue
+            full_index = sl.start + func_type.LINEAR_PARAM_INDEX
+            if (full_index in free_col) and (full_index not in dep_roots):
+                components.append(index)
+                cols.append(free_col[full_index])
+        return np.array(components, dtype=np.int64), np.array(cols, dtype=np.int64)
+
+    def _f_group(self, func_type: Type[BaseFunction], values: np.ndarray, explanatory: ExplanatoryType,
+                 pixel_index: Optional[Union[PixelIndex, GridIndex]], scratch: Optional[List[np.ndarray]], out: np.ndarray):
+        if pixel_index is None:
+            func_type.f_batch(explanatory, values, out, scratch)
+            return
+
+        unwindowed = []
+        flat_out = out.reshape(-1)
+        for value in values:
+            window = func_type.window_from_values(value, self.options.truncate_sigma)
+            if window is None:
+                unwindowed.append(value)
+                continue
+            pixels = pixel_index.query(*window)
+            if len(pixels) > 0:
+                flat_out[pixels] += func_type.f_from_values(pixel_index.take(pixels), value)
+        if len(unwindowed) > 0:
+            func_type.f_batch(explanatory, np.array(unwindowed), out, scratch)
+
+    def _cast_explanatory(self, explanatory: ExplanatoryType) -> ExplanatoryType:
+        if self.options.dtype == np.float64:
+            return explanatory
+
+        # 同じ配列の変換結果は使い回す
+        key = self._get_array_key(explanatory)
+        if key != self._cast_expl_key:
+            if self.dim == 1:
+                self._cast_expl = np.asarray(explanatory, dtype=self.options.dtype)
+            else:
+                self._cast_expl = tuple(np.asarray(arr, dtype=self.options.dtype) for arr in explanatory)
+            self._cast_expl_key = key
+            self._cast_expl_source = explanatory
+        return self._cast_expl
+
+    def _get_scratch(self, shape: Tuple[int, ...]) -> Optional[List[np.ndarray]]:
+        if (not self.options.reuse_buffers) or (self._scratch_num == 0):
+            return None
+        if (len(self._scratch) == 0) or (self._scratch[0].shape != shape) \
+                or (self._scratch[0].dtype != self.options.dtype):
+            self._scratch = [np.empty(shape, dtype=self.options.dtype) for _ in range(self._scratch_num)]
+        return self._scratch
+
+    def _get_thread_scratch(self, shape: Tuple[int, ...]) -> Optional[List[np.ndarray]]:
+        if (not self.options.reuse_buffers) or (self._scratch_num == 0):
+            return None
+        buffers = getattr(self._thread_scratch, "buffers", None)
+        if (buffers is None) or (buffers[0].shape != shape) or (buffers[0].dtype != self.options.dtype):
+            buffers = [np.empty(shape, dtype=self.options.dtype) for _ in range(self._scratch_num)]
+            self._thread_scratch.buffers = buffers
+        return buffers
+
+    def _use_tiles(self, shape: Tuple[int, ...], pixel_index: Optional[Union[PixelIndex, GridIndex]]) -> bool:
+        return (self.options.threads > 1) and (pixel_index is None) and (int(np.prod(shape)) > self.options.tile_size)
+
+    def _split_tiles(self, explanatory: ExplanatoryType,
+                     shape: Tuple[int, ...]) -> List[Tuple[slice, ExplanatoryType, Tuple[int, ...]]]:
+        # 先頭の軸で (行の範囲, タイルの説明変数, タイルの shape) に分ける。
+        # 行優先で並んでいるので、行の範囲はそのまま平坦化した画素の連続した範囲になる
+        row_size = int(np.prod(shape[1:]))
+        rows_per_tile = max(self.options.tile_size // max(row_size, 1), 1)
+        tiles = []
+        for begin in range(0, shape[0], rows_per_tile):
+            rows = slice(begin, min(begin + rows_per_tile, shape[0]))
+            if self.dim == 1:
+                tile_expl = explanatory[rows]
+            elif isinstance(explanatory, RegularGrid):
+                tile_expl = RegularGrid(explanatory.x_axis, explanatory.y_axis[rows])
+            else:
+                # broadcasting で先頭の軸を持たない配列はそのまま使う
+                tile_expl = tuple(arr[rows] if (np.ndim(arr) == len(shape)) and (np.shape(arr)[0] == shape[0])
+                                  else arr for arr in explanatory)
+            tiles.append((rows, tile_expl, (rows.stop - rows.start,) + tuple(shape[1:])))
+        return tiles
+
+    def _run_tiles(self, task: Callable[[ExplanatoryType, Tuple[int, ...], np.ndarray, slice, Any], None],
+                   explanatory: ExplanatoryType, shape: Tuple[int, ...], full_values: np.ndarray, out: Any):
+        # 各タイルは out の互いに重ならない範囲だけに書き込む
+        pool = _get_thread_pool(self.options.threads)
+        row_size = int(np.prod(shape[1:]))
+        futures = []
+        for rows, tile_expl, tile_shape in self._split_tiles(explanatory, shape):
+            pixels = slice(rows.start * row_size, rows.stop * row_size)
+            futures.append(pool.submit(task, tile_expl, tile_shape, full_values, pixels, out))
+        for future in futures:
+            future.result()
+
+    def _f_tile(self, explanatory: ExplanatoryType, shape: Tuple[int, ...], full_values: np.ndarray,
+                pixels: slice, out: np.ndarray):
+        tile_out = out.reshape(-1)[pixels].reshape(shape)
+        scratch = self._get_thread_scratch(shape)
+        for func_type, rows in self._groups:
+            func_type.f_batch(explanatory, full_values[rows], tile_out, scratch)
+
+    def _jac_tile(self, explanatory: ExplanatoryType, shape: Tuple[int, ...], full_values: np.ndarray,
+                  pixels: slice, jac: np.ndarray):
+        size = int(np.prod(shape))
+        for func_type, sl, (rows, cols, coefs) in zip(self._func_types, self._slices, self._jac_entries):
+            if len(rows) == 0:
+                continue
+            values = full_values[sl]
+            sub_jac = func_type.jac_from_values(explanatory, values).reshape(len(values), size)
+            for row, col, coef in zip(rows, cols, coefs):
+                jac[pixels, col] += coef * sub_jac[row]
+
+    def has_jac(self) -> bool:
+        return all(func_type.has_jac() for func_type in self._func_types)
+
+    def jac_full(self, explanatory: ExplanatoryType, full_values: np.ndarray) -> np.ndarray:
+        # 自由パラメータについてのヤコビアン (shape: (画素数, n_free))
+        shape = self._get_shape(explanatory)
+        size = int(np.prod(shape))
+        jac = np.zeros((size, self.get_free_num()), dtype=np.float64)
+        if self._use_tiles(shape, self._get_pixel_index(explanatory)):
+            self._run_tiles(self._jac_tile, explanatory, shape, full_values, jac)
+            return jac
+        for pixels, col, column in self._iter_jac_columns(explanatory, full_values, size):
+            if pixels is None:
+                jac[:, col] += column
+            else:
+                # 窓の外は 0 のまま
+                jac[pixels, col] += column
+        return jac
+
+    def jac_sparse_full(self, explanatory: ExplanatoryType, full_values: np.ndarray,
+                        window_sigma: Optional[float] = None) -> sparse.csr_matrix:
+        # jac_full と同じ値を疎行列で返す。窓で打ち切った関数の列は窓内の画素だけを持つ。
+        # truncate_sigma が無い場合は window_sigma の窓で列だけを打ち切る (f は打ち切らない)
+        size = int(np.prod(self._get_shape(explanatory)))
+        if self.options.truncate_sigma is not None:
+            window_sigma = self.options.truncate_sigma
+        rows, cols, data = [], [], []
+        for pixels, col, column in self._iter_jac_columns(explanatory, full_values, size, window_sigma):
+            rows.append(np.arange(size) if pixels is None else pixels)
+            cols.append(np.full(len(column), col, dtype=np.int64))
+            data.append(column)
+        if len(data) == 0:
+            return sparse.csr_matrix((size, self.get_free_num()), dtype=np.float64)
+        # 同じ要素への寄与 (DEPENDED) は足し合わされる
+        return sparse.coo_matrix((np.concatenate(data), (np.concatenate(rows), np.concatenate(cols))),
+                                 shape=(size, self.get_free_num())).tocsr()
+
+    def _iter_jac_columns(self, explanatory: ExplanatoryType, full_values: np.ndarray, size: int,
+                          window_sigma: Optional[float] = None) -> Iterator[Tuple[Optional[np.ndarray], int, np.ndarray]]:
+        # (画素, 自由パラメータの列, 値) を関数毎に返す。画素が None なら全画素。
+        # 窓の幅は window_sigma、省略した場合は truncate_sigma
+        if window_sigma is None:
+            window_sigma = self.options.truncate_sigma
+        pixel_index = self._get_pixel_index(explanatory, window_sigma)
+        for func_type, sl, (rows, cols, coefs) in zip(self._func_types, self._slices, self._jac_entries):
+            if len(rows) == 0:
+                continue
+            values = full_values[sl]
+
+            window = None
+            if pixel_index is not None:
+                window = func_type.window_from_values(values, window_sigma)
+            if window is None:
+                sub_jac = func_type.jac_from_values(explanatory, values).reshape(len(values), size)
+                for row, col, coef in zip(rows, cols, coefs):
+                    yield None, col, coef * sub_jac[row]
+                continue
+
+            pixels = pixel_index.query(*window)
+            if len(pixels) == 0:
+                continue
+            sub_jac = func_type.jac_from_values(pixel_index.take(pixels), values).reshape(len(values), len(pixels))
+            for row, col, coef in zip(rows, cols, coefs):
+                yield pixels, col, coef * sub_jac[row]
+
+    def jac(self, *args) -> np.ndarray:
+        # scipy.optimize.curve_fit の jac 引数用
+        return self._jac(self.jac_full, args)
+
+    def jac_sparse(self, *args, window_sigma: Optional[float] = None) -> sparse.csr_matrix:
+        return self._jac(self.jac_sparse_full, args, window_sigma)
+
+    def _jac(self, jac_full: Callable[..., Any], args: tuple, *jac_args):
+        self.njev += 1
+        if self.timer is None:
+            full_values = self.expand(np.array(args[1:], dtype=np.float64))
+            return jac_full(self.to_explanatory(args[0]), full_values, *jac_args)
+
+        self.timer.njev += 1
+        start = time.perf_counter()
+        full_values = self.expand(np.array(args[1:], dtype=np.float64))
+        self.timer.assign_time += time.perf_counter() - start
+        start = time.perf_counter()
+        jac = jac_full(self.to_explanatory(args[0]), full_values, *jac_args)
+        self.timer.jac_time += time.perf_counter() - start
+        return jac
+
+    def f(self, *args) -> np.ndarray:
+        # FunctionList.f と同じ呼び出し規約 (scipy.optimize.curve_fit 用)
+        self.nfev += 1
+        if self.timer is None:
+            full_values = self.expand(np.array(args[1:], dtype=np.float64))
+            return self.f_full(self.to_explanatory(args[0]), full_values).reshape(-1)
+
+        self.timer.nfev += 1
+        start = time.perf_counter()
+        full_values = self.expand(np.array(args[1:], dtype=np.float64))
+        self.timer.assign_time += time.perf_counter() - start
+        return self.f_full(self.to_explanatory(args[0]), full_values).reshape(-1)
+
+    def to_explanatory(self, raveled_expl: Union[np.ndarray, RegularGrid]) -> ExplanatoryType:
+        if (self.dim == 1) or isinstance(raveled_expl, RegularGrid):
+            return raveled_expl
+        return raveled_expl[0], raveled_expl[1]
+
+    def _get_pixel_index(self, explanatory: ExplanatoryType,
+                         n_sigma: Optional[float] = None) -> Optional[Union[PixelIndex, GridIndex]]:
+        # n_sigma を省略した場合は truncate_sigma の窓で評価する時だけ索引を作る
+        if n_sigma is None:
+            n_sigma = self.options.truncate_sigma
+        if (n_sigma is None) or (self.dim != 2):
+            return None
+
+        # 同じ配列に対する索引は使い回す
+        key = self._get_array_key(explanatory)
+        if key != self._pixel_index_key:
+            self._pixel_index = build_pixel_index(explanatory)
+            self._pixel_index_key = key
+            self._pixel_index_source = explanatory
+        return self._pixel_index
+
+    def _get_array_key(self, explanatory: ExplanatoryType) -> tuple:
+        arrays = [explanatory] if self.dim == 1 else explanatory
+        return tuple((arr.__array_interface__["data"][0], arr.shape, arr.strides, arr.dtype.str)
+                     for arr in map(np.asarray, arrays))
+
+    def _get_shape(self, explanatory: ExplanatoryType) -> Tuple[int, ...]:
+        if self.dim == 1:
+            return np.shape(explanatory)
+        return np.broadcast(explanatory[0], explanatory[1]).shape
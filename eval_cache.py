@@ -0,0 +1,67 @@
+from collections import OrderedDict
+from typing import Optional
+from typing import Hashable
+from typing import Any
+
+import numpy as np
+
+
+class EvalCache:
+    # 評価結果の LRU キャッシュ。エントリ数と保持する配列の合計バイト数の両方で制限する
+    DEFAULT_MAX_BYTES = 256 * 1024 ** 2
+
+    def __init__(self, max_entries: int, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._sizes: "OrderedDict[Hashable, int]" = OrderedDict()
+        self._keep_alive: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._total_bytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        value = self._entries.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self._sizes.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key: Hashable, value: Any, keep_alive: Any = None):
+        # keep_alive にはキーに含めたアドレスの配列を渡し、エントリがある間に別の配列が同じアドレスを使わないようにする
+        size = self._get_nbytes(value)
+        if (self.max_entries <= 0) or (size > self.max_bytes):
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = value
+        self._sizes[key] = size
+        self._keep_alive[key] = keep_alive
+        self._total_bytes += size
+        while (len(self._entries) > self.max_entries) or (self._total_bytes > self.max_bytes):
+            self._remove(next(iter(self._entries)))
+
+    def clear(self):
+        self._entries.clear()
+        self._sizes.clear()
+        self._keep_alive.clear()
+        self._total_bytes = 0
+
+    def _remove(self, key: Hashable):
+        del self._entries[key]
+        del self._keep_alive[key]
+        self._total_bytes -= self._sizes.pop(key)
+
+    @staticmethod
+    def _get_nbytes(value: Any) -> int:
+        if isinstance(value, np.ndarray):
+            return value.nbytes
+        if isinstance(value, tuple):
+            return sum(EvalCache._get_nbytes(v) for v in value)
+        return 0
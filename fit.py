@@ -1,20 +1,80 @@
 from typing import Optional
 from typing import List
+from typing import Dict
 from typing import Tuple
+from typing import Union
+import cProfile
+import dataclasses
+import functools
+import time
 
 import numpy as np
-import scipy.optimize as so
 
 from functions.gen_function_list import FUNCTION_MAP
 from function_list import FunctionList
 from function_list import ExplanatoryType
+from compiled_model import CompiledModel
+from compiled_model import EvaluationOptions
+from batch_fit import BatchFitResult
+from batch_fit import fit_frame
+from batch_fit import fit_frames
+from batch_fit import FitStatus
+from batch_fit import FrameFitResult
+from model_spec import ModelSpec
+from regular_grid import RegularGrid
+from fit_stats import EvalTimer
+from fit_stats import FitStats
+from solvers import SolverOptions
+from solvers import SolverType
+from solvers import SolverResult
+from solvers import solve
+from solvers import solve_chunked
+from chunk_source import ChunkSource
+from varpro import VarProjection
+from multistart import MultiStartOptions
+from multistart import MultiStartResult
+from multistart import run_multistart
+from pyramid import build_pyramid
+from eval_cache import EvalCache
+from parallel_fit import ParallelFitExecutor
+from stream_fit import DataFileReader
+from stream_fit import StreamResultWriter
+from warm_start import WarmStartPolicy
+from warm_start import WarmStarter
+from warm_start import fit_frames_warm
 from functions.function_info import FunctionInfo
 from functions.base_function import BaseFunction
 from functions.function_parameters import FuncParameter
 from base_exceptions import FitterException
 
 
+def _profiled(method):
+    # profile_path が設定されていれば、公開のフィット 1 回 (段や初期値毎ではなく全体) を計測して書き出し、設定を解除する
+    @functools.wraps(method)
+    def wrapper(self: "Fit", *args, **kwargs):
+        if self.profile_path is None:
+            return method(self, *args, **kwargs)
+        path = self.profile_path
+        # 内側で呼ばれる curve_fit は計測しない
+        self.profile_path = None
+        stats_before = self.last_stats
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            profiler.disable()
+            profiler.dump_stats(path)
+            if (self.last_stats is not None) and (self.last_stats is not stats_before):
+                self.last_stats.profile_path = path
+    return wrapper
+
+
 class Fit:
+    # f_without_assigning の結果を保持する数。fit の後の show_info, plot, 残差で同じ値を何度も評価する
+    MODEL_CACHE_ENTRIES = 4
+    CONTRIBUTION_CACHE_ENTRIES = 32
+
     def __init__(self,
                  data: Optional[np.ndarray] = None,
                  function_list: Optional[FunctionList] = None,
@@ -33,6 +93,23 @@ class Fit:
             self.fl = function_list
 
         self.explanatory = explanatory
+        # False の画素はフィットに使わない。data と同じ shape
+        self.mask: Optional[np.ndarray] = None
+        self.eval_options = EvaluationOptions()
+        self.solver_options = SolverOptions()
+        self.last_stats: Optional[FitStats] = None
+        self._model_cache = EvalCache(self.MODEL_CACHE_ENTRIES)
+        # 逐次フィットで固定する関数の寄与 (フィットに使う画素のみ)
+        self._contribution_cache = EvalCache(self.CONTRIBUTION_CACHE_ENTRIES)
+        # 前回フィットした時の関数毎のパラメータの状態。None なら逐次フィットはできない
+        self._fitted_state: Optional[Dict[str, tuple]] = None
+        # 設定した場合、次のフィットを 1 回だけ cProfile で計測してこのパスに書き出す
+        self.profile_path: Optional[str] = None
+
+    def set_float32_mode(self, enabled: bool):
+        # モデル評価を float32 で行い、作業領域を評価間で使い回す
+        self.eval_options.dtype = np.float32 if enabled else np.float64
+        self.eval_options.reuse_buffers = enabled
 
     def get_dim(self) -> int:
         return self.fl.dim
@@ -48,6 +125,7 @@ class Fit:
         if f_type is None:
             return False
         self.fl.add_func(f_type)
+        self.invalidate_cache()
         return True
 
     def try_remove_function_from_unique_name(self, unique_name: str) -> bool:
@@ -55,6 +133,7 @@ class Fit:
         if (not found) or (target_func is None):
             return False
         self.fl.remove_func(index)
+        self.invalidate_cache()
         return True
 
     def try_get_function(self, f_name: str) -> Tuple[bool, Optional[BaseFunction], int]:
@@ -84,17 +163,48 @@ class Fit:
                 self.explanatory = self.get_default_explanatory()
             else:
                 self.explanatory = explanatory
+            if (self.mask is not None) and (self.mask.shape != data.shape):
+                self.mask = None
+            self.invalidate_cache()
+            self._fitted_state = None
             return True
         return False
 
+    def set_mask(self, mask: Optional[np.ndarray]):
+        self._contribution_cache.clear()
+        self._fitted_state = None
+        if mask is None:
+            self.mask = None
+            return
+        if self.data is None:
+            raise FitterException("データがありません")
+        if np.shape(mask) != self.data.shape:
+            raise FitterException("マスクとデータの shape が一致しません: {} {}".format(np.shape(mask), self.data.shape))
+        self.mask = np.asarray(mask, dtype=bool)
+
+    def get_valid_mask(self, data: Optional[np.ndarray] = None) -> Optional[np.ndarray]:
+        # マスクと data の有限値の画素を合わせたもの。全画素を使う場合は None
+        valid = None
+        if (self.mask is not None) and ((data is None) or (data.shape == self.mask.shape)):
+            valid = self.mask
+        if (data is not None) and (not np.all(np.isfinite(data))):
+            valid = np.isfinite(data) if valid is None else valid & np.isfinite(data)
+        return valid
+
+    def get_residual(self) -> np.ndarray:
+        # フィットに使わない画素は NaN
+        residual = self.data - self.f_without_assigning()
+        valid = self.get_valid_mask(self.data)
+        if valid is not None:
+            residual[~valid] = np.nan
+        return residual
+
     def get_default_explanatory(self) -> ExplanatoryType:
-        if self.data.ndim == 2:
-            x_arr = np.arange(self.data.shape[1], dtype=np.float64)
-            y_arr = np.arange(self.data.shape[0], dtype=np.float64)
-            return np.meshgrid(x_arr, y_arr)
-        elif self.data.ndim == 1:
-            return np.arange(self.data.shape[0])
-        assert False  # ここには到達しない
+        return self._gen_default_explanatory(self.data.shape)
+
+    def get_raveled_explanatory(self, valid: Optional[np.ndarray] = None) -> Union[np.ndarray, RegularGrid]:
+        # CompiledModel.f や FunctionList.f に渡す形の説明変数。valid を指定した場合はその画素だけ
+        return self._ravel_explanatory(self.explanatory, valid)
 
     def runtime_check(self):
         if len(self.fl) < 1:
@@ -104,31 +214,398 @@ class Fit:
             if dim not in [1, 2]:
                 raise FitterException(msg)
 
+    def invalidate_cache(self):
+        self._model_cache.clear()
+        self._contribution_cache.clear()
+
     def f_without_assigning(self) -> np.ndarray:
+        # 関数の構成と全パラメータの値が同じなら前回の結果を使う (戻り値は書き込み不可)
+        if self.explanatory is None:
+            assert self.try_set_data(self.data)
+        key = (tuple(func.unique_name() for func in self.fl.get_functions()),
+               tuple(self.fl.get_values(is_free=False)), id(self.explanatory))
+        estimated = self._model_cache.get(key)
+        if estimated is None:
+            estimated = self.fl.f_without_assigning(self.explanatory)
+            if estimated is not None:
+                estimated.setflags(write=False)
+                self._model_cache.put(key, estimated, self.explanatory)
+        return estimated
+
+    def estimate_initial_values(self, unique_name: Optional[str] = None) -> List[str]:
+        self.runtime_check()
+        if self.data is None:
+            raise FitterException("データがありません")
         if self.explanatory is None:
             assert self.try_set_data(self.data)
-        return self.fl.f_without_assigning(self.explanatory)
 
+        targets = None
+        if unique_name is not None:
+            found, func, _ = self.try_get_function(unique_name)
+            if (not found) or (func is None):
+                raise FitterException("指定された関数がありません: {}".format(unique_name))
+            targets = [func]
+        return self._estimate(targets)
+
+    def _estimate(self, targets: Optional[List[BaseFunction]], keep_set_values: bool = False) -> List[str]:
+        valid = self.get_valid_mask(self.data)
+        if valid is None:
+            return self.fl.estimate(self.explanatory, self.data, targets, keep_set_values)
+        compact_expl = self._to_explanatory(self.get_raveled_explanatory(valid))
+        return self.fl.estimate(compact_expl, self.data[valid], targets, keep_set_values)
+
+    def mark_fitted(self):
+        # 現在の値を逐次フィットの基準にする。FitCommand が結果を反映した後に呼ぶ
+        self._fitted_state = {func.unique_name(): self._get_func_state(func) for func in self.fl.get_functions()}
+
+    def get_changed_functions(self) -> List[BaseFunction]:
+        # 前回のフィットから追加されたか、値や状態が変更された関数
+        if self._fitted_state is None:
+            return list(self.fl.get_functions())
+        return [func for func in self.fl.get_functions()
+                if self._fitted_state.get(func.unique_name()) != self._get_func_state(func)]
+
+    @_profiled
+    def incremental_fit(self, staged: bool = False, polish: bool = True) -> Tuple[np.ndarray, np.ndarray]:
+        # 前回の解を初期値として使い直す。新しい関数は残差から初期値を推定し (set value で変更された値は残す)、
+        # staged の場合は変更された関数のパラメータだけを先に最適化してから全体を polish する。
+        # raises RuntimeError
+        self.runtime_check()
+        if self._fitted_state is None:
+            return self.curve_fit()
+
+        changed = self.get_changed_functions()
+        added = [func for func in changed if func.unique_name() not in self._fitted_state]
+        if len(added) > 0:
+            self._estimate(added, keep_set_values=True)
+
+        if staged and (0 < len(changed) < len(self.fl)):
+            self._fit_functions(changed)
+        if polish or (not staged):
+            return self.curve_fit()
+
+        n_free = len(self.fl.get_values())
+        return np.array(self.fl.get_values()), np.full((n_free, n_free), np.nan)
+
+    def _fit_functions(self, targets: List[BaseFunction]):
+        # targets 以外の関数の寄与を一度だけ評価してデータから差し引き、targets のパラメータだけを最適化する。
+        # GLOBAL_DEPENDED で繋がった関数は一緒に最適化する
+        targets = self.fl.get_linked_functions(targets)
+        valid = self.get_valid_mask(self.data)
+        raveled_expl = self.get_raveled_explanatory(valid)
+        raveled_data = self._ravel_data(self.data, valid)
+        fixed = np.zeros(raveled_data.shape, dtype=np.float64)
+        for func in self.fl.get_functions():
+            if func not in targets:
+                fixed += self._get_contribution(func, raveled_expl)
+
+        sub_fl = FunctionList(list(targets))
+        if len(sub_fl.get_values()) == 0:
+            return
+        opt_para, _ = self._curve_fit(sub_fl, raveled_expl, raveled_data - fixed)
+        sub_fl.set_values(*opt_para)
+
+    def _get_contribution(self, func: BaseFunction, raveled_expl: Union[np.ndarray, RegularGrid]) -> np.ndarray:
+        key = (func.unique_name(), self._get_func_state(func))
+        contribution = self._contribution_cache.get(key)
+        if contribution is None:
+            contribution = np.ravel(func.f(self._to_explanatory(raveled_expl)))
+            self._contribution_cache.put(key, contribution)
+        return contribution
+
+    @staticmethod
+    def _get_func_state(func: BaseFunction) -> tuple:
+        return tuple((param.value, param.state, param.depend_parent, param.depend_coef, param.depend_func,
+                      param.depend_offset, tuple(param.param_range))
+                     for param in func.parameters)
+
+    @_profiled
     def curve_fit(self) -> Tuple[np.ndarray, np.ndarray]:
         # raises RuntimeError
-        raveled_expl = self._get_raveled_expl()
-        opt_para, opt_cov = so.curve_fit(self.fl.f, raveled_expl, self.data.ravel(),
-                                         p0=self.fl.get_values(), bounds=self.fl.get_bounds())
-        return opt_para, opt_cov
+        if self.solver_options.solver_type is SolverType.CHUNKED:
+            # データを展開せずに塊毎に読む。NaN の画素は塊毎に取り除く
+            if self.explanatory is None:
+                self.explanatory = self.get_default_explanatory()
+            return self._curve_fit(self.fl, self.explanatory, self.data, self.mask)
+        # マスクされた画素と NaN の画素は座標ごと最初に取り除く
+        valid = self.get_valid_mask(self.data)
+        raveled_expl = self.get_raveled_explanatory(valid)
+        raveled_data = self._ravel_data(self.data, valid)
+        return self._curve_fit(self.fl, raveled_expl, raveled_data)
+
+    def _curve_fit(self, function_list: FunctionList, raveled_expl: Union[np.ndarray, RegularGrid],
+                   raveled_data: np.ndarray, valid: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        # CHUNKED の場合は展開前のデータと説明変数も受け付け、valid はその場合のみ使う
+        options = self._get_component_cached_options(function_list) if self.solver_options.variable_projection \
+            else self.eval_options
+        model = CompiledModel(function_list, options)
+        model.timer = EvalTimer()
+        if self.solver_options.variable_projection and \
+                (self.solver_options.solver_type in [SolverType.SPARSE, SolverType.CHUNKED]):
+            raise FitterException("変数射影は {} ソルバーと併用できません"
+                                  .format(self.solver_options.solver_type.name.lower()))
+        if (self.solver_options.solver_type is SolverType.SPARSE) and (self.solver_options.tr_solver == "exact"):
+            raise FitterException("sparse ソルバーでは tr_solver=exact は使えません (lsmr のみ)")
+        if (self.solver_options.solver_type is SolverType.SPARSE) and (model.dim != 2):
+            # 窓で打ち切れないのでヤコビアンが密になり、least_squares より遅くなるだけ
+            raise FitterException("sparse ソルバーは 2 次元のデータでのみ使えます")
+        start = time.perf_counter()
+        termination = ""
+        try:
+            if self.solver_options.variable_projection:
+                result = self._solve_projected(model, function_list, raveled_expl, raveled_data)
+            elif self.solver_options.solver_type is SolverType.CHUNKED:
+                source = ChunkSource(raveled_expl, raveled_data, model.dim, valid, self.solver_options.chunk_size)
+                result = solve_chunked(model, source, function_list.get_values(), function_list.get_bounds(),
+                                       self.solver_options)
+            else:
+                jac_sparsity = None
+                if (self.solver_options.solver_type is SolverType.SPARSE) and (not model.has_jac()):
+                    jac_sparsity = function_list.get_jac_sparsity(self._to_explanatory(raveled_expl),
+                                                                  self.solver_options.sparsity_sigma)
+                result = solve(model, raveled_expl, raveled_data, function_list.get_values(),
+                               function_list.get_bounds(), self.solver_options, jac_sparsity)
+        except RuntimeError as e:
+            termination = str(e)
+            raise
+        finally:
+            stats = FitStats.from_timer(model.timer, time.perf_counter() - start)
+            stats.termination = termination
+            stats.solver = self.solver_options.solver_type.name
+            self.last_stats = stats
+
+        stats.termination = result.message
+        stats.status = result.status
+        stats.solver = result.solver
+        stats.tr_solver = result.tr_solver
+        stats.final_cost = result.cost
+        return result.params, result.covariance
+
+    def _solve_projected(self, model: CompiledModel, function_list: FunctionList,
+                         raveled_expl: Union[np.ndarray, RegularGrid], raveled_data: np.ndarray) -> SolverResult:
+        # 非線形パラメータだけをソルバーに渡し、結果を全ての自由パラメータに戻す
+        # raises RuntimeError
+        bounds = function_list.get_bounds()
+        projection = VarProjection(model, raveled_expl, raveled_data, bounds)
+        if projection.get_free_num() == 0:
+            params = projection.to_free([])
+            residual = model.f(raveled_expl, *params) - raveled_data
+            result = SolverResult(params, np.empty(0), float(np.dot(residual, residual)), 1,
+                                  "線形パラメータのみを解きました", "")
+        else:
+            result = solve(projection, raveled_expl, raveled_data, projection.to_nonlinear(function_list.get_values()),
+                           projection.to_nonlinear_bounds(bounds), self.solver_options)
+            result.params = projection.to_free(result.params)
+        result.covariance = projection.covariance(result.params, result.cost)
+        result.solver = "{} + VARPRO".format(result.solver) if len(result.solver) > 0 else "VARPRO"
+        return result
+
+    @_profiled
+    def multistart(self, options: Optional[MultiStartOptions] = None,
+                   executor: Optional[ParallelFitExecutor] = None) -> MultiStartResult:
+        # 現在の値と境界から複数の初期値を作ってフィットし、最良の解を通常のフィットで仕上げる。
+        # FunctionList の値は変更しない
+        # raises RuntimeError
+        self.runtime_check()
+        if options is None:
+            options = MultiStartOptions()
+        start_time = time.perf_counter()
+        valid = self.get_valid_mask(self.data)
+        raveled_expl = self.get_raveled_explanatory(valid)
+        raveled_data = self._ravel_data(self.data, valid)
+
+        eval_options = self._get_component_cached_options(self.fl)
+        if executor is not None:
+            spec = ModelSpec.from_function_list(self.fl)
+            # 共有メモリに載せるため実体化する
+            shared_expl = raveled_expl.ravel() if isinstance(raveled_expl, RegularGrid) else raveled_expl
+
+            def runner(p0s: np.ndarray, max_nfev: Optional[int]) -> BatchFitResult:
+                return executor.fit_starts(spec, shared_expl, raveled_data, p0s, eval_options, max_nfev)
+        else:
+            model = CompiledModel(self.fl, eval_options)
+            bounds = self.fl.get_bounds()
+
+            def runner(p0s: np.ndarray, max_nfev: Optional[int]) -> BatchFitResult:
+                result = BatchFitResult.empty(len(p0s), model.get_free_num())
+                for index, p0 in enumerate(p0s):
+                    result.set_frame(index, fit_frame(model, raveled_expl, raveled_data, p0, bounds, max_nfev))
+                return result
+
+        best, starts = run_multistart(runner, self.fl.get_values(), self.fl.get_bounds(), options)
+
+        n_free = len(best)
+        result = MultiStartResult(best, np.full((n_free, n_free), np.nan), starts[0].cost, 0.0, starts)
+        is_timeout = (options.time_budget is not None) and (time.perf_counter() - start_time > options.time_budget)
+        if not is_timeout:
+            polished = ModelSpec.from_function_list(self.fl).to_function_list()
+            polished.set_values(*best)
+            try:
+                result.params, result.covariance = self._curve_fit(polished, raveled_expl, raveled_data)
+                result.cost = self.last_stats.final_cost
+            except RuntimeError:
+                # 打ち切った解は仕上げでも収束しないことがある。その場合は探索の最良解を返す
+                pass
+        result.elapsed = time.perf_counter() - start_time
+        return result
+
+    @_profiled
+    def pyramid_fit(self, levels: int = 3, factor: int = 2) -> Tuple[np.ndarray, np.ndarray]:
+        # 2-D データをブロック平均で縮小した画像で粗い順にフィットし、各段の解を次の段の初期値にする。
+        # 元の解像度では最後の仕上げだけを行う。FunctionList の値は変更しない
+        # raises RuntimeError
+        self.runtime_check()
+        if self.get_dim() != 2:
+            raise FitterException("多重解像度フィットは 2-D データのみ対応しています")
+        if (levels < 1) or (factor < 2):
+            raise FitterException("段数は 1 以上、縮小率は 2 以上にしてください: levels={} factor={}"
+                                  .format(levels, factor))
+
+        valid = self.get_valid_mask(self.data)
+        if self.explanatory is None:
+            self.explanatory = self.get_default_explanatory()
+        work = ModelSpec.from_function_list(self.fl).to_function_list()
+        level_stats = []
+        for level in build_pyramid(self.data, self.explanatory, valid, levels, factor):
+            level_valid = np.isfinite(level.data)
+            if np.all(level_valid):
+                level_valid = None
+            name = "1/{} ({}x{})".format(level.factor, level.data.shape[1], level.data.shape[0])
+            try:
+                params, _ = self._curve_fit(work, self._ravel_explanatory(level.explanatory, level_valid),
+                                            self._ravel_data(level.data, level_valid))
+                work.set_values(*params)
+            except RuntimeError:
+                # 粗い段で収束しなくても、直前の値のまま次の段に進む
+                pass
+            level_stats.append((name, self.last_stats))
+
+        try:
+            return self._curve_fit(work, self.get_raveled_explanatory(valid), self._ravel_data(self.data, valid))
+        finally:
+            self.last_stats.levels = level_stats
+
+    def batch_fit(self, stack: np.ndarray,
+                  executor: Optional[ParallelFitExecutor] = None,
+                  warm_start: WarmStartPolicy = WarmStartPolicy.NONE) -> BatchFitResult:
+        # stack: (フレーム数, H, W) の 2-D データ、または (フレーム数, N) の 1-D データ
+        if (not isinstance(stack, np.ndarray)) or (stack.ndim not in [2, 3]) or (len(stack) == 0):
+            raise FitterException("スタックの型か shape が不正です: {}".format(getattr(stack, "shape", None)))
+        if self.data is None:
+            if not self.try_set_data(stack[0]):
+                raise FitterException("スタックの型か shape が不正です: {}".format(stack.shape))
+        if self.data.shape != stack.shape[1:]:
+            raise FitterException("データとスタックのフレームの shape が一致しません: {} {}"
+                                  .format(self.data.shape, stack.shape[1:]))
+        self.runtime_check()
+
+        is_warm = warm_start not in [WarmStartPolicy.DEFAULT, WarmStartPolicy.NONE]
+        if (executor is not None) and is_warm:
+            raise FitterException("ウォームスタートは逐次実行でのみ使用できます: {}".format(warm_start.name))
+
+        # フレーム毎の NaN は fit_frame で取り除く
+        raveled_expl = self.get_raveled_explanatory(self.mask)
+        if self.mask is not None:
+            stack = stack[:, self.mask]
+        if executor is not None:
+            if isinstance(raveled_expl, RegularGrid):
+                # 共有メモリに載せるため実体化する
+                raveled_expl = raveled_expl.ravel()
+            return executor.fit_frames(ModelSpec.from_function_list(self.fl), raveled_expl, stack,
+                                       options=self.eval_options)
+        model = CompiledModel(self.fl, self.eval_options)
+        if is_warm:
+            warm_starter = WarmStarter(warm_start, self.fl.get_values(), self.fl.get_bounds())
+            return fit_frames_warm(model, raveled_expl, stack, warm_starter)
+        return fit_frames(model, raveled_expl, stack, self.fl.get_values(), self.fl.get_bounds())
+
+    def fit_stream(self, pattern: str, output_path: str, read_ahead: int = 2,
+                   warm_start: WarmStartPolicy = WarmStartPolicy.NONE) -> int:
+        # pattern に一致するファイルを順にフィットし、結果を output_path に 1 行ずつ追記する
+        self.runtime_check()
+        reader = DataFileReader(pattern, read_ahead)
+        if len(reader) == 0:
+            raise FitterException("ファイルが見つかりません: {}".format(pattern))
+
+        model = CompiledModel(self.fl, self.eval_options)
+        warm_starter = WarmStarter(warm_start, self.fl.get_values(), self.fl.get_bounds())
+        n_free = model.get_free_num()
+        expl_shape: Optional[Tuple[int, ...]] = None
+        raveled_expl: Optional[np.ndarray] = None
+
+        fitted_num = 0
+        with StreamResultWriter(output_path, self.fl.get_param_names()) as writer:
+            for path, data, _ in reader:
+                if (data is None) or (not self._is_valid_data(data, None)) or (data.ndim != self.get_dim()):
+                    writer.write(path, FrameFitResult(np.full(n_free, np.nan), np.full((n_free, n_free), np.nan),
+                                                      FitStatus.INVALID_DATA, np.nan))
+                    continue
+
+                valid = self.mask if (self.mask is not None) and (self.mask.shape == data.shape) else None
+                if data.shape != expl_shape:
+                    # 説明変数は直前と shape が変わった時だけ作り直す
+                    expl_shape = data.shape
+                    raveled_expl = self._get_stream_expl(data.shape, valid)
+                frame_result = warm_starter.fit(model, raveled_expl, self._ravel_data(data, valid))
+                writer.write(path, frame_result)
+                fitted_num += 1
+        return fitted_num
+
+    def _get_stream_expl(self, shape: Tuple[int, ...], valid: Optional[np.ndarray] = None) -> np.ndarray:
+        if (self.data is not None) and (self.explanatory is not None) and (self.data.shape == shape):
+            return self.get_raveled_explanatory(valid)
+        return self._ravel_explanatory(self._gen_default_explanatory(shape), valid)
+
+    def _get_component_cached_options(self, function_list: FunctionList) -> EvaluationOptions:
+        # 数値微分では 1 つのパラメータを動かす度に他の関数の寄与を使い回せるので、関数毎のキャッシュを有効にする。
+        # 基準の寄与と動かした関数の寄与が入る数を保持する
+        if (self.eval_options.component_cache_entries > 0) or \
+                all(func.has_jac() for func in function_list.get_functions()):
+            return self.eval_options
+        return dataclasses.replace(self.eval_options, component_cache_entries=2 * len(function_list) + 2)
 
     def _is_valid_function(self) -> bool:
         return len(self.fl) > 0
 
-    def _get_raveled_expl(self) -> np.ndarray:
+    def _ravel_explanatory(self, explanatory: ExplanatoryType,
+                           valid: Optional[np.ndarray] = None) -> Union[np.ndarray, RegularGrid]:
+        # valid を指定した場合は選ばれた画素の座標だけを詰めて持つ。
+        # RegularGrid は全画素を使う場合はそのまま渡し、CompiledModel が軸の broadcasting で評価する
         if self.get_dim() == 1:
-            return self.explanatory
+            return explanatory if valid is None else np.asarray(explanatory)[valid]
         if self.get_dim() == 2:
-            return np.array([self.explanatory[0].ravel(), self.explanatory[1].ravel()])
+            if isinstance(explanatory, RegularGrid) and (valid is None):
+                return explanatory
+            if valid is None:
+                return np.array([explanatory[0].ravel(), explanatory[1].ravel()])
+            x, y = np.broadcast_arrays(explanatory[0], explanatory[1])
+            return np.array([x[valid], y[valid]])
         assert False
 
+    def _to_explanatory(self, raveled_expl: Union[np.ndarray, RegularGrid]) -> ExplanatoryType:
+        # 関数の f に渡せる形に戻す
+        if (self.get_dim() == 1) or isinstance(raveled_expl, RegularGrid):
+            return raveled_expl
+        return raveled_expl[0], raveled_expl[1]
+
+    @staticmethod
+    def _ravel_data(data: np.ndarray, valid: Optional[np.ndarray] = None) -> np.ndarray:
+        return data.ravel() if valid is None else data[valid]
+
+    @staticmethod
+    def _gen_default_explanatory(shape: Tuple[int, ...]) -> ExplanatoryType:
+        if len(shape) == 2:
+            x_arr = np.arange(shape[1], dtype=np.float64)
+            y_arr = np.arange(shape[0], dtype=np.float64)
+            return RegularGrid(x_arr, y_arr)
+        elif len(shape) == 1:
+            return np.arange(shape[0])
+        assert False  # ここには到達しない
+
     @staticmethod
     def _is_valid_data(data: np.ndarray, explanatory: Optional[ExplanatoryType]) -> bool:
-        if type(data) is not np.ndarray:
+        # np.memmap も受け付ける
+        if not isinstance(data, np.ndarray):
             return False
         if data.ndim > 2:
             return False
@@ -136,6 +613,8 @@ class Fit:
         if explanatory is None:
             return True
 
+        if isinstance(explanatory, RegularGrid):
+            return explanatory.shape == data.shape
         if isinstance(explanatory, tuple):
             return len(explanatory) == int(data.ndim)
         return (int(data.ndim) == 1) and isinstance(explanatory, np.ndarray)
@@ -0,0 +1,79 @@
+from dataclasses import dataclass
+from dataclasses import field
+from typing import Optional
+from typing import Dict
+from typing import List
+from typing import Tuple
+import time
+
+
+class EvalTimer:
+    # モデル評価の回数と時間を集計する。CompiledModel や FunctionList の timer に設定した時だけ計測される
+    def __init__(self):
+        self.nfev = 0
+        self.njev = 0
+        self.assign_time = 0.0
+        self.jac_time = 0.0
+        self.component_time: Dict[str, float] = {}
+
+    def add_component_time(self, name: str, start: float):
+        self.component_time[name] = self.component_time.get(name, 0.0) + (time.perf_counter() - start)
+
+
+@dataclass
+class FitStats:
+    solver: str = ""
+    # least_squares で実際に使われた tr_solver
+    tr_solver: str = ""
+    nfev: int = 0
+    njev: int = 0
+    # 反復回数。ヤコビアンを解析的に与えた場合はヤコビアンの評価回数と一致する
+    iterations: int = 0
+    final_cost: float = float("nan")
+    status: int = 0
+    termination: str = ""
+    elapsed: float = 0.0
+    # パラメータの展開 (FunctionList では set_values) に掛かった時間
+    assign_time: float = 0.0
+    jac_time: float = 0.0
+    component_time: Dict[str, float] = field(default_factory=dict)
+    profile_path: Optional[str] = None
+    # 多重解像度フィットの各段 (粗い順)。(段の名前, その段の統計)
+    levels: List[Tuple[str, "FitStats"]] = field(default_factory=list)
+
+    @classmethod
+    def from_timer(cls, timer: EvalTimer, elapsed: float) -> "FitStats":
+        return cls(nfev=timer.nfev, njev=timer.njev, iterations=timer.njev if timer.njev > 0 else timer.nfev,
+                   elapsed=elapsed, assign_time=timer.assign_time, jac_time=timer.jac_time,
+                   component_time=dict(timer.component_time))
+
+    def get_eval_time(self) -> float:
+        return sum(self.component_time.values())
+
+    def get_other_time(self) -> float:
+        # 最適化ルーチン自体 (線形代数など) に掛かった時間の目安
+        return self.elapsed - self.get_eval_time() - self.assign_time - self.jac_time
+
+    def to_lines(self) -> List[str]:
+        lines = [
+            "{:<20s} {}".format("solver", self.solver),
+            "{:<20s} {}".format("tr_solver", self.tr_solver),
+            "{:<20s} {}".format("termination", self.termination),
+            "{:<20s} {}".format("status", self.status),
+            "{:<20s} {}".format("iterations", self.iterations),
+            "{:<20s} {}".format("nfev", self.nfev),
+            "{:<20s} {}".format("njev", self.njev),
+            "{:<20s} {:G}".format("final cost", self.final_cost),
+            "{:<20s} {:.6f} s".format("elapsed", self.elapsed),
+            "{:<20s} {:.6f} s".format("assign", self.assign_time),
+            "{:<20s} {:.6f} s".format("jacobian", self.jac_time),
+        ]
+        for name, elapsed in self.component_time.items():
+            lines.append("{:<20s} {:.6f} s".format("f: " + name, elapsed))
+        lines.append("{:<20s} {:.6f} s".format("other", self.get_other_time()))
+        if self.profile_path is not None:
+            lines.append("{:<20s} {}".format("profile", self.profile_path))
+        for name, level in self.levels:
+            lines.append("{:<20s} {} iterations, cost {:G}, {:.6f} s".format(
+                "level " + name, level.iterations, level.final_cost, level.elapsed))
+        return lines
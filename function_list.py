@@ -3,13 +3,20 @@ from typing import Union
 from typing import List
 from typing import Tuple
 from typing import Type
+import time
 
 import numpy as np
+from scipy import sparse
 
 from functions.base_function import BaseFunction
+from functions.function_parameters import ParamState
+from fit_stats import EvalTimer
+from regular_grid import RegularGrid
+from pixel_index import build_pixel_index
+from param_mapping import ParamMapping
 
 
-ExplanatoryType = Union[np.ndarray, Tuple[np.ndarray, np.ndarray]]
+ExplanatoryType = Union[np.ndarray, Tuple[np.ndarray, np.ndarray], RegularGrid]
 
 
 class FunctionList:
@@ -18,6 +25,8 @@ class FunctionList:
             f_list = []
         self._funcs: List[BaseFunction] = f_list
         self.dim = -1
+        # 設定した場合のみ f の評価回数と時間を計測する
+        self.timer: Optional[EvalTimer] = None
 
     def __len__(self):
         return len(self._funcs)
@@ -46,13 +55,84 @@ class FunctionList:
             values += func.get_values(is_free)
         return values
 
+    def get_param_names(self, is_free: bool = True) -> List[str]:
+        names = []
+        for func in self._funcs:
+            for param in func.parameters:
+                if is_free and (param.state != ParamState.FREE):
+                    continue
+                names.append("{0}.{1}".format(func.unique_name(), param.name))
+        return names
+
     def set_values(self, *args):
+        if self._has_global_dependency():
+            # 関数を跨ぐ依存は関数毎には解決できないので、全パラメータを写像で求めて設定する
+            mapping = ParamMapping(self._funcs)
+            full_values = mapping.expand(np.array(args, dtype=np.float64))
+            for func, sl in zip(self._funcs, mapping.slices):
+                is_success = func.try_assign_all(*full_values[sl])
+                assert is_success
+            return
+
         arg_index = 0
         for func in self._funcs:
             free_param_num = func.get_free_num()
             free_param = args[arg_index: arg_index + free_param_num]
             is_success = func.try_assign_arg(*free_param)
             assert is_success
+            arg_index += free_param_num
+
+    def get_jac_sparsity(self, explanatory: ExplanatoryType, n_sigma: float) -> sparse.csr_matrix:
+        # 自由パラメータについてのヤコビアンの非ゼロパターン (shape: (画素数, n_free))。
+        # 局在する関数の列は現在の値での窓 (feature_window) に含まれる画素だけを非ゼロとする
+        if self.apply_dim()[0] == 2:
+            pixel_index = build_pixel_index(explanatory)
+            size = len(pixel_index)
+        else:
+            pixel_index = None
+            size = np.size(explanatory)
+
+        # 他の関数に依存するパラメータは、依存元の列に自分の窓の画素を加える
+        mapping = ParamMapping(self._funcs)
+        n_free = mapping.get_free_num()
+        rows, cols = [], []
+        for func_index, func in enumerate(self._funcs):
+            func_cols = mapping.get_function_columns(func_index)
+            if len(func_cols) == 0:
+                continue
+            window = func.feature_window(n_sigma) if pixel_index is not None else None
+            pixels = np.arange(size) if window is None else pixel_index.query(*window)
+            for c in func_cols:
+                rows.append(pixels)
+                cols.append(np.full(len(pixels), c, dtype=np.int64))
+
+        if len(rows) == 0:
+            return sparse.csr_matrix((size, n_free), dtype=np.int8)
+        rows, cols = np.concatenate(rows), np.concatenate(cols)
+        # 重複した要素は足し合わされるので 1 に戻す
+        pattern = sparse.csr_matrix((np.ones(len(rows), dtype=np.int8), (rows, cols)), shape=(size, n_free))
+        pattern.data[:] = 1
+        return pattern
+
+    def get_linked_functions(self, targets: List[BaseFunction]) -> List[BaseFunction]:
+        # targets と GLOBAL_DEPENDED で (どちら向きにでも) 繋がっている関数を全て加えて返す
+        linked = [func for func in self._funcs if func in targets]
+        while True:
+            added = [func for func in self._funcs
+                     if (func not in linked) and any(self._is_linked(func, other) for other in linked)]
+            if len(added) == 0:
+                return linked
+            linked += added
+
+    @staticmethod
+    def _is_linked(func: BaseFunction, other: BaseFunction) -> bool:
+        def depends_on(child: BaseFunction, parent: BaseFunction) -> bool:
+            return any((param.state == ParamState.GLOBAL_DEPENDED) and (param.depend_func == parent.unique_name())
+                       for param in child.parameters)
+        return depends_on(func, other) or depends_on(other, func)
+
+    def _has_global_dependency(self) -> bool:
+        return any(param.state == ParamState.GLOBAL_DEPENDED for func in self._funcs for param in func.parameters)
 
     def _publish_new_fid(self, func_type: Type[BaseFunction]) -> int:
         name = func_type.name()
@@ -79,12 +159,55 @@ class FunctionList:
         return self.dim, "OK"
 
     def f_without_assigning(self, explanatory: ExplanatoryType) -> np.ndarray:
-        sub_function_results = [func.f(explanatory) for func in self._funcs]
-        return np.sum(sub_function_results, axis=0)
+        result = None
+        for func in self._funcs:
+            start = time.perf_counter() if self.timer is not None else 0.0
+            if result is None:
+                result = np.array(func.f(explanatory), dtype=np.float64)
+            else:
+                result += func.f(explanatory)
+            if self.timer is not None:
+                self.timer.add_component_time(func.unique_name(), start)
+        return result
+
+    def estimate(self, explanatory: ExplanatoryType, data: np.ndarray,
+                 targets: Optional[List[BaseFunction]] = None, keep_set_values: bool = False) -> List[str]:
+        # 局在しない関数 (背景) から順に推定し、推定した関数の寄与をデータから差し引いていく。
+        # 複数のガウシアンは残差の最大ピークから 1 つずつ決まる。
+        # keep_set_values の場合は __init__ の値から変更されたパラメータを推定値で上書きしない
+        if targets is None:
+            targets = self._funcs
+        residual = np.array(data, dtype=np.float64)
+        for func in self._funcs:
+            if func not in targets:
+                residual -= func.f(explanatory)
+
+        ordered = sorted(targets, key=lambda fn: fn.feature_point() is not None)
+        estimated = []
+        for func in ordered:
+            if func.get_free_num() == 0:
+                residual -= func.f(explanatory)
+                continue
+            kept = []
+            if keep_set_values:
+                kept = [(param, param.value) for param, default in zip(func.parameters, func.get_default_values())
+                        if param.value != default]
+            if func.estimate(explanatory, residual):
+                estimated.append(func.unique_name())
+            for param, value in kept:
+                param.value = value
+            residual -= func.f(explanatory)
+        return estimated
 
     def f(self, *args) -> np.ndarray:
         msg = ""
-        self.set_values(*args[1:])
+        if self.timer is None:
+            self.set_values(*args[1:])
+        else:
+            self.timer.nfev += 1
+            start = time.perf_counter()
+            self.set_values(*args[1:])
+            self.timer.assign_time += time.perf_counter() - start
         if self.dim == -1:
             self.dim, msg = self._detect_dim()
 
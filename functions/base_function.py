@@ -3,6 +3,7 @@ from typing import Optional
 from typing import List
 from typing import Union
 from typing import Tuple
+from typing import Sequence
 
 import numpy as np
 
@@ -12,6 +13,11 @@ from functions.function_info import FunctionInfo
 
 
 class BaseFunction(metaclass=abc.ABCMeta):
+    # f_batch が使う out と同じ shape の作業領域の数
+    SCRATCH_NUM = 0
+    # f が比例するパラメータ (f = 値 * 基底) の番号。変数射影で閉じた形で解く。無い関数は None
+    LINEAR_PARAM_INDEX: Optional[int] = None
+
     def __init__(self, fid: int):
         self._fid = fid
 
@@ -66,7 +72,8 @@ class BaseFunction(metaclass=abc.ABCMeta):
             elif param.state == ParamState.DEPENDED:
                 new_values.append(None)
             elif param.state == ParamState.GLOBAL_DEPENDED:
-                print("Not supported")
+                # 他の関数に依存する値は FunctionList.set_values で解決する
+                new_values.append(param.value)
 
         # apply to DEPENDENCY
         for index, param in enumerate(self.parameters):
@@ -78,18 +85,40 @@ class BaseFunction(metaclass=abc.ABCMeta):
                 print("Depend parent is not found: {0}(parent) {1}(child)".format(param.depend_parent, param.name))
                 return False
             new_values[index] = depend_parent.value * param.depend_coef
+        return self.try_assign_all(*new_values)
 
+    def try_assign_all(self, *values) -> bool:
+        # 全パラメータの値を状態によらずそのまま設定する
         # range check
-        for param, new_value in zip(self.parameters, new_values):
+        for param, new_value in zip(self.parameters, values):
             if not param.is_in_range(new_value):
                 print("{0} is out of range: {1}(range) {2}(value)".format(param.name, param.param_range, new_value))
                 return False
 
         # apply
-        for param, new_value in zip(self.parameters, new_values):
+        for param, new_value in zip(self.parameters, values):
             param.value = new_value
         return True
 
+    def estimate(self, explanatory: Union[np.ndarray, Tuple[np.ndarray, np.ndarray]], data: np.ndarray) -> bool:
+        # データから FREE のパラメータの初期値を推定する。推定できない関数は False を返す
+        return False
+
+    def get_default_values(self) -> List[float]:
+        # __init__ で設定される値
+        return [param.value for param in type(self)(self.fid).parameters]
+
+    def set_free_values_in_range(self, estimated: Sequence[float]):
+        # 推定値のうち FREE のものだけを範囲内に収めて設定する
+        for param, value in zip(self.parameters, estimated):
+            if param.state != ParamState.FREE:
+                continue
+            if not np.isfinite(value):
+                continue
+            lower, upper = param.param_range
+            margin = (upper - lower) * 1e-9
+            param.value = float(np.clip(value, lower + margin, upper - margin))
+
     def get_free_num(self) -> int:
         return len(list(filter(lambda p: p.state == ParamState.FREE, self.parameters)))
 
@@ -118,3 +147,36 @@ class BaseFunction(metaclass=abc.ABCMeta):
     @abc.abstractmethod
     def f(self, explanatory: Union[np.ndarray, Tuple[np.ndarray, np.ndarray]]) -> np.ndarray:
         pass
+
+    @classmethod
+    @abc.abstractmethod
+    def f_from_values(cls, explanatory: Union[np.ndarray, Tuple[np.ndarray, np.ndarray]],
+                      values: Sequence[float]) -> np.ndarray:
+        pass
+
+    @classmethod
+    def f_batch(cls, explanatory: Union[np.ndarray, Tuple[np.ndarray, np.ndarray]],
+                values: np.ndarray, out: np.ndarray, scratch: Optional[List[np.ndarray]] = None) -> np.ndarray:
+        # 同じ型の関数 K 個分 (values: (K, パラメータ数)) の和を out に加算する。
+        # scratch には SCRATCH_NUM 枚の作業領域を渡して評価毎の確保を省ける
+        for row in values:
+            out += cls.f_from_values(explanatory, row)
+        return out
+
+    @classmethod
+    def window_from_values(cls, values: Sequence[float], n_sigma: float) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        # 寄与が無視できない範囲を (中心, 半幅) で返す。局在しない関数は None
+        return None
+
+    def feature_window(self, n_sigma: float) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        return self.window_from_values(self.get_values(is_free=False), n_sigma)
+
+    @classmethod
+    def has_jac(cls) -> bool:
+        return False
+
+    @classmethod
+    def jac_from_values(cls, explanatory: Union[np.ndarray, Tuple[np.ndarray, np.ndarray]],
+                        values: Sequence[float]) -> Optional[np.ndarray]:
+        # 解析的なヤコビアンを持たない関数は None を返し、数値微分にフォールバックする
+        return None
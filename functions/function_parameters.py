@@ -1,3 +1,4 @@
+from typing import Optional
 from typing import Tuple
 import enum
 
@@ -19,10 +20,20 @@ class FuncParameter:
         self.state = ParamState.FREE
         self.depend_parent = None
         self.depend_coef = 1.0
+        # GLOBAL_DEPENDED の依存先の関数 (unique name)。値は 依存先 * depend_coef + depend_offset
+        self.depend_func: Optional[str] = None
+        self.depend_offset = 0.0
 
     def set_dependency(self, parent_name: str, depend_coef: float = 1.0):
         self.depend_parent = parent_name
         self.depend_coef = depend_coef
 
+    def set_global_dependency(self, func_name: str, parent_name: str,
+                              depend_coef: float = 1.0, depend_offset: float = 0.0):
+        self.depend_func = func_name
+        self.depend_parent = parent_name
+        self.depend_coef = depend_coef
+        self.depend_offset = depend_offset
+
     def is_in_range(self, value: float) -> bool:
         return self.param_range[0] < value < self.param_range[1]
@@ -2,6 +2,7 @@ from typing import Optional
 from typing import Union
 from typing import Tuple
 from typing import List
+from typing import Sequence
 
 import numpy as np
 
@@ -10,6 +11,15 @@ from functions.base_function import BaseFunction
 
 
 class Gauss(BaseFunction):
+    # 初期値推定で許す sigma の、ピーク付近の半値幅から求めた sigma に対する上限の倍率
+    ESTIMATE_MAX_SIGMA_RATIO = 4.0
+    # 半値以上の領域をピークの周りの方向毎に区切る数
+    ESTIMATE_SECTORS = 16
+    # 半値以上に限ったガウシアンの 2 次モーメントは sigma^2 のこの割合になる
+    HALF_MAX_MOMENT_RATIO = 1 - np.log(2)
+    SCRATCH_NUM = 3
+    LINEAR_PARAM_INDEX = 0
+
     def __init__(self, fid: int):
         super().__init__(fid)
         self._parameters = [
@@ -38,6 +48,11 @@ class Gauss(BaseFunction):
 
     def f(self, explanatory: Union[np.ndarray, Tuple[np.ndarray, np.ndarray]]) -> np.ndarray:
         values = [param.value for param in self._parameters]
+        return Gauss.f_from_values(explanatory, values)
+
+    @classmethod
+    def f_from_values(cls, explanatory: Union[np.ndarray, Tuple[np.ndarray, np.ndarray]],
+                      values: Sequence[float]) -> np.ndarray:
         x, y = explanatory
         return Gauss.f_core(x, y, *values)
 
@@ -45,6 +60,123 @@ class Gauss(BaseFunction):
     def f_core(x: np.ndarray, y: np.ndarray,
                norm: float, mean_x: float, mean_y: float,
                sigma_l: float, sigma_s: float, theta: float) -> np.ndarray:
+        dtype = np.result_type(np.asarray(x).dtype, np.asarray(y).dtype, np.float32)
+        out = np.zeros(np.broadcast(x, y).shape, dtype=dtype)
+        return Gauss.f_batch((x, y), np.array([[norm, mean_x, mean_y, sigma_l, sigma_s, theta]]), out)
+
+    @staticmethod
+    def _exponent_coefs(values: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray,
+                                                     np.ndarray, np.ndarray]:
+        # (K, 6) のパラメータから指数部 a dx^2 + 2b dx dy + c dy^2 の係数と振幅を求める
+        norm, mean_x, mean_y, sigma_l, sigma_s, theta = np.asarray(values, dtype=np.float64).T
+        sin_sq = np.sin(theta) ** 2
+        cos_sq = np.cos(theta) ** 2
+        sin_2 = np.sin(2*theta)
+
+        coef_a = cos_sq / (2 * sigma_l ** 2) + sin_sq / (2 * sigma_s ** 2)
+        coef_2b = 2 * (sin_2 / (4 * sigma_l ** 2) + sin_2 / (4 * sigma_s ** 2))
+        coef_c = sin_sq / (2 * sigma_l ** 2) + cos_sq / (2 * sigma_s ** 2)
+        amplitude = norm / (2 * np.pi * sigma_s * sigma_l)
+        return mean_x, mean_y, coef_a, coef_2b, coef_c, amplitude
+
+    @classmethod
+    def f_batch(cls, explanatory: Union[np.ndarray, Tuple[np.ndarray, np.ndarray]],
+                values: np.ndarray, out: np.ndarray, scratch: Optional[List[np.ndarray]] = None) -> np.ndarray:
+        x, y = explanatory
+        # 係数は float64 で求め、画素毎の計算は out の精度で行う
+        coefs = np.array(Gauss._exponent_coefs(values)).astype(out.dtype)
+
+        # 成分数によらず作業領域は 3 枚だけ使い、各成分の寄与は out に直接加算する
+        if scratch is None:
+            scratch = [np.empty(out.shape, dtype=out.dtype) for _ in range(cls.SCRATCH_NUM)]
+        shift_x, shift_y, work = scratch[:cls.SCRATCH_NUM]
+        for mean_x, mean_y, coef_a, coef_2b, coef_c, amplitude in coefs.T:
+            np.subtract(x, mean_x, out=shift_x)
+            np.subtract(y, mean_y, out=shift_y)
+            np.multiply(shift_x, shift_x, out=work)
+            work *= coef_a
+            shift_x *= shift_y
+            shift_x *= coef_2b
+            work += shift_x
+            shift_y *= shift_y
+            shift_y *= coef_c
+            work += shift_y
+            np.negative(work, out=work)
+            np.exp(work, out=work)
+            work *= amplitude
+            out += work
+        return out
+
+    def estimate(self, explanatory: Union[np.ndarray, Tuple[np.ndarray, np.ndarray]], data: np.ndarray) -> bool:
+        x, y = [np.ravel(arr) for arr in np.broadcast_arrays(explanatory[0], explanatory[1])]
+        z = np.ravel(data)
+        valid = np.isfinite(z)
+        if np.sum(valid) < 3:
+            return False
+        x, y, z = x[valid], y[valid], z[valid]
+
+        peak_index = int(np.argmax(z))
+        peak = z[peak_index]
+        if peak <= 0:
+            return False
+        mean_x, mean_y = x[peak_index], y[peak_index]
+
+        # ピークから最も近い半値以下の画素までの距離を HWHM とみなし、sigma の上限を決める
+        dist_sq = (x - mean_x) ** 2 + (y - mean_y) ** 2
+        pixel_size = np.sqrt(np.min(dist_sq[dist_sq > 0])) if np.any(dist_sq > 0) else 1.0
+        below_half = z < peak / 2
+        hwhm = np.sqrt(np.min(dist_sq[below_half])) if np.any(below_half) else pixel_size
+        sigma_0 = max(hwhm / np.sqrt(2 * np.log(2)), pixel_size)
+        max_sigma = sigma_0 * self.ESTIMATE_MAX_SIGMA_RATIO
+
+        # ピークから見て方向毎に最初に半値を下回るまでの画素だけを使う。
+        # 重なった隣の光源の半値以上の領域は、間に半値以下の画素があれば含まれない
+        sector = np.floor((np.arctan2(y - mean_y, x - mean_x) + np.pi) / (2 * np.pi) * self.ESTIMATE_SECTORS)
+        sector = np.clip(sector.astype(np.int64), 0, self.ESTIMATE_SECTORS - 1)
+        sector_limit = np.full(self.ESTIMATE_SECTORS, (max_sigma * np.sqrt(2 * np.log(2))) ** 2)
+        np.minimum.at(sector_limit, sector[below_half], dist_sq[below_half])
+        in_region = (dist_sq < sector_limit[sector]) & (~below_half)
+
+        weight = z[in_region]
+        mean_x = np.sum(weight * x[in_region]) / np.sum(weight)
+        mean_y = np.sum(weight * y[in_region]) / np.sum(weight)
+        shift_x = x[in_region] - mean_x
+        shift_y = y[in_region] - mean_y
+        cov = np.array([[np.sum(weight * shift_x ** 2), np.sum(weight * shift_x * shift_y)],
+                        [np.sum(weight * shift_x * shift_y), np.sum(weight * shift_y ** 2)]]) / np.sum(weight)
+        cov = cov / self.HALF_MAX_MOMENT_RATIO + np.eye(2) * (pixel_size ** 2 / 12)
+
+        if np.linalg.det(cov) <= 0:
+            sigma_l = sigma_s = sigma_0
+            theta = 0.0
+        else:
+            sigma_l, sigma_s, theta = self._shape_from_quadratic(np.linalg.inv(cov) / 2)
+        # 推定した寄与は残差から差し引くので、広がり過ぎて他の光源を消さないようにする
+        sigma_l = min(sigma_l, max_sigma)
+        sigma_s = min(sigma_s, max_sigma)
+
+        norm = peak * 2 * np.pi * sigma_l * sigma_s
+        self.set_free_values_in_range([norm, mean_x, mean_y, sigma_l, sigma_s, theta])
+        return True
+
+    @staticmethod
+    def _shape_from_quadratic(quad: np.ndarray) -> Tuple[float, float, float]:
+        # f_core の指数部 a dx^2 + 2b dx dy + c dy^2 の係数から (sigma_l, sigma_s, theta) を逆算する
+        coef_a, coef_b, coef_c = quad[0, 0], quad[0, 1], quad[1, 1]
+        total = coef_a + coef_c
+        sin_2 = np.clip(2 * coef_b / total, -1.0, 1.0)
+        cos_2 = np.sqrt(1 - sin_2 ** 2)
+        if coef_a > coef_c:
+            # sigma_l >= sigma_s となる符号を選ぶ
+            cos_2 = -cos_2
+        diff = (coef_a - coef_c) / cos_2 if cos_2 != 0 else 0.0
+        inv_l_sq = total + diff
+        inv_s_sq = total - diff
+        return float(np.sqrt(1 / inv_l_sq)), float(np.sqrt(1 / inv_s_sq)), float(np.arctan2(sin_2, cos_2) / 2)
+
+    @classmethod
+    def window_from_values(cls, values: Sequence[float], n_sigma: float) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        _, mean_x, mean_y, sigma_l, sigma_s, theta = values
         sin_sq = np.sin(theta) ** 2
         cos_sq = np.cos(theta) ** 2
         sin_2 = np.sin(2*theta)
@@ -52,15 +184,74 @@ class Gauss(BaseFunction):
         coef_a = cos_sq / (2 * sigma_l ** 2) + sin_sq / (2 * sigma_s ** 2)
         coef_b = sin_2 / (4 * sigma_l ** 2) + sin_2 / (4 * sigma_s ** 2)
         coef_c = sin_sq / (2 * sigma_l ** 2) + cos_sq / (2 * sigma_s ** 2)
+        det = coef_a * coef_c - coef_b ** 2
+        if (not np.isfinite(det)) or (det <= 0):
+            # 指数部が正定値でなければ局在しない
+            return None
+
+        # 指数部が n_sigma**2 / 2 となる楕円の外接矩形
+        level = n_sigma ** 2 / 2
+        half_width = np.sqrt(level * np.array([coef_c, coef_a]) / det)
+        return np.array([mean_x, mean_y]), half_width
+
+    @classmethod
+    def has_jac(cls) -> bool:
+        return True
+
+    @classmethod
+    def jac_from_values(cls, explanatory: Union[np.ndarray, Tuple[np.ndarray, np.ndarray]],
+                        values: Sequence[float]) -> Optional[np.ndarray]:
+        x, y = explanatory
+        return Gauss.jac_core(x, y, *values)
+
+    @staticmethod
+    def jac_core(x: np.ndarray, y: np.ndarray,
+                 norm: float, mean_x: float, mean_y: float,
+                 sigma_l: float, sigma_s: float, theta: float) -> np.ndarray:
+        # f_core の各パラメータによる偏微分 (shape: (6, *x.shape))
+        sin_sq = np.sin(theta) ** 2
+        cos_sq = np.cos(theta) ** 2
+        sin_2 = np.sin(2*theta)
+        cos_2 = np.cos(2*theta)
+        inv_l_sq = 1 / sigma_l ** 2
+        inv_s_sq = 1 / sigma_s ** 2
+
+        coef_a = cos_sq * inv_l_sq / 2 + sin_sq * inv_s_sq / 2
+        coef_b = sin_2 * inv_l_sq / 4 + sin_2 * inv_s_sq / 4
+        coef_c = sin_sq * inv_l_sq / 2 + cos_sq * inv_s_sq / 2
 
         shift_x = x - mean_x
         shift_y = y - mean_y
-        exp = coef_a * shift_x**2 + 2 * coef_b * shift_x * shift_y + coef_c * shift_y**2
+        sq_x = shift_x**2
+        cross = 2 * shift_x * shift_y
+        sq_y = shift_y**2
+        exp = coef_a * sq_x + coef_b * cross + coef_c * sq_y
 
-        return norm / (2 * np.pi * sigma_s * sigma_l) * np.exp(-exp)
+        unit = np.exp(-exp) / (2 * np.pi * sigma_s * sigma_l)
+        value = norm * unit
+
+        # d(exp)/d(coef) の組み合わせ
+        d_exp_l = -(cos_sq * sq_x + sin_2 / 2 * cross + sin_sq * sq_y) / sigma_l ** 3
+        d_exp_s = -(sin_sq * sq_x + sin_2 / 2 * cross + cos_sq * sq_y) / sigma_s ** 3
+        d_exp_theta = (sin_2 * (inv_s_sq - inv_l_sq) / 2 * sq_x
+                       + cos_2 * (inv_l_sq + inv_s_sq) / 2 * cross
+                       + sin_2 * (inv_l_sq - inv_s_sq) / 2 * sq_y)
+
+        jac = np.empty((6,) + np.shape(value), dtype=np.float64)
+        jac[0] = unit
+        jac[1] = value * (2 * coef_a * shift_x + 2 * coef_b * shift_y)
+        jac[2] = value * (2 * coef_b * shift_x + 2 * coef_c * shift_y)
+        jac[3] = -value * (1 / sigma_l + d_exp_l)
+        jac[4] = -value * (1 / sigma_s + d_exp_s)
+        jac[5] = -value * d_exp_theta
+        return jac
 
 
 class Constant(BaseFunction):
+    # 背景とみなすパーセンタイル
+    BACKGROUND_PERCENTILE = 50.0
+    LINEAR_PARAM_INDEX = 0
+
     def __init__(self, fid: int):
         super().__init__(fid)
         self._parameters = [FuncParameter("const", 0.0, (-1e8, 1e8))]
@@ -80,5 +271,42 @@ class Constant(BaseFunction):
     def feature_point(self) -> Optional[np.ndarray]:
         return None
 
+    def estimate(self, explanatory: Union[np.ndarray, Tuple[np.ndarray, np.ndarray]], data: np.ndarray) -> bool:
+        if not np.any(np.isfinite(data)):
+            return False
+        self.set_free_values_in_range([np.nanpercentile(data, self.BACKGROUND_PERCENTILE)])
+        return True
+
     def f(self, explanatory: Union[np.ndarray, Tuple[np.ndarray, np.ndarray]]) -> np.ndarray:
-        return explanatory[0] * 0 + self._parameters[0].value
+        return Constant.f_from_values(explanatory, [self._parameters[0].value])
+
+    @classmethod
+    def f_from_values(cls, explanatory: Union[np.ndarray, Tuple[np.ndarray, np.ndarray]],
+                      values: Sequence[float]) -> np.ndarray:
+        # x が (1, nx) のように broadcast される形でも画素数分の配列にする
+        x, _ = np.broadcast_arrays(explanatory[0], explanatory[1])
+        return Constant.f_core(x, *values)
+
+    @staticmethod
+    def f_core(x: np.ndarray, const: float) -> np.ndarray:
+        return np.full(np.shape(x), const, dtype=np.float64)
+
+    @classmethod
+    def f_batch(cls, explanatory: Union[np.ndarray, Tuple[np.ndarray, np.ndarray]],
+                values: np.ndarray, out: np.ndarray, scratch: Optional[List[np.ndarray]] = None) -> np.ndarray:
+        out += np.sum(values[:, 0])
+        return out
+
+    @classmethod
+    def has_jac(cls) -> bool:
+        return True
+
+    @classmethod
+    def jac_from_values(cls, explanatory: Union[np.ndarray, Tuple[np.ndarray, np.ndarray]],
+                        values: Sequence[float]) -> Optional[np.ndarray]:
+        x, _ = np.broadcast_arrays(explanatory[0], explanatory[1])
+        return Constant.jac_core(x, *values)
+
+    @staticmethod
+    def jac_core(x: np.ndarray, const: float) -> np.ndarray:
+        return np.ones((1,) + np.shape(x), dtype=np.float64)
@@ -19,6 +19,10 @@ from grapihx.cui.commands.remove_command import RemoveCommand
 from grapihx.cui.commands.save_command import SaveCommand
 from grapihx.cui.commands.set_command import SetCommand
 from grapihx.cui.commands.set_data_command import SetDataCommand
+from grapihx.cui.commands.fit_stream_command import FitStreamCommand
+from grapihx.cui.commands.guess_command import GuessCommand
+from grapihx.cui.commands.stats_command import StatsCommand
+from grapihx.cui.commands.multistart_command import MultiStartCommand
 
 _COM_TYPE_TO_COM_MAP: Dict[CuiMainCommandType, Type[BaseCommand]] = {
     CuiMainCommandType.HELP: HelpCommand,
@@ -31,6 +35,10 @@ _COM_TYPE_TO_COM_MAP: Dict[CuiMainCommandType, Type[BaseCommand]] = {
     CuiMainCommandType.SAVE: SaveCommand,
     CuiMainCommandType.SET: SetCommand,
     CuiMainCommandType.SET_DATA: SetDataCommand,
+    CuiMainCommandType.FIT_STREAM: FitStreamCommand,
+    CuiMainCommandType.GUESS: GuessCommand,
+    CuiMainCommandType.STATS: StatsCommand,
+    CuiMainCommandType.MULTISTART: MultiStartCommand,
 }
 
 
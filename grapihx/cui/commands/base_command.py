@@ -1,5 +1,8 @@
 import abc
+from typing import Optional
 from typing import List
+from typing import Dict
+from typing import Tuple
 from typing import Union
 from enum import Enum, auto
 
@@ -20,6 +23,10 @@ class CuiMainCommandType(Enum):
     SAVE = auto()
     SET = auto()
     SET_DATA = auto()
+    FIT_STREAM = auto()
+    GUESS = auto()
+    STATS = auto()
+    MULTISTART = auto()
 
 
 # noinspection PyArgumentList
@@ -31,6 +38,7 @@ class SetSubCommandType(Enum):
     DEPENDENCY = auto()
     GLOBAL_DEPENDENCY = auto()
     DEPENDENCY_COEF = auto()
+    SOLVER = auto()
 
     @staticmethod
     def show_available() -> List[str]:
@@ -56,3 +64,15 @@ class BaseCommand(metaclass=abc.ABCMeta):
     @abc.abstractmethod
     def check(self):
         pass
+
+    def _split_options(self, com_args: Optional[List[ComArgType]] = None) -> Tuple[List[ComArgType], Dict[str, str]]:
+        # key=value の形の引数をオプションとして取り出す (key は小文字にする)。com_args を省略すると全引数
+        args = []
+        options = {}
+        for arg in self.com_args if com_args is None else com_args:
+            if isinstance(arg, str) and ("=" in arg):
+                key, value = arg.split("=", 1)
+                options[key.lower()] = value
+                continue
+            args.append(arg)
+        return args, options
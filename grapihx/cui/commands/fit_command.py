@@ -1,6 +1,7 @@
 from typing import List
 
 from fit import Fit
+from base_exceptions import FitterException
 from grapihx.cui.commands.base_command import BaseCommand
 from grapihx.cui.commands.plot_command import PlotCommand
 from grapihx.cui.commands.show_info_command import ShowInfoCommand
@@ -13,6 +14,9 @@ from grapihx.cui.exceptions.exception import CommandExecutionException
 class FitCommand(BaseCommand):
     PLOT_COM = PlotCommand([])
     SHOW_INFO_COM = ShowInfoCommand([])
+    # full: 前回の解を使わずに全体をフィットする, staged: 変更された関数を先にフィットしてから全体をフィットする,
+    # quick: 変更された関数だけをフィットする, pyramid: 縮小した画像で粗い順にフィットしてから全体をフィットする (2-D のみ)
+    MODES = ["full", "staged", "quick", "pyramid"]
 
     def __init__(self, com_args: List[ComArgType]):
         super().__init__(com_args)
@@ -22,16 +26,39 @@ class FitCommand(BaseCommand):
         return CuiMainCommandType.FIT
 
     def execute(self, fitter: Fit):
+        # ex. fit
+        # ex. fit full
+        # ex. fit staged
+        # ex. fit quick
+        # ex. fit pyramid
+        # ex. fit pyramid 4
         fitter.runtime_check()
+        mode = self.com_args[0] if len(self.com_args) >= 1 else ""
         try:
-            opt_para, opt_cov = fitter.curve_fit()
-        except RuntimeError as e:
+            if mode == "full":
+                opt_para, opt_cov = fitter.curve_fit()
+            elif mode == "pyramid":
+                opt_para, opt_cov = fitter.pyramid_fit(*self.com_args[1:])
+            else:
+                opt_para, opt_cov = fitter.incremental_fit(staged=(mode in ["staged", "quick"]),
+                                                           polish=(mode != "quick"))
+        except (RuntimeError, FitterException) as e:
             raise CommandExecutionException("最適化に失敗しました。: {}".format(e))
         else:
             fitter.fl.set_values(*opt_para)
+            fitter.mark_fitted()
             self.SHOW_INFO_COM.execute(fitter)
             self.PLOT_COM.execute(fitter)
 
     def check(self):
-        if len(self.com_args) != 0:
-            raise CommandParseException("不明な引数が渡されました: {}".format(self.com_args))
+        if len(self.com_args) == 0:
+            return
+        if self.com_args[0] == "pyramid":
+            if len(self.com_args) > 2:
+                raise CommandParseException("コマンドの長さが不正です: {}".format(self.com_args))
+            if (len(self.com_args) == 2) and ((not isinstance(self.com_args[1], int)) or (self.com_args[1] < 1)):
+                raise CommandParseException("段数は 1 以上の整数で指定してください: {}".format(self.com_args[1]))
+            return
+        if (len(self.com_args) != 1) or (self.com_args[0] not in self.MODES):
+            raise CommandParseException("不明な引数が渡されました: {} (available is {})"
+                                        .format(self.com_args, self.MODES))
@@ -0,0 +1,58 @@
+from typing import List
+
+from fit import Fit
+from warm_start import WarmStartPolicy
+from utils import enum_parser
+from base_exceptions import FitterException
+from grapihx.cui.commands.base_command import BaseCommand
+from grapihx.cui.commands.base_command import CuiMainCommandType
+from grapihx.cui.commands.base_command import ComArgType
+from grapihx.cui.exceptions.exception import CommandParseException
+from grapihx.cui.exceptions.exception import CommandExecutionException
+
+
+class FitStreamCommand(BaseCommand):
+    def __init__(self, com_args: List[ComArgType]):
+        super().__init__(com_args)
+
+    @classmethod
+    def get_command_type(cls) -> CuiMainCommandType:
+        return CuiMainCommandType.FIT_STREAM
+
+    def execute(self, fitter: Fit):
+        # ex. fit_stream frames/*.npy result.csv
+        # ex. fit_stream frames/*.npy result.csv 4
+        # ex. fit_stream frames/*.npy result.csv 4 previous
+        pattern, output_path = self.com_args[0], self.com_args[1]
+        read_ahead = 2
+        if len(self.com_args) >= 3:
+            read_ahead = self.com_args[2]
+        warm_start = WarmStartPolicy.NONE
+        if len(self.com_args) == 4:
+            warm_start = WarmStartPolicy(enum_parser.parse_enum(self.com_args[3], WarmStartPolicy))
+
+        try:
+            fitted_num = fitter.fit_stream(pattern, output_path, read_ahead, warm_start)
+        except FitterException as e:
+            raise CommandExecutionException("ストリームフィットに失敗しました: {}".format(e))
+        print("{} 個のファイルをフィットしました: {}".format(fitted_num, output_path))
+
+    def check(self):
+        if not (2 <= len(self.com_args) <= 4):
+            raise CommandParseException("ファイルのパターンと出力先を指定してください: {}".format(self.com_args))
+
+        if not isinstance(self.com_args[0], str):
+            raise CommandParseException("ファイルのパターンは文字列で指定してください: {}".format(self.com_args[0]))
+
+        if not isinstance(self.com_args[1], str):
+            raise CommandParseException("出力先は文字列で指定してください: {}".format(self.com_args[1]))
+
+        if len(self.com_args) >= 3:
+            if (not isinstance(self.com_args[2], int)) or (self.com_args[2] < 1):
+                raise CommandParseException("先読み数は 1 以上の整数で指定してください: {}".format(self.com_args[2]))
+
+        if len(self.com_args) == 4:
+            policy = WarmStartPolicy(enum_parser.parse_enum(str(self.com_args[3]), WarmStartPolicy))
+            if policy is WarmStartPolicy.DEFAULT:
+                raise CommandParseException("不明なウォームスタートの方式です: {} (available is {})"
+                                            .format(self.com_args[3], [p.name.lower() for p in WarmStartPolicy][1:]))
@@ -0,0 +1,41 @@
+from typing import List
+
+from fit import Fit
+from grapihx.cui.commands.base_command import BaseCommand
+from grapihx.cui.commands.show_info_command import ShowInfoCommand
+from grapihx.cui.commands.base_command import CuiMainCommandType
+from grapihx.cui.commands.base_command import ComArgType
+from grapihx.cui.exceptions.exception import CommandParseException
+from grapihx.cui.exceptions.exception import CommandExecutionException
+
+
+class GuessCommand(BaseCommand):
+    SHOW_INFO_COM = ShowInfoCommand([])
+
+    def __init__(self, com_args: List[ComArgType]):
+        super().__init__(com_args)
+
+    @classmethod
+    def get_command_type(cls) -> CuiMainCommandType:
+        return CuiMainCommandType.GUESS
+
+    def execute(self, fitter: Fit):
+        # ex. guess
+        # ex. guess gauss_1
+        unique_name = self.com_args[0] if len(self.com_args) == 1 else None
+        estimated = fitter.estimate_initial_values(unique_name)
+        if len(estimated) == 0:
+            raise CommandExecutionException("初期値を推定できる関数がありませんでした")
+        self.SHOW_INFO_COM.execute(fitter)
+
+    def check(self):
+        if len(self.com_args) == 0:
+            return
+
+        if len(self.com_args) == 1:
+            if not isinstance(self.com_args[0], str):
+                # function name must be string
+                raise CommandParseException("関数名は文字列で指定してください: {}".format(self.com_args))
+            return
+
+        raise CommandParseException("コマンドの長さが不正です: {}".format(self.com_args))
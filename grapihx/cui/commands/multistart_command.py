@@ -0,0 +1,109 @@
+from typing import List
+from typing import Dict
+from typing import Tuple
+
+from fit import Fit
+from multistart import MultiStartOptions
+from multistart import SeedStrategy
+from parallel_fit import ParallelFitExecutor
+from utils import enum_parser
+from base_exceptions import FitterException
+from grapihx.cui.commands.base_command import BaseCommand
+from grapihx.cui.commands.plot_command import PlotCommand
+from grapihx.cui.commands.show_info_command import ShowInfoCommand
+from grapihx.cui.commands.base_command import CuiMainCommandType
+from grapihx.cui.commands.base_command import ComArgType
+from grapihx.cui.exceptions.exception import CommandParseException
+from grapihx.cui.exceptions.exception import CommandExecutionException
+
+
+class MultiStartCommand(BaseCommand):
+    PLOT_COM = PlotCommand([])
+    SHOW_INFO_COM = ShowInfoCommand([])
+    # option -> (型, 最小値)
+    OPTIONS: Dict[str, Tuple[type, float]] = {
+        "width": (float, 0.0),
+        "probe": (int, 1),
+        "prune": (float, 1.0),
+        "keep": (float, 0.0),
+        "budget": (float, 0.0),
+        "workers": (int, 1),
+        "seed": (int, 0),
+    }
+
+    def __init__(self, com_args: List[ComArgType]):
+        super().__init__(com_args)
+
+    @classmethod
+    def get_command_type(cls) -> CuiMainCommandType:
+        return CuiMainCommandType.MULTISTART
+
+    def execute(self, fitter: Fit):
+        # ex. multistart
+        # ex. multistart 16
+        # ex. multistart 16 perturb width=0.2
+        # ex. multistart 32 lhs budget=60 workers=4 seed=0
+        args, options = self._split_options()
+        ms_options = MultiStartOptions()
+        if len(args) >= 1:
+            ms_options.n_starts = args[0]
+        if len(args) == 2:
+            ms_options.strategy = SeedStrategy(enum_parser.parse_enum(args[1], SeedStrategy))
+        if "width" in options:
+            ms_options.width = float(options["width"])
+        if "probe" in options:
+            ms_options.probe_nfev = int(options["probe"])
+        if "prune" in options:
+            ms_options.prune_factor = float(options["prune"])
+        if "keep" in options:
+            ms_options.keep_fraction = float(options["keep"])
+        if "budget" in options:
+            ms_options.time_budget = float(options["budget"])
+        if "seed" in options:
+            ms_options.seed = int(options["seed"])
+        executor = None
+        if "workers" in options:
+            executor = ParallelFitExecutor(int(options["workers"]))
+
+        fitter.runtime_check()
+        try:
+            result = fitter.multistart(ms_options, executor)
+        except (RuntimeError, FitterException) as e:
+            raise CommandExecutionException("最適化に失敗しました。: {}".format(e))
+        finally:
+            if executor is not None:
+                executor.close()
+
+        for line in result.to_lines():
+            print(line)
+        fitter.fl.set_values(*result.params)
+        fitter.mark_fitted()
+        self.SHOW_INFO_COM.execute(fitter)
+        self.PLOT_COM.execute(fitter)
+
+    def check(self):
+        args, options = self._split_options()
+        if len(args) > 2:
+            raise CommandParseException("コマンドの長さが不正です: {}".format(self.com_args))
+
+        if len(args) >= 1:
+            if (not isinstance(args[0], int)) or (args[0] < 1):
+                raise CommandParseException("初期値の数は 1 以上の整数で指定してください: {}".format(args[0]))
+
+        if len(args) == 2:
+            strategy = SeedStrategy(enum_parser.parse_enum(str(args[1]), SeedStrategy))
+            if strategy is SeedStrategy.DEFAULT:
+                raise CommandParseException("不明な初期値の生成方法です: {} (available is {})"
+                                            .format(args[1], SeedStrategy.show_available()))
+
+        for key, value in options.items():
+            if key not in self.OPTIONS:
+                raise CommandParseException("不明なオプションです: {} (available is {})"
+                                            .format(key, list(self.OPTIONS.keys())))
+            value_type, minimum = self.OPTIONS[key]
+            try:
+                number = value_type(value)
+            except ValueError:
+                raise CommandParseException("オプションの値が不正です: {}={}".format(key, value))
+            if number < minimum:
+                raise CommandParseException("オプションの値は {} 以上で指定してください: {}={}".format(minimum, key, value))
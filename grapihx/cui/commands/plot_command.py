@@ -6,6 +6,7 @@ import matplotlib.pyplot as plt
 import numpy as np
 
 from fit import Fit
+from regular_grid import RegularGrid
 from grapihx.cui.commands.base_command import BaseCommand
 from grapihx.cui.commands.base_command import CuiMainCommandType
 from grapihx.cui.commands.base_command import ComArgType
@@ -27,10 +28,19 @@ class PlotCommand(BaseCommand):
         data = fitter.data
         f_points = fitter.get_feature_points()
         estimated = fitter.f_without_assigning()
-        residual = data - estimated
+        residual = fitter.get_residual()
         dim = fitter.get_dim()
 
+        # フィットに使わなかった画素は描画しない
+        valid = fitter.get_valid_mask(data)
+        if valid is not None:
+            data = np.ma.masked_where(~valid, data)
+            residual = np.ma.masked_invalid(residual)
+
         if dim == 2:
+            if isinstance(expl, RegularGrid):
+                # 描画には同じ shape の座標が必要なのでここで実体化する
+                expl = expl.meshgrid()
             self._plot_2d(data, estimated, residual, expl[0], expl[1], feature_points=f_points)
         elif dim == 1:
             assert False, "未実装"
@@ -1,6 +1,8 @@
 from typing import List
 
 from fit import Fit
+from solvers import SolverType
+from solvers import SolverOptions
 from functions.function_parameters import FuncParameter
 from functions.function_parameters import ParamState
 from utils import enum_parser
@@ -13,6 +15,10 @@ from grapihx.cui.exceptions.exception import CommandExecutionException
 
 
 class SetCommand(BaseCommand):
+    SOLVER_OPTION_KEYS = ["ftol", "xtol", "max_nfev", "tr_solver", "sparsity_sigma", "varpro", "chunk_size"]
+    INT_SOLVER_OPTION_KEYS = ["max_nfev", "chunk_size"]
+    ON_OFF = ["on", "off"]
+
     def __init__(self, com_args: List[ComArgType]):
         super().__init__(com_args)
 
@@ -21,6 +27,10 @@ class SetCommand(BaseCommand):
         return CuiMainCommandType.SET
 
     def execute(self, fitter: Fit):
+        if self.com_args[0] == SetSubCommandType.SOLVER:
+            self._execute_solver_com(fitter)
+            return
+
         if self._is_short_state_com():
             self._execute_short_state_com(fitter)
             return
@@ -34,7 +44,7 @@ class SetCommand(BaseCommand):
             self._execute_bounds_com(objective_param)
             return
         if self.com_args[0] == SetSubCommandType.STATE:
-            self._execute_state_com(objective_param)
+            self._execute_state_com(fitter, objective_param)
             return
         if self.com_args[0] == SetSubCommandType.DEPENDENCY:
             self._execute_dependency_com(objective_param)
@@ -53,7 +63,10 @@ class SetCommand(BaseCommand):
     def _execute_bounds_com(self, objective_param: FuncParameter):
         objective_param.param_range = (self.com_args[4], self.com_args[5])
 
-    def _execute_state_com(self, objective_param: FuncParameter):
+    def _execute_state_com(self, fitter: Fit, objective_param: FuncParameter):
+        if self.com_args[3] == ParamState.GLOBAL_DEPENDED:
+            # 依存先が無ければ状態を変えずに失敗させる
+            self._get_param(fitter, self.com_args[4], self.com_args[5])
         objective_param.state = self.com_args[3]
 
         if self.com_args[3] == ParamState.FIX:
@@ -73,7 +86,8 @@ class SetCommand(BaseCommand):
             return
 
         if self.com_args[3] == ParamState.GLOBAL_DEPENDED:
-            raise CommandExecutionException("この機能は未実装です")
+            objective_param.set_global_dependency(self.com_args[4], self.com_args[5],
+                                                  objective_param.depend_coef, objective_param.depend_offset)
 
     def _execute_short_state_com(self, fitter: Fit):
         found, target_func, index = fitter.try_get_function(self.com_args[1])
@@ -90,20 +104,45 @@ class SetCommand(BaseCommand):
             objective_param.depend_coef = self.com_args[4]
 
     def _execute_global_dependency_com(self, fitter: Fit, objective_param: FuncParameter):
-        raise CommandExecutionException("この機能は未実装です: {}".format(self.com_args[0]))
+        self._get_param(fitter, self.com_args[3], self.com_args[4])
+        depend_coef = float(self.com_args[5]) if len(self.com_args) >= 6 else objective_param.depend_coef
+        depend_offset = float(self.com_args[6]) if len(self.com_args) == 7 else objective_param.depend_offset
+        objective_param.set_global_dependency(self.com_args[3], self.com_args[4], depend_coef, depend_offset)
 
     def _execute_dependency_coef_com(self, objective_param: FuncParameter):
         objective_param.depend_coef = self.com_args[3]
 
+    def _execute_solver_com(self, fitter: Fit):
+        # 指定されなかったオプションは既定値に戻す
+        options = SolverOptions(SolverType(enum_parser.parse_enum(self.com_args[1], SolverType)))
+        _, option_values = self._split_options(self.com_args[2:])
+        for key, value in option_values.items():
+            if key in self.INT_SOLVER_OPTION_KEYS:
+                setattr(options, key, int(value))
+            elif key == "tr_solver":
+                options.tr_solver = value.lower()
+            elif key == "varpro":
+                options.variable_projection = value.lower() == "on"
+            else:
+                setattr(options, key, float(value))
+        fitter.solver_options = options
+        print("ソルバーを設定しました: {}".format(options))
+
     def check(self):
         # ex. set value gauss_0 norm 12.22
         # ex. set bounds const_0 const -10 10
         # ex. set bounds const_0 const -10, 10
+        if (len(self.com_args) > 0) and (self.com_args[0] == SetSubCommandType.SOLVER):
+            self._check_solver()
+            return
+
         if self._is_short_state_com():
             self._check_short_state()
             return
 
-        if not (4 <= len(self.com_args) <= 6):
+        # global_dependency のみ係数とオフセットの 2 つを取れる
+        max_len = 7 if (len(self.com_args) > 0) and (self.com_args[0] == SetSubCommandType.GLOBAL_DEPENDENCY) else 6
+        if not (4 <= len(self.com_args) <= max_len):
             raise CommandParseException("コマンドの長さが不正です: {}".format(self.com_args))
 
         if not isinstance(self.com_args[0], SetSubCommandType):
@@ -181,7 +220,13 @@ class SetCommand(BaseCommand):
                         raise CommandParseException("依存係数は数値で指定してください: {}".format(self.com_args[4]))
 
             if state_enum is ParamState.GLOBAL_DEPENDED:
-                raise CommandParseException("この機能は未実装です: {}".format(self.com_args[3]))
+                # ex. set state gauss_1 sigma_l global_depended gauss_0 sigma_l
+                if len(self.com_args) != 6:
+                    raise CommandParseException("コマンドの長さが不正です: {}".format(self.com_args))
+                if not isinstance(self.com_args[4], str):
+                    raise CommandParseException("依存先の関数名は文字列で指定してください: {}".format(self.com_args[4]))
+                if not isinstance(self.com_args[5], str):
+                    raise CommandParseException("依存先のパラメータは文字列で指定してください: {}".format(self.com_args[5]))
             return
 
         if self.com_args[0] == SetSubCommandType.DEPENDENCY:
@@ -201,9 +246,10 @@ class SetCommand(BaseCommand):
             return
 
         if self.com_args[0] == SetSubCommandType.GLOBAL_DEPENDENCY:
-            # ex. set global_depend gauss_0 sigma_l gauss_1 sigma_l
-            # ex. set global_depend gauss_0 sigma_l gauss_1 sigma_l 0.5
-            if not (5 <= len(self.com_args) <= 6):
+            # ex. set global_dependency gauss_0 sigma_l gauss_1 sigma_l
+            # ex. set global_dependency gauss_0 sigma_l gauss_1 sigma_l 0.5
+            # ex. set global_dependency gauss_0 mean_x gauss_1 mean_x 1 12.5
+            if not (5 <= len(self.com_args) <= 7):
                 raise CommandParseException("コマンドの長さが不正です: {}".format(self.com_args))
             if not isinstance(self.com_args[3], str):
                 # dependency function name must be string
@@ -212,11 +258,16 @@ class SetCommand(BaseCommand):
                 # parameter name must be string
                 raise CommandParseException("パラメータ名は文字列で指定してください: {}".format(self.com_args[4]))
 
-            if len(self.com_args) == 6:
+            # 整数で書いた値は int として渡ってくる
+            if len(self.com_args) >= 6:
                 # With depending coefficient
-                if not isinstance(self.com_args[5], float):
+                if not isinstance(self.com_args[5], (int, float)):
                     # Depending Coefficient must be numeric
-                    raise CommandParseException("依存係数は数値で指定指定してください: {}".format(self.com_args[5]))
+                    raise CommandParseException("依存係数は数値で指定してください: {}".format(self.com_args[5]))
+            if len(self.com_args) == 7:
+                # With depending offset
+                if not isinstance(self.com_args[6], (int, float)):
+                    raise CommandParseException("依存オフセットは数値で指定してください: {}".format(self.com_args[6]))
             return
 
         if self.com_args[0] == SetSubCommandType.DEPENDENCY_COEF:
@@ -251,6 +302,46 @@ class SetCommand(BaseCommand):
             return
         raise CommandParseException("以下のコマンドのみ許可されています: {}".format(self._get_arrowed_short_state_list()))
 
+    def _check_solver(self):
+        # ex. set solver least_squares
+        # ex. set solver lm ftol=1e-10 max_nfev=200
+        # ex. set solver chunked chunk_size=1048576
+        if len(self.com_args) < 2:
+            raise CommandParseException("ソルバーを指定してください: (available is {})".format(SolverType.show_available()))
+        if not isinstance(self.com_args[1], str) or \
+                SolverType(enum_parser.parse_enum(self.com_args[1], SolverType)) is SolverType.DEFAULT:
+            raise CommandParseException("不明なソルバーです: {} (available is {})"
+                                        .format(self.com_args[1], SolverType.show_available()))
+
+        args, options = self._split_options(self.com_args[2:])
+        if len(args) > 0:
+            raise CommandParseException("オプションは key=value の形で指定してください: {}".format(self.com_args[2:]))
+        for key, value in options.items():
+            if key not in self.SOLVER_OPTION_KEYS:
+                raise CommandParseException("不明なオプションです: {} (available is {})"
+                                            .format(key, self.SOLVER_OPTION_KEYS))
+            if key == "tr_solver":
+                if value.lower() not in SolverOptions.TR_SOLVERS:
+                    raise CommandParseException("不明な tr_solver です: {} (available is {})"
+                                                .format(value, SolverOptions.TR_SOLVERS))
+                solver_type = SolverType(enum_parser.parse_enum(self.com_args[1], SolverType))
+                if (value.lower() == "exact") and (solver_type is SolverType.SPARSE):
+                    raise CommandParseException("sparse ソルバーでは tr_solver=exact は使えません (lsmr のみ)")
+                continue
+            if key == "varpro":
+                if value.lower() not in self.ON_OFF:
+                    raise CommandParseException("varpro は on か off で指定してください: {}".format(value))
+                solver_type = SolverType(enum_parser.parse_enum(self.com_args[1], SolverType))
+                if (value.lower() == "on") and (solver_type in [SolverType.SPARSE, SolverType.CHUNKED]):
+                    raise CommandParseException("変数射影は {} ソルバーと併用できません".format(solver_type.name.lower()))
+                continue
+            try:
+                number = int(value) if key in self.INT_SOLVER_OPTION_KEYS else float(value)
+            except ValueError:
+                raise CommandParseException("オプションの値は数値で指定してください: {}={}".format(key, value))
+            if number <= 0:
+                raise CommandParseException("オプションの値は正の数で指定してください: {}={}".format(key, value))
+
     def _is_short_state_com(self) -> bool:
         return len(self.com_args) == 3
 
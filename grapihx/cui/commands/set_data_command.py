@@ -1,8 +1,14 @@
+from typing import Optional
 from typing import List
+from typing import Dict
+from typing import Tuple
 
 import numpy as np
 
 from fit import Fit
+from regular_grid import RegularGrid
+from base_exceptions import FitterException
+from utils import data_loader
 from grapihx.cui.commands.base_command import BaseCommand
 from grapihx.cui.commands.base_command import CuiMainCommandType
 from grapihx.cui.commands.base_command import ComArgType
@@ -11,7 +17,9 @@ from grapihx.cui.exceptions.exception import CommandExecutionException
 
 
 class SetDataCommand(BaseCommand):
-    SUPPORTED_EXT = [".txt", ".csv", ".tsv"]
+    SUPPORTED_EXT = [".npy", ".txt", ".csv", ".tsv"]
+    # ex. set_data frame.npy rows=100:900 cols=::2 mmap=off mask=bad_pixels.npy
+    OPTION_KEYS = ["rows", "cols", "mmap", "mask"]
 
     def __init__(self, com_args: List[ComArgType]):
         super().__init__(com_args)
@@ -21,28 +29,53 @@ class SetDataCommand(BaseCommand):
         return CuiMainCommandType.SET_DATA
 
     def execute(self, fitter: Fit):
-        data_name = self.com_args[0]
-        data = None
-        if data_name.endswith(".npy"):
-            data = np.load(data_name)
-        elif any(map(data_name.endswith, SetDataCommand.SUPPORTED_EXT)):
-            data = np.loadtxt(data_name)
-        else:
+        args, options = self._split_options()
+        data_name = args[0]
+        if not any(map(data_name.endswith, SetDataCommand.SUPPORTED_EXT)):
             raise CommandExecutionException("その拡張子はサポートされていません: {}".format(data_name))
 
-        if not isinstance(data, np.ndarray):
-            raise CommandExecutionException("指定した変数の型が不正です: {}".format(type(data)))
+        crop = self._get_crop(options)
+        mmap_mode = options.get("mmap", "r")
+        if mmap_mode == "off":
+            mmap_mode = None
+
+        try:
+            data, source_shape = data_loader.load_data(data_name, mmap_mode, crop)
+        except (OSError, ValueError, FitterException) as e:
+            raise CommandExecutionException("データを読み込めませんでした: {}".format(e))
 
+        is_cropped = crop is not None
+        if crop is None:
+            crop = (slice(None), slice(None))
         mesh = None
-        if len(self.com_args) == 4:
-            mesh = np.linspace(*self.com_args[1:])
-        elif len(self.com_args) == 7:
-            x_lin = np.linspace(*self.com_args[1:4])
-            y_lin = np.linspace(*self.com_args[4:7])
-            mesh = tuple(np.meshgrid(x_lin, y_lin))
+        if len(args) == 4:
+            mesh = self._crop_axis(np.linspace(*args[1:]), source_shape, crop)
+        elif len(args) == 7:
+            x_lin = np.linspace(*args[1:4])[crop[1]]
+            y_lin = np.linspace(*args[4:7])[crop[0]]
+            mesh = RegularGrid(x_lin, y_lin)
+        elif is_cropped and (data.ndim == 2) and (len(source_shape) == 2):
+            # 切り出した場合は元のデータの画素座標を説明変数にする
+            x_lin = np.arange(source_shape[1], dtype=np.float64)[crop[1]]
+            y_lin = np.arange(source_shape[0], dtype=np.float64)[crop[0]]
+            mesh = RegularGrid(x_lin, y_lin)
+        elif is_cropped and (data.ndim == 1):
+            mesh = self._crop_axis(np.arange(int(np.prod(source_shape)), dtype=np.float64), source_shape, crop)
+
+        mask = None
+        if "mask" in options:
+            # 0 以外の画素をフィットに使う。データと同じ範囲を切り出す
+            try:
+                mask = np.asarray(data_loader.load_data(options["mask"], None, crop if is_cropped else None)[0]) != 0
+            except (OSError, ValueError, FitterException) as e:
+                raise CommandExecutionException("マスクを読み込めませんでした: {}".format(e))
+            if mask.shape != data.shape:
+                raise CommandExecutionException("マスクとデータの shape が一致しません: {} {}"
+                                                .format(mask.shape, data.shape))
 
         if not fitter.try_set_data(data, mesh):
             raise CommandExecutionException("指定した配列の次元数が不正です: {} {}".format(data.shape, mesh))
+        fitter.set_mask(mask)
 
     def check(self):
         if len(self.com_args) < 1:
@@ -51,19 +84,51 @@ class SetDataCommand(BaseCommand):
         if not isinstance(self.com_args[0], str):
             raise CommandParseException("変数名は文字列で指定してください: {}".format(self.com_args))
 
-        if len(self.com_args) == 4:
-            if not self._check_linspace_arg(self.com_args[1:]):
-                raise CommandParseException("説明変数のパラメータが不正です: {}".format(self.com_args[1:]))
-        elif len(self.com_args) == 7:
-            if not self._check_linspace_arg(self.com_args[1:4]):
-                raise CommandParseException("説明変数のパラメータが不正です: {}".format(self.com_args[1:4]))
-            if not self._check_linspace_arg(self.com_args[4:7]):
-                raise CommandParseException("説明変数のパラメータが不正です: {}".format(self.com_args[4:7]))
-        elif len(self.com_args) == 1:
+        args, options = self._split_options()
+        if len(args) == 4:
+            if not self._check_linspace_arg(args[1:]):
+                raise CommandParseException("説明変数のパラメータが不正です: {}".format(args[1:]))
+        elif len(args) == 7:
+            if not self._check_linspace_arg(args[1:4]):
+                raise CommandParseException("説明変数のパラメータが不正です: {}".format(args[1:4]))
+            if not self._check_linspace_arg(args[4:7]):
+                raise CommandParseException("説明変数のパラメータが不正です: {}".format(args[4:7]))
+        elif len(args) == 1:
             # ok
             pass
         else:
-            raise CommandParseException("コマンドの長さが不正です: ".format(self.com_args))
+            raise CommandParseException("コマンドの長さが不正です: {}".format(self.com_args))
+
+        for key, value in options.items():
+            if key not in SetDataCommand.OPTION_KEYS:
+                raise CommandParseException("不明なオプションです: {} (available is {})"
+                                            .format(key, SetDataCommand.OPTION_KEYS))
+            if key == "mmap":
+                if value not in ["r", "c", "off"]:
+                    raise CommandParseException("mmap には r, c, off のいずれかを指定してください: {}".format(value))
+                continue
+            if key == "mask":
+                if not any(map(value.endswith, SetDataCommand.SUPPORTED_EXT)):
+                    raise CommandParseException("その拡張子はサポートされていません: {}".format(value))
+                continue
+            try:
+                data_loader.parse_slice(value)
+            except ValueError:
+                raise CommandParseException("範囲の指定が不正です: {}={}".format(key, value))
+
+    @staticmethod
+    def _crop_axis(axis: np.ndarray, source_shape: Tuple[int, ...], crop: data_loader.CropType) -> np.ndarray:
+        # 1-D のデータの説明変数を、データと同じく切り出し前の shape (1 行のテキストなら (1, 列数)) の上で切り出す
+        if axis.size != int(np.prod(source_shape)):
+            return axis[crop[0]]
+        return axis.reshape(source_shape)[crop[:len(source_shape)]].reshape(-1)
+
+    @staticmethod
+    def _get_crop(options: Dict[str, str]) -> Optional[data_loader.CropType]:
+        if ("rows" not in options) and ("cols" not in options):
+            return None
+        return (data_loader.parse_slice(options.get("rows", ":")),
+                data_loader.parse_slice(options.get("cols", ":")))
 
     @staticmethod
     def _check_linspace_arg(args: list) -> bool:
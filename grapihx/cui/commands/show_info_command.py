@@ -42,11 +42,16 @@ class ShowInfoCommand(BaseCommand):
             print(self._SEP)
             for param in func.parameters:
                 param_rec = [func.name, func.u_name, param.name, param.state.name, param.value, *param.param_range]
-                if (param.state is ParamState.DEPENDED) or (param.state is ParamState.GLOBAL_DEPENDED):
-                    # GLOBAL_DEPENDED の時の依存先関数名はまだフィールドを用意していないので空文字
+                if param.state is ParamState.DEPENDED:
                     param_rec += ["", param.depend_parent, param.depend_coef]
                     print(self._INFO_D_TEMP.format(*param_rec))
                     continue
+                if param.state is ParamState.GLOBAL_DEPENDED:
+                    # オフセットがある場合は係数の後ろに付ける
+                    param_rec += [str(param.depend_func), param.depend_parent, param.depend_coef]
+                    offset = " {:+G}".format(param.depend_offset) if param.depend_offset != 0 else ""
+                    print(self._INFO_D_TEMP.format(*param_rec) + offset)
+                    continue
                 print(self._INFO_TEMP.format(*param_rec))
 
     def check(self):
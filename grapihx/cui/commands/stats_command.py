@@ -0,0 +1,51 @@
+from typing import List
+
+from fit import Fit
+from grapihx.cui.commands.base_command import BaseCommand
+from grapihx.cui.commands.base_command import CuiMainCommandType
+from grapihx.cui.commands.base_command import ComArgType
+from grapihx.cui.exceptions.exception import CommandParseException
+from grapihx.cui.exceptions.exception import CommandExecutionException
+
+
+class StatsCommand(BaseCommand):
+    _PROFILE = "profile"
+    _OFF = "off"
+
+    def __init__(self, com_args: List[ComArgType]):
+        super().__init__(com_args)
+
+    @classmethod
+    def get_command_type(cls) -> CuiMainCommandType:
+        return CuiMainCommandType.STATS
+
+    def execute(self, fitter: Fit):
+        # ex. stats
+        # ex. stats profile fit.prof
+        # ex. stats profile off
+        if len(self.com_args) == 2:
+            if self.com_args[1] == self._OFF:
+                fitter.profile_path = None
+                print("プロファイルを無効にしました")
+            else:
+                fitter.profile_path = self.com_args[1]
+                print("次のフィット 1 回分のプロファイルを書き出します: {}".format(fitter.profile_path))
+            return
+
+        if fitter.last_stats is None:
+            raise CommandExecutionException("フィットの統計情報がありません")
+        for line in fitter.last_stats.to_lines():
+            print(line)
+
+    def check(self):
+        if len(self.com_args) == 0:
+            return
+
+        if len(self.com_args) == 2:
+            if self.com_args[0] != self._PROFILE:
+                raise CommandParseException("不明な引数が渡されました: {}".format(self.com_args[0]))
+            if not isinstance(self.com_args[1], str):
+                raise CommandParseException("出力先は文字列で指定してください: {}".format(self.com_args[1]))
+            return
+
+        raise CommandParseException("コマンドの長さが不正です: {}".format(self.com_args))
@@ -0,0 +1,66 @@
+from dataclasses import dataclass
+from dataclasses import field
+from typing import Optional
+from typing import List
+from typing import Tuple
+
+from function_list import FunctionList
+from functions.gen_function_list import FUNCTION_MAP
+from functions.function_parameters import ParamState
+from base_exceptions import FitterException
+
+
+@dataclass
+class ParamSpec:
+    name: str
+    value: float
+    param_range: Tuple[float, float]
+    state: ParamState
+    depend_parent: Optional[str] = None
+    depend_coef: float = 1.0
+    depend_func: Optional[str] = None
+    depend_offset: float = 0.0
+
+
+@dataclass
+class FunctionSpec:
+    name: str
+    fid: int
+    parameters: List[ParamSpec] = field(default_factory=list)
+
+
+@dataclass
+class ModelSpec:
+    # プロセス間で受け渡すための FunctionList の pickle 可能な表現
+    functions: List[FunctionSpec] = field(default_factory=list)
+
+    @classmethod
+    def from_function_list(cls, function_list: FunctionList) -> "ModelSpec":
+        functions = []
+        for func in function_list.get_functions():
+            params = [ParamSpec(p.name, float(p.value), tuple(p.param_range), p.state, p.depend_parent, p.depend_coef,
+                                p.depend_func, p.depend_offset)
+                      for p in func.parameters]
+            functions.append(FunctionSpec(func.name(), func.fid, params))
+        return cls(functions)
+
+    def to_function_list(self) -> FunctionList:
+        funcs = []
+        for func_spec in self.functions:
+            f_type = FUNCTION_MAP.get(func_spec.name)
+            if f_type is None:
+                raise FitterException("指定された関数が見つかりませんでした: {}".format(func_spec.name))
+
+            func = f_type(func_spec.fid)
+            for param_spec in func_spec.parameters:
+                found, param = func.try_get_param(param_spec.name)
+                if not found:
+                    raise FitterException("指定されたパラメータがありません: {}, {}"
+                                          .format(func.unique_name(), param_spec.name))
+                param.value = param_spec.value
+                param.param_range = param_spec.param_range
+                param.state = param_spec.state
+                param.set_global_dependency(param_spec.depend_func, param_spec.depend_parent,
+                                            param_spec.depend_coef, param_spec.depend_offset)
+            funcs.append(func)
+        return FunctionList(funcs)
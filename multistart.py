@@ -0,0 +1,177 @@
+from dataclasses import dataclass
+from dataclasses import field
+from typing import Optional
+from typing import List
+from typing import Sequence
+from typing import Tuple
+from typing import Callable
+from enum import Enum, auto
+import time
+
+import numpy as np
+from scipy.stats import qmc
+
+from batch_fit import BatchFitResult
+from batch_fit import FitStatus
+from base_exceptions import FitterException
+
+
+# (初期値 (M, n_free), 評価回数の上限) を受け取り、各初期値からフィットした結果を返す
+StartRunner = Callable[[np.ndarray, Optional[int]], BatchFitResult]
+
+
+# noinspection PyArgumentList
+class SeedStrategy(Enum):
+    DEFAULT = 0
+    # 探索範囲のラテン超方格サンプリング
+    LHS = auto()
+    # 現在の値に正規乱数を加える
+    PERTURB = auto()
+
+    @staticmethod
+    def show_available() -> List[str]:
+        return [s.name.lower() for s in SeedStrategy][1:]
+
+
+# noinspection PyArgumentList
+class StartState(Enum):
+    DEFAULT = 0
+    RUNNING = auto()
+    CONVERGED = auto()
+    # 途中のコストが最良解から離れすぎていたので打ち切った
+    PRUNED = auto()
+    FAILED = auto()
+    # 時間の上限で打ち切った
+    TIMEOUT = auto()
+
+
+@dataclass
+class MultiStartOptions:
+    n_starts: int = 8
+    strategy: SeedStrategy = SeedStrategy.LHS
+    # 探索範囲の半幅 (現在の値に対する比、値が 0 に近い場合は絶対値)。
+    # 既定の境界 (±1e8 など) は広すぎて一様に撒いても意味がないので、境界と現在の値の周りの範囲の共通部分から選ぶ
+    width: float = 0.5
+    # 1 巡目の評価回数の上限。巡毎に BUDGET_GROWTH 倍にする
+    probe_nfev: int = 20
+    # コストが最良解のこの倍数を超えた初期値は打ち切る
+    prune_factor: float = 1.5
+    # 各巡の後に続ける初期値の割合 (コストの小さい順、最低 1 つ)
+    keep_fraction: float = 0.5
+    # 全体の時間の上限 (秒)。巡の間でのみ確認する
+    time_budget: Optional[float] = None
+    seed: Optional[int] = None
+
+    BUDGET_GROWTH = 4
+
+
+@dataclass
+class StartSummary:
+    index: int
+    seed: np.ndarray
+    params: np.ndarray
+    cost: float
+    state: StartState
+    nfev: int = 0
+    rounds: int = 0
+
+
+@dataclass
+class MultiStartResult:
+    params: np.ndarray
+    covariance: np.ndarray
+    cost: float
+    elapsed: float
+    # コストの小さい順
+    starts: List[StartSummary] = field(default_factory=list)
+
+    def to_lines(self) -> List[str]:
+        lines = ["{:>4s} {:>10s} {:>16s} {:>8s} {:>6s}".format("rank", "start", "cost", "nfev", "rounds")]
+        for rank, start in enumerate(self.starts):
+            lines.append("{:>4d} {:>10s} {:>16.6g} {:>8d} {:>6d}  {}".format(
+                rank, "#{}".format(start.index), start.cost, start.nfev, start.rounds, start.state.name.lower()))
+        lines.append("{:<20s} {:.6f} s".format("elapsed", self.elapsed))
+        return lines
+
+
+def generate_seeds(p0: Sequence[float], bounds: Tuple[Sequence[float], Sequence[float]],
+                   options: MultiStartOptions) -> np.ndarray:
+    # (n_starts, n_free)。先頭は現在の値そのもの
+    p0 = np.asarray(p0, dtype=np.float64)
+    lower, upper = _get_search_box(p0, bounds, options.width)
+    rng = np.random.default_rng(options.seed)
+    n_random = options.n_starts - 1
+    if (n_random <= 0) or (len(p0) == 0):
+        return p0[np.newaxis]
+
+    if options.strategy is SeedStrategy.PERTURB:
+        scale = options.width * np.maximum(np.abs(p0), 1.0) / 2
+        seeds = p0 + rng.normal(0.0, 1.0, (n_random, len(p0))) * scale
+    else:
+        sampler = qmc.LatinHypercube(d=len(p0), seed=rng)
+        seeds = qmc.scale(sampler.random(n_random), lower, upper)
+    # 境界上の初期値は受け付けられないので内側に収める
+    seeds = np.clip(seeds, lower, upper)
+    return np.vstack([p0, seeds])
+
+
+def _get_search_box(p0: np.ndarray, bounds: Tuple[Sequence[float], Sequence[float]],
+                    width: float) -> Tuple[np.ndarray, np.ndarray]:
+    bound_lower = np.asarray(bounds[0], dtype=np.float64)
+    bound_upper = np.asarray(bounds[1], dtype=np.float64)
+    half_width = width * np.maximum(np.abs(p0), 1.0)
+    lower = np.maximum(bound_lower, p0 - half_width)
+    upper = np.minimum(bound_upper, p0 + half_width)
+    margin = (upper - lower) * 1e-6
+    return lower + margin, upper - margin
+
+
+def run_multistart(runner: StartRunner, p0: Sequence[float], bounds: Tuple[Sequence[float], Sequence[float]],
+                   options: Optional[MultiStartOptions] = None) -> Tuple[np.ndarray, List[StartSummary]]:
+    # 全ての初期値を probe_nfev 回だけ進め、最良解から離れた初期値を落としながら上限を増やして続ける。
+    # 収束した初期値はそれ以上進めない。(最良の値, コスト順の要約) を返す
+    if options is None:
+        options = MultiStartOptions()
+    if options.n_starts < 1:
+        raise FitterException("初期値の数は 1 以上にしてください: {}".format(options.n_starts))
+    if options.probe_nfev < 1:
+        raise FitterException("評価回数の上限は 1 以上にしてください: {}".format(options.probe_nfev))
+
+    start_time = time.perf_counter()
+    seeds = generate_seeds(p0, bounds, options)
+    starts = [StartSummary(index, seed, seed.copy(), np.inf, StartState.RUNNING) for index, seed in enumerate(seeds)]
+    max_nfev = options.probe_nfev
+    while True:
+        active = [start for start in starts if start.state is StartState.RUNNING]
+        if len(active) == 0:
+            break
+        if (options.time_budget is not None) and (time.perf_counter() - start_time > options.time_budget):
+            for start in active:
+                start.state = StartState.TIMEOUT
+            break
+
+        result = runner(np.array([start.params for start in active]), max_nfev)
+        for index, start in enumerate(active):
+            start.nfev += int(result.nfev[index])
+            start.rounds += 1
+            status = FitStatus(int(result.status[index]))
+            if status in [FitStatus.SUCCESS, FitStatus.INCOMPLETE]:
+                start.params = result.params[index]
+                start.cost = float(result.chi2[index])
+            if status is FitStatus.SUCCESS:
+                start.state = StartState.CONVERGED
+            elif status is not FitStatus.INCOMPLETE:
+                start.state = StartState.FAILED
+
+        best_cost = min(start.cost for start in starts)
+        running = sorted([start for start in starts if start.state is StartState.RUNNING], key=lambda s: s.cost)
+        keep_num = max(int(np.ceil(len(running) * options.keep_fraction)), 1)
+        for rank, start in enumerate(running):
+            if (rank >= keep_num) or (start.cost > options.prune_factor * best_cost):
+                start.state = StartState.PRUNED
+        max_nfev *= options.BUDGET_GROWTH
+
+    ranked = sorted(starts, key=lambda s: (s.state is StartState.FAILED, s.cost))
+    if not np.isfinite(ranked[0].cost):
+        raise RuntimeError("Optimal parameters not found: 全ての初期値でフィットに失敗しました")
+    return ranked[0].params, ranked
@@ -0,0 +1,152 @@
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Optional
+from typing import Dict
+from typing import List
+from typing import Tuple
+from typing import Any
+import os
+
+import numpy as np
+
+from batch_fit import BatchFitResult
+from batch_fit import fit_frame
+from compiled_model import CompiledModel
+from compiled_model import EvaluationOptions
+from model_spec import ModelSpec
+from base_exceptions import FitterException
+
+
+_SharedArrayInfo = Tuple[str, Tuple[int, ...], str]
+# (世代, モデル, 評価オプション, フレーム, 説明変数)。世代が変わった時だけワーカーの状態を作り直す
+_WorkerSetup = Tuple[int, ModelSpec, Optional[EvaluationOptions], _SharedArrayInfo, _SharedArrayInfo]
+
+# ワーカープロセス毎に、呼び出し (世代) 毎に一度だけ構築する状態
+_worker_state: Dict[str, Any] = {}
+
+
+def _attach(info: _SharedArrayInfo) -> np.ndarray:
+    name, shape, dtype = info
+    # SharedMemory は参照が切れると閉じられるので保持しておく
+    attached: Dict[str, shared_memory.SharedMemory] = _worker_state.setdefault("shm", {})
+    if name not in attached:
+        attached[name] = shared_memory.SharedMemory(name=name)
+    return np.ndarray(shape, dtype=np.dtype(dtype), buffer=attached[name].buf)
+
+
+def _prepare_worker(setup: _WorkerSetup):
+    generation, spec, options, frames_info, expl_info = setup
+    if _worker_state.get("generation") == generation:
+        return
+    # 親が確保し直した古いブロックを閉じる。先にそれを指す配列を手放す
+    _worker_state.pop("frames", None)
+    _worker_state.pop("raveled_expl", None)
+    attached: Dict[str, shared_memory.SharedMemory] = _worker_state.setdefault("shm", {})
+    for name in [name for name in attached if name not in [frames_info[0], expl_info[0]]]:
+        attached.pop(name).close()
+    function_list = spec.to_function_list()
+
+    _worker_state["frames"] = _attach(frames_info)
+    _worker_state["raveled_expl"] = _attach(expl_info)
+    _worker_state["model"] = CompiledModel(function_list, options)
+    _worker_state["bounds"] = function_list.get_bounds()
+    _worker_state["generation"] = generation
+
+
+def _run_task(task: Tuple[_WorkerSetup, List[int], np.ndarray, Optional[int]]) -> BatchFitResult:
+    setup, frame_indices, p0s, max_nfev = task
+    _prepare_worker(setup)
+    model: CompiledModel = _worker_state["model"]
+    result = BatchFitResult.empty(len(frame_indices), model.get_free_num())
+    for index, (frame_index, p0) in enumerate(zip(frame_indices, p0s)):
+        raveled_data = _worker_state["frames"][frame_index].ravel()
+        result.set_frame(index, fit_frame(model, _worker_state["raveled_expl"], raveled_data, p0,
+                                          _worker_state["bounds"], max_nfev))
+    return result
+
+
+class ParallelFitExecutor:
+    # プロセスプールと共有メモリは最初の呼び出しで作り、close (with を抜けた時) まで使い回す
+    def __init__(self, max_workers: Optional[int] = None, chunk_size: int = 1):
+        if max_workers is None:
+            max_workers = os.cpu_count() or 1
+        if max_workers < 1:
+            raise FitterException("ワーカー数は 1 以上にしてください: {}".format(max_workers))
+        if chunk_size < 1:
+            raise FitterException("チャンクサイズは 1 以上にしてください: {}".format(chunk_size))
+        self.max_workers = max_workers
+        self.chunk_size = chunk_size
+        self._pool: Optional[ProcessPoolExecutor] = None
+        # "frames", "expl" 毎の共有メモリ。足りなくなった時だけ確保し直す
+        self._shms: Dict[str, shared_memory.SharedMemory] = {}
+        self._generation = 0
+
+    def __enter__(self) -> "ParallelFitExecutor":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+        for shm in self._shms.values():
+            shm.close()
+            shm.unlink()
+        self._shms = {}
+
+    def fit_frames(self, spec: ModelSpec, raveled_expl: np.ndarray, frames: np.ndarray,
+                   p0: Optional[np.ndarray] = None,
+                   options: Optional[EvaluationOptions] = None) -> BatchFitResult:
+        # 各フレームを独立にフィットする。p0 は (n_free,) か (フレーム数, n_free)
+        if p0 is None:
+            p0 = spec.to_function_list().get_values()
+        p0s = np.asarray(p0, dtype=np.float64)
+        if p0s.ndim == 1:
+            p0s = np.tile(p0s, (len(frames), 1))
+        return self._run(spec, options, raveled_expl, frames, np.arange(len(frames)), p0s)
+
+    def fit_starts(self, spec: ModelSpec, raveled_expl: np.ndarray, data: np.ndarray,
+                   p0s: np.ndarray, options: Optional[EvaluationOptions] = None,
+                   max_nfev: Optional[int] = None) -> BatchFitResult:
+        # 同じデータを異なる初期値 (行毎) からフィットする。max_nfev を指定すると上限で打ち切る (INCOMPLETE)
+        p0s = np.atleast_2d(np.asarray(p0s, dtype=np.float64))
+        return self._run(spec, options, raveled_expl, data[np.newaxis], np.zeros(len(p0s), dtype=np.int64), p0s,
+                         max_nfev)
+
+    def _run(self, spec: ModelSpec, options: Optional[EvaluationOptions], raveled_expl: np.ndarray, frames: np.ndarray,
+             frame_indices: np.ndarray, p0s: np.ndarray, max_nfev: Optional[int] = None) -> BatchFitResult:
+        if len(frame_indices) == 0:
+            raise FitterException("フィット対象がありません")
+        if len(frame_indices) != len(p0s):
+            raise FitterException("フィット対象と初期値の数が一致しません: {} {}".format(len(frame_indices), len(p0s)))
+
+        frames_info = self._share("frames", np.ascontiguousarray(frames, dtype=np.float64))
+        expl_info = self._share("expl", np.ascontiguousarray(raveled_expl, dtype=np.float64))
+        # 共有メモリの中身が変わったので、ワーカーに状態を作り直させる
+        self._generation += 1
+        setup = (self._generation, spec, options, frames_info, expl_info)
+
+        tasks = []
+        for start in range(0, len(frame_indices), self.chunk_size):
+            stop = start + self.chunk_size
+            tasks.append((setup, [int(i) for i in frame_indices[start:stop]], np.array(p0s[start:stop]), max_nfev))
+
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.max_workers)
+        # map は投入順に結果を返す
+        task_results = list(self._pool.map(_run_task, tasks))
+        return BatchFitResult.concatenate(task_results)
+
+    def _share(self, key: str, array: np.ndarray) -> _SharedArrayInfo:
+        shm = self._shms.get(key)
+        if (shm is None) or (shm.size < array.nbytes):
+            if shm is not None:
+                shm.close()
+                shm.unlink()
+            shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            self._shms[key] = shm
+        shared = np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)
+        shared[...] = array
+        return shm.name, array.shape, array.dtype.str
@@ -0,0 +1,101 @@
+from typing import List
+from typing import Dict
+from typing import Tuple
+
+import numpy as np
+
+from functions.base_function import BaseFunction
+from functions.function_parameters import ParamState
+from base_exceptions import FitterException
+
+
+class ParamMapping:
+    # 自由パラメータのベクトルから全関数の全パラメータへの線形写像。
+    # full = base; full[free] = 自由パラメータ; full[dep] = full[root] * coef + offset
+    # DEPENDED (関数内) と GLOBAL_DEPENDED (関数間) の連鎖は FREE か FIX の依存元まで辿って 1 段にまとめる
+    def __init__(self, functions: List[BaseFunction]):
+        self.slices: List[slice] = []
+        base_values: List[float] = []
+        offsets: Dict[str, int] = {}
+        offset = 0
+        for func in functions:
+            offsets[func.unique_name()] = offset
+            base_values += [param.value for param in func.parameters]
+            self.slices.append(slice(offset, offset + len(func.parameters)))
+            offset += len(func.parameters)
+
+        free_index: List[int] = []
+        dep_index: List[int] = []
+        dep_root_index: List[int] = []
+        dep_coef: List[float] = []
+        dep_offset: List[float] = []
+        for func in functions:
+            for index, param in enumerate(func.parameters):
+                full_index = offsets[func.unique_name()] + index
+                if param.state == ParamState.FREE:
+                    free_index.append(full_index)
+                elif param.state in [ParamState.DEPENDED, ParamState.GLOBAL_DEPENDED]:
+                    root, coef, shift = self._resolve_dependency(functions, offsets, func, index)
+                    dep_index.append(full_index)
+                    dep_root_index.append(root)
+                    dep_coef.append(coef)
+                    dep_offset.append(shift)
+
+        self.base_values = np.array(base_values, dtype=np.float64)
+        self.free_index = np.array(free_index, dtype=np.int64)
+        self.dep_index = np.array(dep_index, dtype=np.int64)
+        self.dep_root_index = np.array(dep_root_index, dtype=np.int64)
+        self.dep_coef = np.array(dep_coef, dtype=np.float64)
+        self.dep_offset = np.array(dep_offset, dtype=np.float64)
+
+    def get_free_num(self) -> int:
+        return len(self.free_index)
+
+    def get_all_num(self) -> int:
+        return len(self.base_values)
+
+    def expand(self, free_values: np.ndarray) -> np.ndarray:
+        full_values = self.base_values.copy()
+        full_values[self.free_index] = free_values
+        full_values[self.dep_index] = full_values[self.dep_root_index] * self.dep_coef + self.dep_offset
+        return full_values
+
+    def get_function_columns(self, func_index: int) -> np.ndarray:
+        # 関数 func_index の値に影響する自由パラメータの列
+        sl = self.slices[func_index]
+        free_col = {int(full): col for col, full in enumerate(self.free_index)}
+        cols = {free_col[full] for full in range(sl.start, sl.stop) if full in free_col}
+        for full, root in zip(self.dep_index, self.dep_root_index):
+            if (sl.start <= full < sl.stop) and (int(root) in free_col):
+                cols.add(free_col[int(root)])
+        return np.array(sorted(cols), dtype=np.int64)
+
+    @staticmethod
+    def _resolve_dependency(functions: List[BaseFunction], offsets: Dict[str, int],
+                            func: BaseFunction, index: int) -> Tuple[int, float, float]:
+        # 依存の連鎖を辿り、(依存元の全パラメータ内の番号, 累積係数, 累積オフセット) を返す
+        funcs = {f.unique_name(): f for f in functions}
+        coef = 1.0
+        shift = 0.0
+        visited = set()
+        while func.parameters[index].state in [ParamState.DEPENDED, ParamState.GLOBAL_DEPENDED]:
+            param = func.parameters[index]
+            if (func.unique_name(), index) in visited:
+                raise FitterException("依存関係が循環しています: {0} {1}".format(func.unique_name(), param.name))
+            visited.add((func.unique_name(), index))
+
+            if param.state == ParamState.GLOBAL_DEPENDED:
+                if param.depend_func not in funcs:
+                    raise FitterException("Depend function is not found: {0}(parent) {1} {2}(child)"
+                                          .format(param.depend_func, func.unique_name(), param.name))
+                parent_func = funcs[param.depend_func]
+                shift += coef * param.depend_offset
+            else:
+                parent_func = func
+            names = [p.name for p in parent_func.parameters]
+            if param.depend_parent not in names:
+                raise FitterException("Depend parent is not found: {0}(parent) {1}(child)"
+                                      .format(param.depend_parent, param.name))
+            coef *= param.depend_coef
+            func, index = parent_func, names.index(param.depend_parent)
+        return offsets[func.unique_name()] + index, coef, shift
@@ -0,0 +1,60 @@
+from typing import Tuple
+from typing import Union
+
+import numpy as np
+
+from regular_grid import RegularGrid
+
+
+class PixelIndex:
+    # 任意の 2-D 座標列について、矩形の窓に含まれる画素を y の二分探索で絞り込む
+    def __init__(self, x: np.ndarray, y: np.ndarray):
+        self.x = np.ravel(x)
+        self.y = np.ravel(y)
+        self._order = np.argsort(self.y, kind="stable")
+        self._sorted_x = self.x[self._order]
+        self._sorted_y = self.y[self._order]
+
+    def __len__(self):
+        return len(self.x)
+
+    def query(self, center: np.ndarray, half_width: np.ndarray) -> np.ndarray:
+        lower = np.searchsorted(self._sorted_y, center[1] - half_width[1], side="left")
+        upper = np.searchsorted(self._sorted_y, center[1] + half_width[1], side="right")
+        in_x = np.abs(self._sorted_x[lower:upper] - center[0]) <= half_width[0]
+        return self._order[lower:upper][in_x]
+
+    def take(self, pixels: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        return self.x[pixels], self.y[pixels]
+
+
+class GridIndex:
+    # RegularGrid 用の PixelIndex。軸毎の二分探索で窓を矩形の画素ブロックとして求める
+    def __init__(self, grid: RegularGrid):
+        self.grid = grid
+        self._x_order = np.argsort(grid.x_axis, kind="stable")
+        self._y_order = np.argsort(grid.y_axis, kind="stable")
+        self._sorted_x = grid.x_axis[self._x_order]
+        self._sorted_y = grid.y_axis[self._y_order]
+
+    def __len__(self):
+        return self.grid.size
+
+    def query(self, center: np.ndarray, half_width: np.ndarray) -> np.ndarray:
+        x_lower = np.searchsorted(self._sorted_x, center[0] - half_width[0], side="left")
+        x_upper = np.searchsorted(self._sorted_x, center[0] + half_width[0], side="right")
+        y_lower = np.searchsorted(self._sorted_y, center[1] - half_width[1], side="left")
+        y_upper = np.searchsorted(self._sorted_y, center[1] + half_width[1], side="right")
+        cols = self._x_order[x_lower:x_upper]
+        rows = self._y_order[y_lower:y_upper]
+        return (rows[:, np.newaxis] * len(self.grid.x_axis) + cols[np.newaxis, :]).ravel()
+
+    def take(self, pixels: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        rows, cols = np.divmod(pixels, len(self.grid.x_axis))
+        return self.grid.x_axis[cols], self.grid.y_axis[rows]
+
+
+def build_pixel_index(explanatory: Union[Tuple[np.ndarray, np.ndarray], RegularGrid]) -> Union[PixelIndex, GridIndex]:
+    if isinstance(explanatory, RegularGrid):
+        return GridIndex(explanatory)
+    return PixelIndex(explanatory[0], explanatory[1])
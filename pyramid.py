@@ -0,0 +1,71 @@
+from dataclasses import dataclass
+from typing import Optional
+from typing import List
+from typing import Tuple
+from typing import Union
+
+import numpy as np
+
+from regular_grid import RegularGrid
+
+
+# これより小さい辺になる段は作らない
+MIN_LEVEL_SIZE = 16
+
+
+@dataclass
+class PyramidLevel:
+    # 元の画像に対する縮小率
+    factor: int
+    # 有効な画素の無いブロックは NaN
+    data: np.ndarray
+    explanatory: Union[Tuple[np.ndarray, np.ndarray], RegularGrid]
+
+
+def build_pyramid(data: np.ndarray,
+                  explanatory: Union[Tuple[np.ndarray, np.ndarray], RegularGrid],
+                  valid: Optional[np.ndarray],
+                  levels: int,
+                  factor: int = 2) -> List[PyramidLevel]:
+    # 元の解像度を除いた縮小画像を粗い順に返す。各段は元の画像から直接 factor^k 画素のブロック平均で作る。
+    # 座標もブロック平均するので、パラメータは段の間でそのまま受け渡せる
+    pyramid = []
+    for level in range(1, levels + 1):
+        level_factor = factor ** level
+        if min(data.shape) // level_factor < MIN_LEVEL_SIZE:
+            break
+        pyramid.append(PyramidLevel(level_factor, bin_image(data, valid, level_factor),
+                                    bin_explanatory(explanatory, data.shape, level_factor)))
+    return pyramid[::-1]
+
+
+def bin_image(data: np.ndarray, valid: Optional[np.ndarray], factor: int) -> np.ndarray:
+    # 有効な画素だけの平均。端の factor に満たない行と列は捨てる
+    height, width = data.shape[0] // factor, data.shape[1] // factor
+    cropped = np.asarray(data[:height * factor, :width * factor], dtype=np.float64)
+    if valid is None:
+        return _block_sum(cropped, factor) / (factor * factor)
+
+    weights = np.asarray(valid[:height * factor, :width * factor], dtype=np.float64)
+    counts = _block_sum(weights, factor)
+    sums = _block_sum(np.where(weights > 0, cropped, 0.0), factor)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(counts > 0, sums / counts, np.nan)
+
+
+def bin_explanatory(explanatory: Union[Tuple[np.ndarray, np.ndarray], RegularGrid],
+                    shape: Tuple[int, int], factor: int) -> Union[Tuple[np.ndarray, np.ndarray], RegularGrid]:
+    height, width = shape[0] // factor, shape[1] // factor
+    if isinstance(explanatory, RegularGrid):
+        x_axis = explanatory.x_axis[:width * factor].reshape(width, factor).mean(axis=1)
+        y_axis = explanatory.y_axis[:height * factor].reshape(height, factor).mean(axis=1)
+        return RegularGrid(x_axis, y_axis)
+
+    x, y = np.broadcast_arrays(explanatory[0], explanatory[1])
+    return (_block_sum(np.asarray(x[:height * factor, :width * factor], dtype=np.float64), factor) / (factor * factor),
+            _block_sum(np.asarray(y[:height * factor, :width * factor], dtype=np.float64), factor) / (factor * factor))
+
+
+def _block_sum(image: np.ndarray, factor: int) -> np.ndarray:
+    height, width = image.shape[0] // factor, image.shape[1] // factor
+    return image.reshape(height, factor, width, factor).sum(axis=(1, 3))
@@ -0,0 +1,44 @@
+from typing import Iterator
+from typing import Tuple
+
+import numpy as np
+
+
+class RegularGrid:
+    # 直交格子の説明変数。x, y の軸だけを持ち、関数は (1, nx) と (ny, 1) の broadcasting で評価する。
+    # scipy.optimize.curve_fit は ndarray, tuple, list 以外の xdata をそのまま関数に渡すので、
+    # ここでは tuple を継承しない。
+    def __init__(self, x_axis: np.ndarray, y_axis: np.ndarray):
+        self.x_axis = np.asarray(x_axis, dtype=np.float64).ravel()
+        self.y_axis = np.asarray(y_axis, dtype=np.float64).ravel()
+
+    def __len__(self):
+        return 2
+
+    def __iter__(self) -> Iterator[np.ndarray]:
+        yield self[0]
+        yield self[1]
+
+    def __getitem__(self, index: int) -> np.ndarray:
+        if index == 0:
+            return self.x_axis[np.newaxis, :]
+        if index == 1:
+            return self.y_axis[:, np.newaxis]
+        raise IndexError(index)
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return len(self.y_axis), len(self.x_axis)
+
+    @property
+    def size(self) -> int:
+        return len(self.y_axis) * len(self.x_axis)
+
+    def meshgrid(self) -> Tuple[np.ndarray, np.ndarray]:
+        x_mesh, y_mesh = np.meshgrid(self.x_axis, self.y_axis)
+        return x_mesh, y_mesh
+
+    def ravel(self) -> np.ndarray:
+        # (2, 画素数) の配列を実体化する
+        return np.array([np.tile(self.x_axis, len(self.y_axis)), np.repeat(self.y_axis, len(self.x_axis))])
+
@@ -0,0 +1,347 @@
+from dataclasses import dataclass
+from typing import Optional
+from typing import List
+from typing import Sequence
+from typing import Tuple
+from typing import Union
+from enum import Enum, auto
+import inspect
+import time
+
+import numpy as np
+import scipy.optimize as so
+from scipy import sparse
+
+from compiled_model import CompiledModel
+from regular_grid import RegularGrid
+from chunk_source import ChunkSource
+
+
+# scipy 1.9 以降では終了理由を curve_fit から受け取れる
+_HAS_FULL_OUTPUT = "full_output" in inspect.signature(so.curve_fit).parameters
+
+# CHUNKED の減衰係数 (J^T J の対角成分に対する比)
+_INITIAL_DAMPING = 1e-3
+_DAMPING_FACTOR = 10.0
+_MIN_DAMPING = 1e-12
+_MAX_DAMPING = 1e16
+# tr_solver="lsmr" の部分問題の許容誤差。既定 (1e-6) では重なったガウス関数で試行点が不正確になり、反復回数が数十倍になる
+_LSMR_TOL = 1e-12
+
+
+# noinspection PyArgumentList
+class SolverType(Enum):
+    DEFAULT = 0
+    # scipy.optimize.curve_fit (境界付きの場合は trf)
+    CURVE_FIT = auto()
+    # scipy.optimize.least_squares (trf, x_scale="jac")
+    LEAST_SQUARES = auto()
+    # 境界なしの Levenberg-Marquardt。解が境界の外に出た場合は LEAST_SQUARES でやり直す
+    LM = auto()
+    # LEAST_SQUARES と同じだがヤコビアンを疎行列で扱う。関数の数が多く窓で打ち切る場合に向く
+    SPARSE = auto()
+    # データを塊毎に読み、J^T J と J^T r だけを足し合わせる Levenberg-Marquardt。
+    # 全画素のヤコビアンを持たないので、メモリに載らない (np.memmap の) データをフィットできる
+    CHUNKED = auto()
+
+    @staticmethod
+    def show_available() -> List[str]:
+        return [s.name.lower() for s in SolverType][1:]
+
+
+@dataclass
+class SolverOptions:
+    solver_type: SolverType = SolverType.CURVE_FIT
+    ftol: float = 1e-8
+    xtol: float = 1e-8
+    max_nfev: Optional[int] = None
+    # least_squares の信頼領域部分問題の解法 ("exact" か "lsmr")。
+    # None の場合、密なヤコビアンでは "exact"、疎なヤコビアンでは "lsmr" を使う。SPARSE では "lsmr" のみ使える。
+    # 密なヤコビアンで "lsmr" を使うと、ガウス関数が重なって条件数が悪い場合に収束が極端に遅くなる
+    tr_solver: Optional[str] = None
+    # SPARSE で truncate_sigma が無い場合に、ヤコビアンの列を打ち切る窓の幅 (sigma 単位)。
+    # 数値微分の jac_sparsity の窓はフィット開始時の値で決まるので、位置や幅の変化を見込んで広めにとる
+    sparsity_sigma: float = 6.0
+    # 線形パラメータを評価毎に最小二乗で解き、非線形パラメータだけを最適化する (varpro.VarProjection)
+    variable_projection: bool = False
+    # CHUNKED で一度に読む画素数
+    chunk_size: int = ChunkSource.DEFAULT_CHUNK_SIZE
+
+    TR_SOLVERS = ["exact", "lsmr"]
+
+
+@dataclass
+class SolverResult:
+    params: np.ndarray
+    covariance: np.ndarray
+    cost: float
+    status: int
+    message: str
+    # 実際に使われたソルバー (LM から LEAST_SQUARES にフォールバックした場合など)
+    solver: str
+    # least_squares で実際に使われた tr_solver。least_squares を使わなかった場合は空
+    tr_solver: str = ""
+
+
+def solve(model: CompiledModel,
+          raveled_expl: Union[np.ndarray, RegularGrid],
+          raveled_data: np.ndarray,
+          p0: Sequence[float],
+          bounds: Tuple[Sequence[float], Sequence[float]],
+          options: Optional[SolverOptions] = None,
+          jac_sparsity: Optional[sparse.spmatrix] = None) -> SolverResult:
+    # raises RuntimeError
+    # model は f, jac, has_jac (SPARSE では jac_sparse も) を持てばよい (varpro.VarProjection など)。
+    # jac_sparsity は SPARSE でヤコビアンを数値微分する場合のみ使う
+    if options is None:
+        options = SolverOptions()
+    if options.solver_type in [SolverType.DEFAULT, SolverType.CURVE_FIT]:
+        return _solve_curve_fit(model, raveled_expl, raveled_data, p0, bounds, options)
+    if options.solver_type is SolverType.LM:
+        return _solve_lm(model, raveled_expl, raveled_data, p0, bounds, options)
+    if options.solver_type is SolverType.CHUNKED:
+        return solve_chunked(model, ChunkSource(raveled_expl, raveled_data, model.dim, chunk_size=options.chunk_size),
+                             p0, bounds, options)
+    is_sparse = options.solver_type is SolverType.SPARSE
+    return _solve_least_squares(model, raveled_expl, raveled_data, p0, bounds, options, is_sparse,
+                                jac_sparsity if is_sparse else None)
+
+
+def _solve_curve_fit(model: CompiledModel, raveled_expl: Union[np.ndarray, RegularGrid], raveled_data: np.ndarray,
+                     p0: Sequence[float], bounds: Tuple[Sequence[float], Sequence[float]],
+                     options: SolverOptions) -> SolverResult:
+    jac = model.jac if model.has_jac() else None
+    kwargs = {"p0": p0, "bounds": bounds, "jac": jac, "ftol": options.ftol, "xtol": options.xtol}
+    if options.max_nfev is not None:
+        kwargs["max_nfev"] = options.max_nfev
+    if _HAS_FULL_OUTPUT:
+        kwargs["full_output"] = True
+    result = so.curve_fit(model.f, raveled_expl, raveled_data, **kwargs)
+
+    opt_para, opt_cov = result[:2]
+    if _HAS_FULL_OUTPUT:
+        fvec = result[2]["fvec"]
+        status, message = result[4], result[3]
+    else:
+        fvec = model.f(raveled_expl, *opt_para) - raveled_data
+        status, message = 1, ""
+    return SolverResult(opt_para, opt_cov, float(np.dot(fvec, fvec)), status, message, SolverType.CURVE_FIT.name)
+
+
+def _solve_least_squares(model: CompiledModel, raveled_expl: Union[np.ndarray, RegularGrid],
+                         raveled_data: np.ndarray, p0: Sequence[float],
+                         bounds: Tuple[Sequence[float], Sequence[float]],
+                         options: SolverOptions, is_sparse: bool,
+                         jac_sparsity: Optional[sparse.spmatrix] = None) -> SolverResult:
+    def residual(params: np.ndarray) -> np.ndarray:
+        return model.f(raveled_expl, *params) - raveled_data
+
+    jac = "2-point"
+    if model.has_jac() and is_sparse:
+        def jac(params: np.ndarray):
+            return model.jac_sparse(raveled_expl, *params, window_sigma=options.sparsity_sigma)
+    elif model.has_jac():
+        def jac(params: np.ndarray):
+            return model.jac(raveled_expl, *params)
+
+    tr_solver = options.tr_solver
+    if tr_solver is None:
+        tr_solver = "lsmr" if is_sparse else "exact"
+    kwargs = {}
+    if tr_solver == "lsmr":
+        kwargs["tr_options"] = {"atol": _LSMR_TOL, "btol": _LSMR_TOL}
+    if (jac_sparsity is not None) and (not model.has_jac()):
+        # 互いに重ならない列をまとめて差分をとるので、数値微分の評価回数が列数より大幅に減る
+        kwargs["jac_sparsity"] = jac_sparsity
+    res = so.least_squares(residual, p0, jac=jac, bounds=bounds, method="trf", x_scale="jac", tr_solver=tr_solver,
+                           ftol=options.ftol, xtol=options.xtol, max_nfev=options.max_nfev, **kwargs)
+    solver = SolverType.SPARSE if is_sparse else SolverType.LEAST_SQUARES
+    result = _to_result(res, len(raveled_data), solver.name)
+    result.tr_solver = tr_solver
+    return result
+
+
+def _solve_lm(model: CompiledModel, raveled_expl: Union[np.ndarray, RegularGrid], raveled_data: np.ndarray,
+              p0: Sequence[float], bounds: Tuple[Sequence[float], Sequence[float]],
+              options: SolverOptions) -> SolverResult:
+    lower, upper = np.array(bounds[0]), np.array(bounds[1])
+    if len(raveled_data) >= len(p0):
+        def residual(params: np.ndarray) -> np.ndarray:
+            return model.f(raveled_expl, *params) - raveled_data
+
+        jac = "2-point"
+        if model.has_jac():
+            def jac(params: np.ndarray) -> np.ndarray:
+                return model.jac(raveled_expl, *params)
+
+        res = so.least_squares(residual, p0, jac=jac, method="lm", x_scale="jac",
+                               ftol=options.ftol, xtol=options.xtol, max_nfev=options.max_nfev)
+        if res.success and np.all(res.x > lower) and np.all(res.x < upper):
+            return _to_result(res, len(raveled_data), SolverType.LM.name)
+
+    # 境界が効いている場合は境界付きの trf でやり直す
+    result = _solve_least_squares(model, raveled_expl, raveled_data, p0, bounds, options, False)
+    result.solver = "{} -> {}".format(SolverType.LM.name, result.solver)
+    return result
+
+
+def solve_chunked(model: CompiledModel, source: ChunkSource, p0: Sequence[float],
+                  bounds: Tuple[Sequence[float], Sequence[float]],
+                  options: Optional[SolverOptions] = None) -> SolverResult:
+    # 境界は試行点を内側に射影して扱う。max_nfev はデータを読む回数 (既定は 100 * 自由パラメータ数)
+    # raises RuntimeError
+    if options is None:
+        options = SolverOptions(SolverType.CHUNKED)
+    lower, upper = np.array(bounds[0], dtype=np.float64), np.array(bounds[1], dtype=np.float64)
+    margin = (upper - lower) * 1e-9
+    lower, upper = lower + margin, upper - margin
+    max_nfev = options.max_nfev if options.max_nfev is not None else 100 * max(len(p0), 1)
+
+    params = np.clip(np.array(p0, dtype=np.float64), lower, upper)
+    jtj, jtr, cost, n_data = _accumulate_normal(model, source, params, upper)
+    nfev = 1
+    damping = _INITIAL_DAMPING
+    status, message = 0, ""
+    while status == 0:
+        # 対角成分に比例した減衰 (Marquardt)
+        diag = np.maximum(np.diag(jtj), np.finfo(float).tiny)
+        try:
+            step = np.linalg.solve(jtj + damping * np.diag(diag), -jtr)
+        except np.linalg.LinAlgError:
+            step = np.linalg.lstsq(jtj + damping * np.diag(diag), -jtr, rcond=None)[0]
+        trial = np.clip(params + step, lower, upper)
+        trial_cost = _accumulate_cost(model, source, trial)
+        nfev += 1
+
+        if trial_cost < cost:
+            if cost - trial_cost <= options.ftol * cost:
+                status, message = 2, "ftol の収束条件を満たしました"
+            elif np.linalg.norm(trial - params) <= options.xtol * (options.xtol + np.linalg.norm(params)):
+                status, message = 3, "xtol の収束条件を満たしました"
+            params = trial
+            damping = max(damping / _DAMPING_FACTOR, _MIN_DAMPING)
+            jtj, jtr, cost, n_data = _accumulate_normal(model, source, params, upper)
+            nfev += 1
+        else:
+            damping *= _DAMPING_FACTOR
+            if damping > _MAX_DAMPING:
+                # どの方向にもコストが下がらない
+                status, message = 2, "これ以上コストが下がりません"
+        if (status == 0) and (nfev >= max_nfev):
+            raise RuntimeError("Optimal parameters not found: データの読み込み回数が上限 {} に達しました".format(max_nfev))
+
+    if n_data == 0:
+        raise RuntimeError("Optimal parameters not found: 有効な画素がありません")
+    return SolverResult(params, covariance_from_normal(jtj, cost, n_data), cost, status, message,
+                        SolverType.CHUNKED.name)
+
+
+def _accumulate_normal(model: CompiledModel, source: ChunkSource, params: np.ndarray,
+                       upper: np.ndarray) -> Tuple[np.ndarray, np.ndarray, float, int]:
+    # (J^T J, J^T r, 残差の二乗和, 画素数)。保持するのは塊 1 つ分のヤコビアンだけ。
+    # jac_time にはヤコビアンと正規方程式の計算だけを入れる (f_full の時間は関数毎の時間に入る)
+    _count_pass(model, is_jac=True)
+    full_values = _expand(model, params)
+    n_free = len(params)
+    jtj = np.zeros((n_free, n_free), dtype=np.float64)
+    jtr = np.zeros(n_free, dtype=np.float64)
+    cost = 0.0
+    n_data = 0
+    for chunk_expl, chunk_data in source:
+        base = np.ravel(model.f_full(chunk_expl, full_values))
+        residual = base - chunk_data
+        start = time.perf_counter()
+        eval_start = _get_eval_time(model)
+        if model.has_jac():
+            jac = model.jac_full(chunk_expl, full_values)
+        else:
+            jac = _forward_difference(model, chunk_expl, params, base, upper)
+        jtj += jac.T @ jac
+        jtr += jac.T @ residual
+        if model.timer is not None:
+            # 数値微分の f_full は関数毎の時間に数えられている
+            model.timer.jac_time += (time.perf_counter() - start) - (_get_eval_time(model) - eval_start)
+        cost += float(np.dot(residual, residual))
+        n_data += len(residual)
+    return jtj, jtr, cost, n_data
+
+
+def _accumulate_cost(model: CompiledModel, source: ChunkSource, params: np.ndarray) -> float:
+    _count_pass(model, is_jac=False)
+    full_values = _expand(model, params)
+    cost = 0.0
+    for chunk_expl, chunk_data in source:
+        residual = np.ravel(model.f_full(chunk_expl, full_values)) - chunk_data
+        cost += float(np.dot(residual, residual))
+    return cost
+
+
+def _forward_difference(model: CompiledModel, explanatory, params: np.ndarray, base: np.ndarray,
+                        upper: np.ndarray) -> np.ndarray:
+    jac = np.empty((len(base), len(params)), dtype=np.float64)
+    for col in range(len(params)):
+        step = np.sqrt(np.finfo(float).eps) * max(abs(params[col]), 1.0)
+        if params[col] + step >= upper[col]:
+            step = -step
+        shifted = params.copy()
+        shifted[col] += step
+        jac[:, col] = (np.ravel(model.f_full(explanatory, model.expand(shifted))) - base) / step
+    return jac
+
+
+def _expand(model: CompiledModel, params: np.ndarray) -> np.ndarray:
+    if model.timer is None:
+        return model.expand(params)
+    start = time.perf_counter()
+    full_values = model.expand(params)
+    model.timer.assign_time += time.perf_counter() - start
+    return full_values
+
+
+def _get_eval_time(model: CompiledModel) -> float:
+    if model.timer is None:
+        return 0.0
+    return sum(model.timer.component_time.values())
+
+
+def _count_pass(model: CompiledModel, is_jac: bool):
+    # データを 1 回読む毎に 1 回の評価として数える
+    if is_jac:
+        model.njev += 1
+    else:
+        model.nfev += 1
+    if model.timer is not None:
+        if is_jac:
+            model.timer.njev += 1
+        else:
+            model.timer.nfev += 1
+
+
+def _to_result(res: so.OptimizeResult, n_data: int, solver: str) -> SolverResult:
+    if not res.success:
+        raise RuntimeError("Optimal parameters not found: " + res.message)
+    cost = 2 * res.cost
+    return SolverResult(res.x, covariance_from_jac(res.jac, cost, n_data), cost, res.status, res.message, solver)
+
+
+def covariance_from_jac(jac: Union[np.ndarray, sparse.spmatrix], cost: float, n_data: int) -> np.ndarray:
+    # scipy.optimize.curve_fit と同じく、特異値の小さい方向を除いた (J^T J)^-1 を残差の分散で拡大する
+    n_free = jac.shape[1]
+    if sparse.issparse(jac):
+        return covariance_from_normal((jac.T @ jac).toarray(), cost, n_data)
+    _, s, vt = np.linalg.svd(jac, full_matrices=False)
+    threshold = np.finfo(float).eps * max(jac.shape) * s[0]
+    s = s[s > threshold]
+    vt = vt[:s.size]
+    cov = np.dot(vt.T / s ** 2, vt)
+    if n_data > n_free:
+        return cov * (cost / (n_data - n_free))
+    return np.full((n_free, n_free), np.inf)
+
+
+def covariance_from_normal(jtj: np.ndarray, cost: float, n_data: int) -> np.ndarray:
+    # J^T J だけが分かっている場合 (疎なヤコビアンや塊毎に足し合わせた場合)
+    n_free = jtj.shape[0]
+    if n_data > n_free:
+        return np.linalg.pinv(jtj) * (cost / (n_data - n_free))
+    return np.full((n_free, n_free), np.inf)
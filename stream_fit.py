@@ -0,0 +1,109 @@
+from typing import Optional
+from typing import Iterator
+from typing import List
+from typing import Tuple
+import glob
+import os
+import queue
+import threading
+
+import numpy as np
+
+from batch_fit import FrameFitResult
+from utils import data_loader
+
+
+StreamItem = Tuple[str, Optional[np.ndarray], str]
+
+
+class DataFileReader:
+    # 次のファイルをバックグラウンドのスレッドで読み込む。先読みは read_ahead 個までに制限する
+    _END = None
+
+    def __init__(self, pattern: str, read_ahead: int = 2, mmap_mode: Optional[str] = None):
+        self.paths = sorted(glob.glob(pattern))
+        self.read_ahead = max(read_ahead, 1)
+        self.mmap_mode = mmap_mode
+        self._queue: "queue.Queue[Optional[StreamItem]]" = queue.Queue(maxsize=self.read_ahead)
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __iter__(self) -> Iterator[StreamItem]:
+        self._thread = threading.Thread(target=self._load_all, daemon=True)
+        self._thread.start()
+        try:
+            while True:
+                item = self._queue.get()
+                if item is self._END:
+                    return
+                yield item
+        finally:
+            self.close()
+
+    def close(self):
+        self._stop.set()
+        if self._thread is None:
+            return
+        # 読み込み側が put で止まっている場合に備えて空にする
+        while self._thread.is_alive():
+            try:
+                self._queue.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        self._thread = None
+
+    def _load_all(self):
+        for path in self.paths:
+            if self._stop.is_set():
+                return
+            try:
+                data, _ = data_loader.load_data(path, self.mmap_mode)
+                if self.mmap_mode is not None:
+                    # 読み込みの待ち時間をフィットと重ねるため、ここで実体化する
+                    data = np.array(data)
+                item = (path, data, "")
+            except Exception as e:
+                item = (path, None, str(e))
+            if not self._put(item):
+                return
+        self._put(self._END)
+
+    def _put(self, item: Optional[StreamItem]) -> bool:
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+
+class StreamResultWriter:
+    # 1 ファイル分の結果を 1 行として CSV に追記する
+    def __init__(self, output_path: str, param_names: List[str]):
+        self.output_path = output_path
+        self.param_names = param_names
+        self._file = None
+
+    def __enter__(self) -> "StreamResultWriter":
+        is_new = (not os.path.exists(self.output_path)) or (os.path.getsize(self.output_path) == 0)
+        self._file = open(self.output_path, "a")
+        if is_new:
+            header = ["file", "status", "chi2", "nfev", "elapsed", "warm_started", "time_saved"]
+            self._file.write(",".join(header + self.param_names) + "\n")
+            self._file.flush()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._file.close()
+        self._file = None
+
+    def write(self, path: str, result: FrameFitResult):
+        record = [path, result.status.name, repr(float(result.chi2)), str(int(result.nfev)),
+                  repr(float(result.elapsed)), str(int(result.warm_started)), repr(float(result.time_saved))]
+        record += [repr(float(p)) for p in result.params]
+        self._file.write(",".join(record) + "\n")
+        self._file.flush()
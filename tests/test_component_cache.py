@@ -0,0 +1,57 @@
+import numpy as np
+
+from fit import Fit
+from compiled_model import CompiledModel
+from compiled_model import EvaluationOptions
+from functions.predefined_functions import Constant
+from functions.predefined_functions import Gauss
+
+
+class NoJacGauss(Gauss):
+    @classmethod
+    def has_jac(cls) -> bool:
+        return False
+
+
+def _gen_fitter(gauss_type: type) -> Fit:
+    fitter = Fit()
+    fitter.fl.add_func(gauss_type)
+    fitter.fl.add_func(Constant)
+    fitter.runtime_check()
+    fitter.try_set_data(np.zeros((24, 32)))
+    fitter.fl.set_values(*[2.0, 14.0, 11.0, 3.0, 2.0, 0.3, 0.5])
+    fitter.data = fitter.f_without_assigning() + 0.01 * np.random.default_rng(0).standard_normal((24, 32))
+    fitter.fl.set_values(*[1.0, 13.0, 10.0, 2.5, 2.5, 0.0, 0.0])
+    fitter.invalidate_cache()
+    return fitter
+
+
+def test_component_cache_only_for_numerical_jacobian():
+    fitter = _gen_fitter(Gauss)
+    assert fitter._get_component_cached_options(fitter.fl).component_cache_entries == 0
+    fitter = _gen_fitter(NoJacGauss)
+    assert fitter._get_component_cached_options(fitter.fl).component_cache_entries > 0
+    # 元の設定は変更しない
+    assert fitter.eval_options.component_cache_entries == 0
+
+
+def test_f_components_with_cache():
+    fitter = _gen_fitter(NoJacGauss)
+    raveled_expl = fitter.get_raveled_explanatory()
+    plain = CompiledModel(fitter.fl)
+    cached = CompiledModel(fitter.fl, EvaluationOptions(component_cache_entries=6))
+    explanatory = plain.to_explanatory(raveled_expl)
+    full_values = plain.expand(np.array(fitter.fl.get_values()))
+    expected = plain.f_components(explanatory, full_values)
+    np.testing.assert_allclose(cached.f_components(explanatory, full_values), expected)
+    np.testing.assert_allclose(cached.f_components(explanatory, full_values), expected)
+
+
+def test_variable_projection_with_numerical_jacobian():
+    results = []
+    for gauss_type in [Gauss, NoJacGauss]:
+        fitter = _gen_fitter(gauss_type)
+        fitter.solver_options.variable_projection = True
+        params, _ = fitter.curve_fit()
+        results.append(params)
+    np.testing.assert_allclose(results[1], results[0], rtol=1e-4, atol=1e-4)
@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+from fit import Fit
+from utils import data_loader
+from grapihx.cui import command_parser
+
+
+@pytest.mark.parametrize("slice_str, expected", [
+    ("-1", [9]),
+    ("-2", [8]),
+    ("0", [0]),
+    (":", list(range(10))),
+    ("2:8:3", [2, 5]),
+])
+def test_parse_slice(slice_str, expected):
+    assert list(range(10)[data_loader.parse_slice(slice_str)]) == expected
+
+
+@pytest.mark.parametrize("rows", ["-1", "-2"])
+@pytest.mark.parametrize("ext", [".npy", ".csv"])
+def test_load_negative_row(tmp_path, rows, ext):
+    full = np.arange(12, dtype=np.float64).reshape(4, 3)
+    path = str(tmp_path / ("data" + ext))
+    if ext == ".npy":
+        np.save(path, full)
+    else:
+        np.savetxt(path, full, delimiter=",")
+    crop = (data_loader.parse_slice(rows), slice(None))
+    data, source_shape = data_loader.load_data(path, None, crop)
+    assert source_shape == (4, 3)
+    np.testing.assert_array_equal(data, full[crop])
+
+
+def test_load_one_row_text_crops_columns(tmp_path):
+    path = str(tmp_path / "row.csv")
+    np.savetxt(path, np.arange(5, dtype=np.float64).reshape(1, 5), delimiter=",")
+    data, source_shape = data_loader.load_data(path, None, (slice(None), slice(0, 2)))
+    assert source_shape == (1, 5)
+    np.testing.assert_array_equal(data, [0, 1])
+
+
+def test_set_data_one_row_text_mesh(tmp_path):
+    path = str(tmp_path / "row.csv")
+    np.savetxt(path, np.arange(10, 15, dtype=np.float64).reshape(1, 5), delimiter=",")
+    fitter = Fit()
+    command_parser.parse("set_data {} cols=1:3".format(path)).execute(fitter)
+    np.testing.assert_array_equal(fitter.data, [11, 12])
+    np.testing.assert_array_equal(fitter.explanatory, [1, 2])
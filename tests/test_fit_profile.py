@@ -0,0 +1,43 @@
+import os
+
+import numpy as np
+
+from fit import Fit
+from functions.predefined_functions import Gauss
+
+
+def _gen_fitter() -> Fit:
+    fitter = Fit()
+    fitter.try_add_function_from_name(Gauss.name())
+    fitter.runtime_check()
+    fitter.try_set_data(np.zeros((24, 32)))
+    fitter.data = fitter.f_without_assigning() + 0.01 * np.random.default_rng(0).standard_normal((24, 32))
+    fitter.invalidate_cache()
+    return fitter
+
+
+def test_profile_only_next_fit(tmp_path):
+    path = str(tmp_path / "fit.prof")
+    fitter = _gen_fitter()
+    fitter.profile_path = path
+    fitter.curve_fit()
+    assert os.path.exists(path)
+    assert fitter.profile_path is None
+    assert fitter.last_stats.profile_path == path
+
+    os.remove(path)
+    fitter.curve_fit()
+    assert not os.path.exists(path)
+    assert fitter.last_stats.profile_path is None
+
+
+def test_profile_pyramid_fit_once(tmp_path):
+    path = str(tmp_path / "pyramid.prof")
+    fitter = _gen_fitter()
+    fitter.profile_path = path
+    fitter.pyramid_fit(levels=2)
+    assert os.path.exists(path)
+    assert fitter.profile_path is None
+    # 最後の仕上げの統計に記録され、各段の統計には記録されない
+    assert fitter.last_stats.profile_path == path
+    assert all(stats.profile_path is None for _, stats in fitter.last_stats.levels)
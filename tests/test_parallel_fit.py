@@ -0,0 +1,35 @@
+import numpy as np
+
+from fit import Fit
+from functions.predefined_functions import Gauss
+from multistart import MultiStartOptions
+from parallel_fit import ParallelFitExecutor
+
+
+def _gen_fitter() -> Fit:
+    fitter = Fit()
+    fitter.try_add_function_from_name(Gauss.name())
+    fitter.runtime_check()
+    fitter.try_set_data(np.zeros((24, 32)))
+    fitter.data = fitter.f_without_assigning() + 0.01 * np.random.default_rng(0).standard_normal((24, 32))
+    fitter.invalidate_cache()
+    return fitter
+
+
+def test_executor_reuses_pool_until_closed():
+    fitter = _gen_fitter()
+    with ParallelFitExecutor(2) as executor:
+        first = fitter.multistart(MultiStartOptions(), executor)
+        pool = executor._pool
+        shm_names = {key: shm.name for key, shm in executor._shms.items()}
+        second = fitter.multistart(MultiStartOptions(), executor)
+        assert executor._pool is pool
+        assert {key: shm.name for key, shm in executor._shms.items()} == shm_names
+
+        # フレーム数が増えると共有メモリだけ確保し直す
+        batch = fitter.batch_fit(np.stack([fitter.data] * 3), executor)
+        assert executor._pool is pool
+        np.testing.assert_allclose(batch.chi2, first.cost, rtol=1e-6)
+    np.testing.assert_allclose(second.cost, first.cost, rtol=1e-6)
+    assert executor._pool is None
+    assert len(executor._shms) == 0
@@ -0,0 +1,36 @@
+import pytest
+
+from fit import Fit
+from functions.function_parameters import ParamState
+from functions.predefined_functions import Gauss
+from grapihx.cui import command_parser
+from grapihx.cui.exceptions.exception import CommandParseException
+
+
+def _gen_fitter() -> Fit:
+    fitter = Fit()
+    fitter.try_add_function_from_name(Gauss.name())
+    fitter.try_add_function_from_name(Gauss.name())
+    return fitter
+
+
+@pytest.mark.parametrize("com", [
+    "set global_dependency gauss_1 sigma_l gauss_0 sigma_l abc",
+    "set global_dependency gauss_1 sigma_l gauss_0 sigma_l abc 1.5",
+    "set global_dependency gauss_1 sigma_l gauss_0 sigma_l 0.5 abc",
+])
+def test_global_dependency_rejects_non_numeric(com):
+    with pytest.raises(CommandParseException):
+        command_parser.parse(com)
+
+
+def test_global_dependency_accepts_int_coef():
+    fitter = _gen_fitter()
+    command_parser.parse("set global_dependency gauss_1 mean_x gauss_0 mean_x 1 12.5").execute(fitter)
+    command_parser.parse("set state gauss_1 mean_x global_depended gauss_0 mean_x").execute(fitter)
+
+    _, param = fitter.try_get_parameter("gauss_1", "mean_x")
+    assert param.state == ParamState.GLOBAL_DEPENDED
+    assert isinstance(param.depend_coef, float)
+    assert param.depend_coef == 1.0
+    assert param.depend_offset == 12.5
@@ -0,0 +1,135 @@
+from typing import Optional
+from typing import Iterator
+from typing import List
+from typing import Tuple
+import itertools
+import warnings
+
+import numpy as np
+
+from base_exceptions import FitterException
+
+
+TEXT_DELIMITERS = {".csv": ",", ".tsv": "\t", ".txt": None}
+DEFAULT_CHUNK_ROWS = 4096
+
+CropType = Tuple[slice, ...]
+
+
+def load_data(path: str, mmap_mode: Optional[str] = "r",
+              crop: Optional[CropType] = None) -> Tuple[np.ndarray, Tuple[int, ...]]:
+    # 読み込んだ配列と切り出し前の shape を返す。crop は読み込まれる配列の軸の順に指定する。
+    # テキストは 1 行や 1 列でもファイルの (行, 列) で切り出し、shape も (行数, 列数) を返す
+    if path.endswith(".npy"):
+        return load_npy(path, mmap_mode, crop)
+    for ext, delimiter in TEXT_DELIMITERS.items():
+        if path.endswith(ext):
+            return load_text(path, delimiter, crop)
+    raise FitterException("その拡張子はサポートされていません: {}".format(path))
+
+
+def load_npy(path: str, mmap_mode: Optional[str] = "r",
+             crop: Optional[CropType] = None) -> Tuple[np.ndarray, Tuple[int, ...]]:
+    # mmap_mode が指定された場合は切り出した範囲だけが実際に読み込まれる
+    data = np.load(path, mmap_mode=mmap_mode)
+    if not isinstance(data, np.ndarray):
+        raise FitterException("指定した変数の型が不正です: {}".format(type(data)))
+    source_shape = data.shape
+    if crop is not None:
+        data = data[crop[:data.ndim]]
+    return data, source_shape
+
+
+def load_text(path: str, delimiter: Optional[str] = None, crop: Optional[CropType] = None,
+              chunk_rows: int = DEFAULT_CHUNK_ROWS, comments: str = "#") -> Tuple[np.ndarray, Tuple[int, ...]]:
+    # 行数と列数を数えてから float64 の配列を確保し、チャンク毎にまとめて数値化して書き込む
+    n_rows, n_cols = _count_shape(path, delimiter, comments)
+    if n_rows == 0:
+        raise FitterException("データがありません: {}".format(path))
+
+    row_slice = slice(None)
+    col_slice = slice(None)
+    if crop is not None:
+        row_slice = crop[0]
+        if len(crop) > 1:
+            col_slice = crop[1]
+    row_indices = range(n_rows)[row_slice]
+    col_indices = range(n_cols)[col_slice]
+    is_row_forward = (row_slice.step is None) or (row_slice.step > 0)
+
+    if not is_row_forward:
+        # 逆順の行指定は全体を読んでから切り出す
+        full = load_text(path, delimiter, None, chunk_rows, comments)[0].reshape(n_rows, n_cols)
+        out = np.array(full[row_slice, col_slice])
+    else:
+        out = np.empty((len(row_indices), len(col_indices)), dtype=np.float64)
+        with open(path, "r") as file:
+            # 必要な行だけを読む
+            lines = itertools.islice(_iter_data_lines(file, comments),
+                                     row_indices.start, row_indices.stop, row_indices.step)
+            written = 0
+            for chunk in _iter_chunks(lines, chunk_rows):
+                out[written: written + len(chunk)] = _parse_chunk(chunk, delimiter, n_cols, path)[:, col_slice]
+                written += len(chunk)
+
+    if (n_rows == 1) or (n_cols == 1):
+        # np.loadtxt と同様に 1 行または 1 列のデータは 1-D にする
+        return out.reshape(-1), (n_rows, n_cols)
+    return out, (n_rows, n_cols)
+
+
+def parse_slice(slice_str: str) -> slice:
+    # ex. "10:200" "::2" "0:100:4"
+    parts = slice_str.split(":")
+    if not (1 <= len(parts) <= 3):
+        raise ValueError(slice_str)
+    values = [int(p) if len(p) > 0 else None for p in parts]
+    if len(values) == 1:
+        if values[0] is None:
+            return slice(None)
+        # "-1" は最後の 1 つ (slice(-1, 0) では空になる)
+        return slice(values[0], (values[0] + 1) or None)
+    return slice(*values)
+
+
+def _iter_data_lines(file, comments: str) -> Iterator[str]:
+    for line in file:
+        stripped = line.split(comments, 1)[0].strip()
+        if len(stripped) == 0:
+            continue
+        yield stripped
+
+
+def _iter_chunks(lines: Iterator[str], chunk_rows: int) -> Iterator[List[str]]:
+    while True:
+        chunk = list(itertools.islice(lines, chunk_rows))
+        if len(chunk) == 0:
+            return
+        yield chunk
+
+
+def _count_shape(path: str, delimiter: Optional[str], comments: str) -> Tuple[int, int]:
+    n_rows = 0
+    n_cols = 0
+    with open(path, "r") as file:
+        for line in _iter_data_lines(file, comments):
+            if n_rows == 0:
+                n_cols = len(line.split(delimiter))
+            n_rows += 1
+    return n_rows, n_cols
+
+
+def _parse_chunk(chunk: List[str], delimiter: Optional[str], n_cols: int, path: str) -> np.ndarray:
+    text = " ".join(chunk)
+    if delimiter is not None:
+        text = text.replace(delimiter, " ")
+    try:
+        with warnings.catch_warnings():
+            # 古い numpy では数値化できない文字列は警告のみとなるので、下の要素数チェックで検出する
+            warnings.simplefilter("ignore", DeprecationWarning)
+            values = np.fromstring(text, dtype=np.float64, sep=" ")
+    except ValueError:
+        raise FitterException("数値に変換できない値があります: {}".format(path))
+    if len(values) != len(chunk) * n_cols:
+        raise FitterException("列数が一定ではありません: {}".format(path))
+    return values.reshape(len(chunk), n_cols)
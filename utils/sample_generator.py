@@ -2,6 +2,7 @@ from typing import Optional
 from typing import Union
 from typing import Dict
 from typing import Tuple
+from typing import List
 
 import numpy as np
 
@@ -37,3 +38,35 @@ def gen_2d_gaussian(size: Optional[Union[int, Tuple[int, int]]] = None,
 
     noise = np.random.random(raw.shape) - 0.5
     return x_mesh, y_mesh, raw + noise
+
+
+def gen_2d_multi_gaussian(size: Optional[Union[int, Tuple[int, int]]] = None,
+                          n_components: int = 1,
+                          noise: float = 0.5,
+                          background: float = 0.0,
+                          seed: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray, List[Dict[str, float]]]:
+    # 画素座標上にランダムなガウシアンを n_components 個置いたデータと、その真値を返す
+    if size is None:
+        size = (101, 101)
+    elif type(size) is int:
+        size = (size, size)
+    rng = np.random.default_rng(seed)
+
+    x_mesh, y_mesh = np.meshgrid(np.arange(size[0], dtype=np.float64), np.arange(size[1], dtype=np.float64))
+    raw = np.full(x_mesh.shape, background, dtype=np.float64)
+    short_side = min(size)
+    params_list = []
+    for _ in range(n_components):
+        sigma_s = rng.uniform(0.01, 0.03) * short_side + 0.5
+        params = {
+            "norm": rng.uniform(50.0, 150.0) * sigma_s ** 2,
+            "mean_x": rng.uniform(0.1, 0.9) * size[0],
+            "mean_y": rng.uniform(0.1, 0.9) * size[1],
+            "sigma_l": sigma_s * rng.uniform(1.0, 2.0),
+            "sigma_s": sigma_s,
+            "theta": rng.uniform(-0.5, 0.5)
+        }
+        raw += Gauss.f_core(x_mesh, y_mesh, **params)
+        params_list.append(params)
+
+    return x_mesh, y_mesh, raw + rng.normal(0.0, noise, raw.shape), params_list
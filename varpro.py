@@ -0,0 +1,123 @@
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+from typing import Union
+import time
+
+import numpy as np
+
+from compiled_model import CompiledModel
+from regular_grid import RegularGrid
+from solvers import covariance_from_jac
+
+
+class VarProjection:
+    # 変数射影 (variable projection)。線形パラメータ (Gauss.norm, Constant.const など) を除いた
+    # 非線形パラメータだけを最適化し、評価毎に線形パラメータを基底画像の最小二乗で解く。
+    # f と jac は CompiledModel と同じ呼び出し規約なので、そのまま solvers.solve に渡せる。
+    # jac は Kaufman の近似 (I - B B^+) J を使う
+    def __init__(self, model: CompiledModel, raveled_expl: Union[np.ndarray, RegularGrid], raveled_data: np.ndarray,
+                 bounds: Tuple[Sequence[float], Sequence[float]]):
+        self.model = model
+        self.timer = model.timer
+        self._explanatory = model.to_explanatory(raveled_expl)
+        self._data = np.asarray(raveled_data, dtype=np.float64)
+        self._linear_components, self._linear_cols = model.get_linear_columns()
+        n_free = model.get_free_num()
+        self._nonlinear_cols = np.setdiff1d(np.arange(n_free), self._linear_cols)
+        self._lower = np.asarray(bounds[0], dtype=np.float64)
+        self._upper = np.asarray(bounds[1], dtype=np.float64)
+        # 最後に解いた (非線形パラメータ, 基底, 線形パラメータ)
+        self._last: Optional[Tuple[bytes, np.ndarray, np.ndarray]] = None
+
+    def get_projected_num(self) -> int:
+        return len(self._linear_cols)
+
+    def get_free_num(self) -> int:
+        return len(self._nonlinear_cols)
+
+    def has_jac(self) -> bool:
+        return self.model.has_jac()
+
+    def to_nonlinear(self, free_values: Sequence[float]) -> np.ndarray:
+        return np.asarray(free_values, dtype=np.float64)[self._nonlinear_cols]
+
+    def to_nonlinear_bounds(self, bounds: Tuple[Sequence[float], Sequence[float]]) -> Tuple[np.ndarray, np.ndarray]:
+        return self.to_nonlinear(bounds[0]), self.to_nonlinear(bounds[1])
+
+    def to_free(self, nonlinear_values: Sequence[float]) -> np.ndarray:
+        # 非線形パラメータから、線形パラメータを解いた全ての自由パラメータを返す
+        nonlinear_values = np.asarray(nonlinear_values, dtype=np.float64)
+        _, linear_values = self._solve(nonlinear_values)
+        return self._merge(nonlinear_values, linear_values)
+
+    def f(self, *args) -> np.ndarray:
+        self.model.nfev += 1
+        if self.timer is not None:
+            self.timer.nfev += 1
+        nonlinear_values = np.array(args[1:], dtype=np.float64)
+        basis, linear_values = self._solve(nonlinear_values)
+        return basis @ np.append(linear_values, 1.0)
+
+    def jac(self, *args) -> np.ndarray:
+        self.model.njev += 1
+        start = time.perf_counter()
+        if self.timer is not None:
+            self.timer.njev += 1
+        nonlinear_values = np.array(args[1:], dtype=np.float64)
+        basis, linear_values = self._solve(nonlinear_values)
+        full_values = self.model.expand(self._merge(nonlinear_values, linear_values))
+        nonlinear_jac = self.model.jac_full(self._explanatory, full_values)[:, self._nonlinear_cols]
+        linear_basis = basis[:, :-1]
+        if linear_basis.shape[1] > 0:
+            nonlinear_jac -= linear_basis @ np.linalg.lstsq(linear_basis, nonlinear_jac, rcond=None)[0]
+        if self.timer is not None:
+            self.timer.jac_time += time.perf_counter() - start
+        return nonlinear_jac
+
+    def covariance(self, free_values: np.ndarray, cost: float) -> np.ndarray:
+        # 線形パラメータも含めた共分散。解析的なヤコビアンが無い場合は前進差分で求める
+        full_values = self.model.expand(free_values)
+        if self.model.has_jac():
+            jac = self.model.jac_full(self._explanatory, full_values)
+        else:
+            base = np.ravel(self.model.f_full(self._explanatory, full_values))
+            jac = np.empty((len(base), len(free_values)), dtype=np.float64)
+            for col in range(len(free_values)):
+                step = np.sqrt(np.finfo(float).eps) * max(abs(free_values[col]), 1.0)
+                shifted = np.array(free_values, dtype=np.float64)
+                shifted[col] += step
+                jac[:, col] = (np.ravel(self.model.f_full(self._explanatory, self.model.expand(shifted))) - base) / step
+        return covariance_from_jac(jac, cost, len(self._data))
+
+    def _solve(self, nonlinear_values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        # 基底 (画素数, 線形パラメータの数 + 1) と線形パラメータを返す。最後の列は射影しない関数の和
+        key = nonlinear_values.tobytes()
+        if (self._last is not None) and (self._last[0] == key):
+            return self._last[1], self._last[2]
+
+        start = time.perf_counter()
+        # 射影する関数の線形パラメータを 1 にして評価すると、その関数の列が基底になる
+        full_values = self.model.expand(self._merge(nonlinear_values, np.ones(len(self._linear_cols))))
+        columns = self.model.f_components(self._explanatory, full_values)
+        is_linear = np.zeros(columns.shape[1], dtype=bool)
+        is_linear[self._linear_components] = True
+        basis = np.column_stack([columns[:, self._linear_components], np.sum(columns[:, ~is_linear], axis=1)])
+
+        linear_values = np.zeros(len(self._linear_cols))
+        if len(self._linear_cols) > 0:
+            linear_values = np.linalg.lstsq(basis[:, :-1], self._data - basis[:, -1], rcond=None)[0]
+            # 境界は最小二乗の後で内側に収める
+            lower, upper = self._lower[self._linear_cols], self._upper[self._linear_cols]
+            margin = (upper - lower) * 1e-9
+            linear_values = np.clip(linear_values, lower + margin, upper - margin)
+        if self.timer is not None:
+            self.timer.add_component_time("projection", start)
+        self._last = (key, basis, linear_values)
+        return basis, linear_values
+
+    def _merge(self, nonlinear_values: np.ndarray, linear_values: np.ndarray) -> np.ndarray:
+        free_values = np.empty(self.model.get_free_num(), dtype=np.float64)
+        free_values[self._nonlinear_cols] = nonlinear_values
+        free_values[self._linear_cols] = linear_values
+        return free_values
@@ -0,0 +1,118 @@
+from typing import List
+from typing import Sequence
+from typing import Tuple
+from enum import Enum, auto
+
+import numpy as np
+
+from batch_fit import BatchFitResult
+from batch_fit import FrameFitResult
+from batch_fit import FitStatus
+from batch_fit import fit_frame
+from compiled_model import CompiledModel
+
+
+# noinspection PyArgumentList
+class WarmStartPolicy(Enum):
+    DEFAULT = 0
+    NONE = auto()
+    PREVIOUS = auto()
+    EXTRAPOLATE = auto()
+
+
+class WarmStarter:
+    # 連続するフィットの初期値を直前の結果から決める
+    def __init__(self,
+                 policy: WarmStartPolicy,
+                 initial: Sequence[float],
+                 bounds: Tuple[Sequence[float], Sequence[float]],
+                 history: int = 3,
+                 divergence_factor: float = 10.0):
+        self.policy = policy
+        self.initial = np.array(initial, dtype=np.float64)
+        self.lower = np.array(bounds[0], dtype=np.float64)
+        self.upper = np.array(bounds[1], dtype=np.float64)
+        self.history = max(history, 1)
+        self.divergence_factor = divergence_factor
+        self._params: List[np.ndarray] = []
+        self._chi2: List[float] = []
+        # 通常の初期値だけで成功したフレームの時間。短縮時間の基準にする
+        self._cold_elapsed: List[float] = []
+
+    def seed(self) -> Tuple[np.ndarray, bool]:
+        # (初期値, 直前の結果を使ったか)
+        if (self.policy in [WarmStartPolicy.DEFAULT, WarmStartPolicy.NONE]) or (len(self._params) == 0):
+            return self.initial, False
+
+        if (self.policy is WarmStartPolicy.EXTRAPOLATE) and (len(self._params) >= 2):
+            # 直近 k フレームの線形外挿
+            steps = np.arange(len(self._params), dtype=np.float64)
+            slope, intercept = np.polyfit(steps, np.array(self._params), 1)
+            candidate = slope * len(self._params) + intercept
+        else:
+            candidate = self._params[-1]
+
+        if not np.all(np.isfinite(candidate)):
+            return self.initial, False
+        if np.any(candidate <= self.lower) or np.any(candidate >= self.upper):
+            # 境界外の初期値は curve_fit が受け付けないので、最後の解に戻す
+            candidate = self._params[-1]
+            if np.any(candidate <= self.lower) or np.any(candidate >= self.upper):
+                return self.initial, False
+        return candidate, True
+
+    def is_diverged(self, result: FrameFitResult) -> bool:
+        if result.status is not FitStatus.SUCCESS:
+            return True
+        if len(self._chi2) == 0:
+            return False
+        return result.chi2 > self.divergence_factor * float(np.median(self._chi2))
+
+    def update(self, result: FrameFitResult):
+        if result.status is not FitStatus.SUCCESS:
+            return
+        self._params.append(np.array(result.params, dtype=np.float64))
+        self._chi2.append(result.chi2)
+        self._params = self._params[-self.history:]
+        self._chi2 = self._chi2[-self.history:]
+
+    def estimate_time_saved(self, result: FrameFitResult) -> float:
+        # それまでに通常の初期値から始めたフレームの平均時間との差
+        if (not result.warm_started) or (len(self._cold_elapsed) == 0):
+            return np.nan
+        return float(np.mean(self._cold_elapsed)) - result.elapsed
+
+    def fit(self, model: CompiledModel, raveled_expl: np.ndarray, raveled_data: np.ndarray) -> FrameFitResult:
+        bounds = (self.lower, self.upper)
+        p0, is_warm = self.seed()
+        result = fit_frame(model, raveled_expl, raveled_data, p0, bounds)
+        result.warm_started = is_warm
+
+        if is_warm and self.is_diverged(result):
+            # 発散したとみなし、通常の初期値からやり直す。評価回数と時間は合算する
+            cold = fit_frame(model, raveled_expl, raveled_data, self.initial, bounds)
+            cold.nfev += result.nfev
+            cold.njev += result.njev
+            cold.elapsed += result.elapsed
+            # ウォームスタートで失った時間
+            cold.time_saved = -result.elapsed
+            result = cold
+        elif not is_warm:
+            if result.status is FitStatus.SUCCESS:
+                self._cold_elapsed.append(result.elapsed)
+        else:
+            result.time_saved = self.estimate_time_saved(result)
+
+        self.update(result)
+        return result
+
+
+def fit_frames_warm(model: CompiledModel,
+                    raveled_expl: np.ndarray,
+                    frames: np.ndarray,
+                    warm_starter: WarmStarter) -> BatchFitResult:
+    result = BatchFitResult.empty(len(frames), model.get_free_num())
+    for index, frame in enumerate(frames):
+        result.set_frame(index, warm_starter.fit(model, raveled_expl, frame.ravel()))
+    return result
+